@@ -1,17 +1,22 @@
 import logging
-from fastapi import FastAPI, Request
+import time
+from fastapi import FastAPI
 
-from config import CURATE_URL, LOG_DIRECTORY
+from config import CURATE_URL
 from db.models.atom_model import init_db as init_atom_db
 from db.models.preservation_model import init_db as init_preservation_db
+from db.models.job_model import init_db as init_job_db
+from db.models.metrics_model import init_db as init_metrics_db
+from db.models.aip_model import init_db as init_aip_db
 from api.routes.preservation_routes import router as preservation_router
-from api.routes.atom_routes import router as atom_router
+from api.routes.atom_routes import router as atom_router, close_atom_client
+from api.routes.job_routes import router as job_router
+from api.routes.metrics_routes import router as metrics_router
+from api.routes.aip_routes import router as aip_router
+from api.routes.worker_routes import router as worker_router
+from preservation import logs, metrics
 
-logger = logging.getLogger("preservation_api")
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler(f'{LOG_DIRECTORY}/preservation_api.log')
-file_handler.setFormatter(logging.Formatter("%(asctime)s %(filename)s:%(lineno)d %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
-logger.addHandler(file_handler)
+logger = logs.configure("preservation_api", 'preservation_api.log', logging.DEBUG)
 
 description = """
 ## Preservation Configs
@@ -25,6 +30,30 @@ description = """
 
 * **Get config** (`GET /atom`).
 * **Add / Update config** (`POST /atom`).
+* **Search descriptions** (`GET /atom/search`). Responses are cached in memory.
+* **Search cache statistics** (`GET /atom/search/cache`).
+
+## Preservation Jobs
+
+* **Submit jobs** (`POST /jobs?config_id=&user=`). The body is NDJSON, one Curate node per line.
+* **List jobs** (`GET /jobs`). Filter by status, user, config and creation time; page with `cursor`.
+* **Job summary** (`GET /jobs/summary`). Backlog by status and recent throughput.
+* **Get job** (`GET /jobs/{id}`). Includes per-stage timings.
+* **Get job profile** (`GET /jobs/{id}/profile`). Hottest functions and allocations per stage, for jobs submitted with `profile=true`.
+
+## AIPs
+
+* **Search AIP files** (`GET /aips/files`). Find files by name, checksum, PUID, AIP or Curate node; page with `cursor`.
+* **Format summary** (`GET /aips/formats`). Files and bytes preserved by PUID.
+* **Get AIP** (`GET /aips/{uuid}`). Files and bytes of an AIP by METS file group.
+
+## Metrics
+
+* **Prometheus metrics** (`GET /metrics`). Stage timings, transfer volumes and Curate/AtoM call latencies from every worker.
+
+## Workers
+
+* **Worker call** (`POST /workers/{target}/{method}`). Job queue, fingerprint and AIP index calls of workers on other hosts, authenticated with `WORKER_API_TOKEN`.
 
 ## Authentication
 You will need to authenticate with a valid token. The token is passed in the `Authorization` header as `Bearer <token>`.
@@ -46,13 +75,53 @@ app = FastAPI(
 async def startup_event():
     init_atom_db()
     init_preservation_db()
+    init_job_db()
+    init_metrics_db()
+    init_aip_db()
     logger.info("App started")
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info("Request made")
-    response = await call_next(request)
-    return response
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_atom_client()
+    logger.info("App stopped")
+
+class RequestLogMiddleware:
+    """
+    Records the duration and status of every request once its response starts.
+    A plain ASGI middleware, as @app.middleware would cut off the body of a request
+    whose response streams while the body is still being sent.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+
+        async def send_logged(message):
+            if message['type'] == 'http.response.start':
+                duration = time.perf_counter() - start
+                status = message['status']
+                route = scope.get('route')
+                route_path = route.path if route else 'unmatched'
+                metrics.observe(
+                    'preservation_api_request_duration_seconds',
+                    duration,
+                    {'method': scope['method'], 'route': route_path, 'status': status},
+                    metrics.LATENCY_BUCKETS
+                )
+                # Queued for the log writer thread, the event loop never waits on the disk
+                logger.info(
+                    "%s %s %s in %.3fs", scope['method'], scope['path'], status, duration,
+                    extra={'method': scope['method'], 'route': route_path, 'status': status, 'duration_seconds': round(duration, 6)}
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_logged)
+
+app.add_middleware(RequestLogMiddleware)
 
 @app.get("/", tags=["Default"])
 async def root():
@@ -61,6 +130,10 @@ async def root():
 try:
     app.include_router(preservation_router, prefix="/preservation", tags=["Preservation"])
     app.include_router(atom_router, prefix="/atom", tags=["AtoM"])
+    app.include_router(job_router, prefix="/jobs", tags=["Jobs"])
+    app.include_router(aip_router, prefix="/aips", tags=["AIPs"])
+    app.include_router(metrics_router, tags=["Metrics"])
+    app.include_router(worker_router, prefix="/workers", tags=["Workers"])
 except Exception as e:
     logger.error(e)
     raise
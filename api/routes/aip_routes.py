@@ -0,0 +1,54 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from db.models.aip_model import AIPModel
+from db.schemas.aip_schema import AIPFileListSchema, AIPFormatSchema, AIPSchema
+import logging
+
+logger = logging.getLogger("preservation_api")
+
+router = APIRouter()
+
+@router.get("/files", response_model=AIPFileListSchema)
+async def list_aip_files(
+    aip_uuid: Optional[str] = None,
+    node_uuid: Optional[str] = Query(None, description="Files preserved from this Curate node"),
+    name: Optional[str] = Query(None, description="Exact file name, without its directory"),
+    checksum: Optional[str] = None,
+    puid: Optional[str] = Query(None, description="PRONOM identifier, e.g. fmt/353"),
+    use: Optional[str] = Query(None, description="METS file group, e.g. original or preservation"),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    logger.info("Searching AIP files")
+    try:
+        files = await run_in_threadpool(AIPModel.list_files_from_db, aip_uuid, node_uuid, name, checksum, puid, use, cursor, limit)
+        next_cursor = files[-1]['id'] if len(files) == limit else None
+        return {'files': files, 'next_cursor': next_cursor}
+    except Exception as e:
+        logger.error(f"AIPs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+@router.get("/formats", response_model=list[AIPFormatSchema])
+async def get_aip_formats(aip_uuid: Optional[str] = None):
+    """
+    Counts preserved files and bytes by PUID, across every AIP or in one.
+    """
+    logger.info("Getting AIP formats")
+    try:
+        return await run_in_threadpool(AIPModel.get_formats_from_db, aip_uuid)
+    except Exception as e:
+        logger.error(f"AIPs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+@router.get("/{aip_uuid}", response_model=AIPSchema)
+async def get_aip(aip_uuid: str):
+    logger.info(f"Getting AIP {aip_uuid}")
+    try:
+        aip = await run_in_threadpool(AIPModel.get_aip_from_db, aip_uuid)
+    except Exception as e:
+        logger.error(f"AIPs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    if not aip:
+        raise HTTPException(status_code=404, detail="AIP not indexed")
+    return aip
@@ -1,23 +1,70 @@
 import logging
-import requests
+import httpx
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from api.cache import TTLCache
+from config import ATOM_SEARCH_CACHE_SIZE, ATOM_SEARCH_CACHE_TTL_SECONDS, ATOM_HTTP_MAX_CONNECTIONS, ATOM_HTTP_TIMEOUT_SECONDS
 from db.models.atom_model import AtomConfigModel
 from db.schemas.atom_schema import AtomConfigSchema
+from preservation import metrics
 
 logger = logging.getLogger("preservation_api")
 
 router = APIRouter()
 
+search_cache = TTLCache(ATOM_SEARCH_CACHE_SIZE, ATOM_SEARCH_CACHE_TTL_SECONDS)
+# Read-through cache of the AtoM config, cleared by every write
+_atom_config_cache = {'config': None, 'generation': 0}
+_atom_client: httpx.AsyncClient = None
+
+async def get_cached_atom_config() -> dict:
+    """
+    Returns the AtoM config, reading the database only on first use or after invalidation.
+    """
+    if _atom_config_cache['config'] is not None:
+        return _atom_config_cache['config']
+    generation = _atom_config_cache['generation']
+    config = await run_in_threadpool(AtomConfigModel.get_config_from_db)
+    # Don't store a config that a write invalidated while it was loading
+    if generation == _atom_config_cache['generation']:
+        _atom_config_cache['config'] = config
+    return config
+
+def invalidate_atom_config():
+    _atom_config_cache.update(config=None, generation=_atom_config_cache['generation'] + 1)
+    # Cached results may belong to a different AtoM instance
+    search_cache.clear()
+
+def get_atom_client() -> httpx.AsyncClient:
+    """
+    Returns the shared AtoM HTTP client so connections are pooled across requests.
+    """
+    global _atom_client
+    if _atom_client is None:
+        _atom_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ATOM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=ATOM_HTTP_MAX_CONNECTIONS),
+            timeout=ATOM_HTTP_TIMEOUT_SECONDS
+        )
+    return _atom_client
+
+async def close_atom_client():
+    global _atom_client
+    if _atom_client is not None:
+        await _atom_client.aclose()
+        _atom_client = None
+
 @router.get("/", response_model=AtomConfigSchema)
 async def get_atom_config():
     logger.info("Getting AtoM config from database")
     try:
-        config = AtomConfigModel.get_config_from_db()
-        logger.info(config)
+        config = await get_cached_atom_config()
         if not config:
             raise HTTPException(status_code=404, detail="Atom config not found")
+        config = dict(config)
         config.pop('id')
         return config
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Exception: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
@@ -26,41 +73,57 @@ async def get_atom_config():
 async def set_atom_config(config: AtomConfigSchema):
     try:
         data = config.dict()
-        logger.info(f"Updating AtoM config in database with data: {data}")
-        if AtomConfigModel.get_config_from_db():
-            AtomConfigModel.update_config_in_db(data)
+        logger.info(f"Updating AtoM config in database for {data['atom_url']}")
+        if await run_in_threadpool(AtomConfigModel.get_config_from_db):
+            await run_in_threadpool(AtomConfigModel.update_config_in_db, data)
+            invalidate_atom_config()
             logger.debug("Updated current AtoM config")
             return {"message": "Atom config updated successfully"}
         else:
-            AtomConfigModel.add_new_config_to_db(data)
+            await run_in_threadpool(AtomConfigModel.add_new_config_to_db, data)
+            invalidate_atom_config()
             logger.debug("Added new AtoM config")
             return {"message": "Atom config added successfully"}
     except Exception as e:
         logger.error(f"Exception: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+@router.get("/search/cache")
+async def get_search_cache_stats():
+    return search_cache.stats()
+
 @router.get("/search")
 async def search_atom(request: Request):
     try:
         query_string = request.url.query
         logger.info(f"Searching AtoM with parameters: {query_string}")
-        atom_config = AtomConfigModel.get_config_from_db()
+
+        cached = search_cache.get(query_string)
+        metrics.inc('preservation_atom_search_cache_total', labels={'result': 'miss' if cached is None else 'hit'})
+        if cached is not None:
+            logger.debug("AtoM search served from cache")
+            return cached
+
+        generation = _atom_config_cache['generation']
+        atom_config = await get_cached_atom_config()
         
         if not atom_config:
             raise HTTPException(status_code=404, detail="No AtoM config found")
         
-        logger.debug(f"AtoM config: {atom_config}")
-        
         config = AtomConfigSchema(**atom_config)
         
         atom_api_url = f"{config.atom_url}/api/informationobjects?{query_string}"
         headers = {'REST-API-Key': config.atom_api_key}
 
-        response = requests.get(atom_api_url, headers=headers)
-
-        response.raise_for_status()
+        with metrics.timed('preservation_http_request', {'service': 'atom', 'endpoint': 'api/informationobjects'}):
+            response = await get_atom_client().get(atom_api_url, headers=headers)
+            response.raise_for_status()
 
-        return response.json()
+        results = response.json()
+        # Results of an AtoM instance the config no longer points at would outlive the clear
+        if generation == _atom_config_cache['generation']:
+            search_cache.set(query_string, results)
+        return results
 
     except Exception as e:
         logger.error(f"Exception: {e}")
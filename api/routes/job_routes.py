@@ -0,0 +1,271 @@
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from config import CURATE_URL, JOB_SUBMIT_MAX_LINE_BYTES
+from db.models.job_model import JobModel
+from db.models.preservation_model import PreservationConfigModel
+from db.schemas.job_schema import (
+    CurateNodeSchema, JobCancelSchema, JobDetailSchema, JobEstimateSchema, JobListSchema, JobPriority, JobQueueSchema, JobStatus, JobSubmissionSchema, JobSummarySchema
+)
+from preservation.curate import CurateManager
+from preservation.submission import Submission
+import logging
+
+logger = logging.getLogger("preservation_api")
+
+router = APIRouter()
+
+def _db_timestamp(value: datetime) -> str:
+    # Matches sqlite CURRENT_TIMESTAMP, which is UTC
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+@router.get("/", response_model=JobListSchema)
+async def list_jobs(
+    status: Optional[JobStatus] = None,
+    user: Optional[str] = None,
+    config_id: Optional[int] = None,
+    split_group: Optional[str] = Query(None, description="Only the jobs of one split directory"),
+    since: Optional[datetime] = Query(None, description="Only jobs created at or after this UTC time"),
+    until: Optional[datetime] = Query(None, description="Only jobs created before this UTC time"),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    logger.info("Listing preservation jobs")
+    try:
+        jobs = await run_in_threadpool(
+            JobModel.list_jobs_from_db, status, user, config_id, split_group,
+            _db_timestamp(since), _db_timestamp(until), cursor, limit
+        )
+        next_cursor = jobs[-1]['id'] if len(jobs) == limit else None
+        return {'jobs': jobs, 'next_cursor': next_cursor}
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+def _parse_node_lines(lines: list, first_line_number: int, errors: list) -> list:
+    """
+    Parses NDJSON lines into Curate nodes, recording invalid lines in errors.
+    """
+    nodes = []
+    for line_number, line in enumerate(lines, start=first_line_number):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            nodes.append(CurateNodeSchema(**json.loads(line)).model_dump())
+        except (ValueError, TypeError, ValidationError) as e:
+            errors.append({'line': line_number, 'error': str(e)})
+    return nodes
+
+def _check_line_lengths(lines: list, first_line_number: int):
+    """
+    Rejects a submission with a line longer than JOB_SUBMIT_MAX_LINE_BYTES, which can't be a Curate node.
+    """
+    for line_number, line in enumerate(lines, start=first_line_number):
+        if len(line) > JOB_SUBMIT_MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Line {line_number} is longer than {JOB_SUBMIT_MAX_LINE_BYTES} bytes")
+
+async def _queue_body(request: Request, submission: Submission, errors: list):
+    """
+    Queues the Curate nodes of an NDJSON body as it streams in.
+    Yields the (job ID, node) of the jobs queued after each chunk.
+    """
+    buffer = bytearray()
+    line_number = 1
+    async for chunk in request.stream():
+        # Lines end in the new chunk, so only it is searched and the partial line is the only copy carried over
+        searched = len(buffer)
+        buffer += chunk
+        end = buffer.rfind(b'\n', searched)
+        if end == -1:
+            _check_line_lengths([buffer], line_number)
+            continue
+        lines = bytes(buffer[:end]).split(b'\n')
+        del buffer[:end + 1]
+        _check_line_lengths(lines + [buffer], line_number)
+        nodes = _parse_node_lines(lines, line_number, errors)
+        line_number += len(lines)
+        if nodes:
+            yield await run_in_threadpool(submission.add, nodes)
+    nodes = _parse_node_lines([bytes(buffer)], line_number, errors)
+    if nodes:
+        yield await run_in_threadpool(submission.add, nodes)
+    yield await run_in_threadpool(submission.finish)
+
+class _DuplexResponse(StreamingResponse):
+    """
+    Streams a response while the request body is still being read, which StreamingResponse
+    can't, as it consumes the body's messages while it listens for a disconnect.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+async def _stream_submission(request: Request, submission: Submission):
+    errors = []
+    reported = 0
+    try:
+        async for queued in _queue_body(request, submission, errors):
+            for job_id, node in queued:
+                yield json.dumps({'job_id': job_id, 'Uuid': node['Uuid']}) + '\n'
+            for error in errors[reported:]:
+                yield json.dumps(error) + '\n'
+            reported = len(errors)
+    except HTTPException as e:
+        # The jobs of the lines before an overlong one stay queued
+        for job_id, node in await run_in_threadpool(submission.finish):
+            yield json.dumps({'job_id': job_id, 'Uuid': node['Uuid']}) + '\n'
+        yield json.dumps({'error': e.detail}) + '\n'
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        yield json.dumps({'error': f"Internal server error after queuing {len(submission.job_ids)} jobs: {e}"}) + '\n'
+        return
+    logger.info(f"Queued {len(submission.job_ids)} preservation jobs, skipped {len(errors)} invalid lines")
+
+@router.post(
+    "/",
+    status_code=202,
+    response_model=JobSubmissionSchema,
+    openapi_extra={"requestBody": {"required": True, "content": {"application/x-ndjson": {"schema": {"type": "string"}}}}}
+)
+async def submit_jobs(request: Request, config_id: int, user: str, profile: bool = False, force: bool = False,
+                      priority: Optional[JobPriority] = None):
+    """
+    Queues a preservation job for every Curate node in an NDJSON body.
+    Set profile to record CPU and allocation profiles of each job.
+    Set force to preserve nodes even if they are unchanged since their last AIP.
+    Without a priority, submissions of up to SCHEDULER_INTERACTIVE_MAX_NODES nodes are queued as high
+    and larger ones as normal.
+
+    Nodes are queued as the body streams in, so workers can start before the upload ends.
+    Invalid lines are skipped and reported in errors. A line longer than JOB_SUBMIT_MAX_LINE_BYTES
+    stops the submission with a 413, the jobs of the lines before it stay queued.
+
+    With Accept: application/x-ndjson the response streams a {"job_id", "Uuid"} line for each job
+    as it is queued, and a {"line", "error"} line for each invalid line, while the body is still
+    being sent. The client has to read it as it sends. A 413 or server error then ends the stream with an {"error"} line.
+    """
+    logger.info(f"Submitting preservation jobs for {user} with config ID: {config_id}")
+    if not await run_in_threadpool(PreservationConfigModel.get_config_from_db, config_id):
+        raise HTTPException(status_code=404, detail="Preservation config ID not found")
+    submission = Submission(user, config_id, profile, force, priority)
+    if 'application/x-ndjson' in request.headers.get('accept', ''):
+        return _DuplexResponse(_stream_submission(request, submission), status_code=202, media_type='application/x-ndjson')
+    errors = []
+    try:
+        async for _ in _queue_body(request, submission, errors):
+            pass
+    except HTTPException as e:
+        # The jobs of the lines before an overlong one stay queued
+        await run_in_threadpool(submission.finish)
+        raise HTTPException(status_code=e.status_code, detail=f"{e.detail}, after queuing {len(submission.job_ids)} jobs")
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error after queuing {len(submission.job_ids)} jobs: {e}")
+    logger.info(f"Queued {len(submission.job_ids)} preservation jobs, skipped {len(errors)} invalid lines")
+    return {'jobs': submission.job_ids, 'errors': errors}
+
+@router.get("/summary", response_model=JobSummarySchema)
+async def get_jobs_summary(hours: int = Query(24, ge=1, le=24 * 30)):
+    logger.info("Getting preservation job summary")
+    try:
+        since = _db_timestamp(datetime.utcnow() - timedelta(hours=hours))
+        summary = await run_in_threadpool(JobModel.get_summary_from_db, since)
+        summary['since'] = since
+        return summary
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+@router.get("/{id}", response_model=JobDetailSchema)
+async def get_job(id: int):
+    logger.info(f"Getting preservation job with ID: {id}")
+    try:
+        job = await run_in_threadpool(JobModel.get_job_from_db, id)
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    if not job:
+        raise HTTPException(status_code=404, detail="Preservation job ID not found")
+    return job
+
+@router.get("/{id}/queue", response_model=JobQueueSchema)
+async def get_job_queue_estimate(id: int):
+    """
+    Returns the position of a queued job and when it is estimated to start, in UTC.
+    """
+    logger.info(f"Getting queue estimate of preservation job with ID: {id}")
+    try:
+        estimate = await run_in_threadpool(JobModel.get_queue_estimate_from_db, id)
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    if not estimate:
+        raise HTTPException(status_code=404, detail="No queued preservation job with this ID")
+    return estimate
+
+@router.get("/{id}/eta", response_model=JobEstimateSchema)
+async def get_job_eta(id: int):
+    """
+    Returns the predicted remaining time of each stage of a queued or running job and when it
+    is estimated to finish, in UTC. Stages without any recorded runs have no prediction.
+    """
+    logger.info(f"Getting remaining time of preservation job with ID: {id}")
+    try:
+        estimate = await run_in_threadpool(JobModel.get_remaining_estimate_from_db, id)
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    if not estimate:
+        raise HTTPException(status_code=404, detail="No queued or running preservation job with this ID")
+    return estimate
+
+def _tag_cancelled(node_uuids: list):
+    curate_manager = CurateManager('admin', CURATE_URL, configure_client=False)
+    for node_uuid in node_uuids:
+        try:
+            curate_manager.update_tag(node_uuid, 'Cancelled')
+        except Exception as e:
+            logger.error(f"Failed to tag cancelled node {node_uuid}: {e}")
+
+@router.post("/{id}/cancel", response_model=JobCancelSchema)
+async def cancel_job(id: int, background_tasks: BackgroundTasks):
+    """
+    Cancels a queued job, or asks the worker of a running job to stop it. A running job is
+    cancelled once its worker notices, within JOB_CANCEL_POLL_SECONDS, and kills its
+    downloads, a3m client and compression. Cancelling a split directory cancels its unfinished parts.
+    Queued nodes are tagged in Curate after the response, so a slow or unavailable Curate doesn't hold it up.
+    """
+    logger.info(f"Cancelling preservation job with ID: {id}")
+    try:
+        result = await run_in_threadpool(JobModel.cancel_job_in_db, id)
+    except Exception as e:
+        logger.error(f"Jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Preservation job ID not found")
+    if not result['cancelled'] and not result['stopping']:
+        raise HTTPException(status_code=409, detail="Preservation job has already finished")
+    # Workers tag the nodes they stop, queued nodes are tagged here
+    background_tasks.add_task(_tag_cancelled, [job['node_uuid'] for job in result['cancelled']])
+    return {
+        'cancelled': [job['id'] for job in result['cancelled']],
+        'stopping': [job['id'] for job in result['stopping']],
+    }
+
+@router.get("/{id}/profile")
+async def get_job_profile(id: int):
+    """
+    Returns the profile summary of a job submitted with profiling enabled.
+    """
+    job = await run_in_threadpool(JobModel.get_job_from_db, id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Preservation job ID not found")
+    summary_path = Path(job['profile_path']) / 'summary.json' if job['profile_path'] else None
+    if not summary_path or not summary_path.exists():
+        raise HTTPException(status_code=404, detail="No profile recorded for this job")
+    return await run_in_threadpool(lambda: json.loads(summary_path.read_text()))
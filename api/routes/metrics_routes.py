@@ -0,0 +1,69 @@
+import os
+import time
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from db.models.metrics_model import MetricsModel
+from preservation import metrics
+from preservation.scratch import volumes
+import logging
+
+logger = logging.getLogger("preservation_api")
+
+router = APIRouter()
+
+# Walking the scratch volumes is too slow to repeat on every scrape
+DIRECTORY_SIZE_TTL_SECONDS = 30
+_directory_size = {'bytes': {}, 'checked': 0.0}
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # Removed by a finishing job while we walked
+                continue
+    return total
+
+async def get_processing_directory_sizes() -> dict:
+    """
+    Returns the bytes in processing directories on each scratch volume.
+    """
+    if time.monotonic() - _directory_size['checked'] > DIRECTORY_SIZE_TTL_SECONDS:
+        _directory_size['bytes'] = {str(volume): await run_in_threadpool(directory_size, volume) for volume in volumes()}
+        _directory_size['checked'] = time.monotonic()
+    return _directory_size['bytes']
+
+def gauge(family: str, value: float, labels: dict = None) -> tuple:
+    return (family, 'gauge', family, metrics.format_labels(labels), value)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus metrics for the API and, through the shared store, every preservation worker.
+    """
+    samples = {}
+    # Workers and the API can report the same series, so add them up, the API's own gauges are the newest
+    stored = await run_in_threadpool(MetricsModel.get_all_metrics_from_db)
+    for family, kind, name, labels, value in stored + metrics.registry.samples():
+        key = (name, labels)
+        if key in samples and kind != 'gauge':
+            samples[key] = (family, kind, name, labels, samples[key][4] + value)
+        else:
+            samples[key] = (family, kind, name, labels, value)
+
+    gauges = await run_in_threadpool(MetricsModel.get_job_gauges_from_db)
+    extra = [gauge('preservation_jobs', count, {'status': status}) for status, count in gauges['statuses'].items()]
+    extra += [gauge('preservation_jobs_running', count, {'stage': stage}) for stage, count in gauges['stages'].items()]
+    extra.append(gauge('preservation_jobs_queued', gauges['statuses'].get('queued', 0)))
+    extra.append(gauge('preservation_inflight_transfers', gauges['stages'].get('transfer', 0)))
+    extra += [gauge('preservation_dip_queue_depth', count, {'status': status}) for status, count in gauges['dip_queue'].items()]
+    sizes = await get_processing_directory_sizes()
+    extra += [gauge('preservation_processing_directory_bytes', size, {'volume': volume}) for volume, size in sizes.items()]
+
+    return PlainTextResponse(
+        metrics.render_samples(list(samples.values()) + extra),
+        media_type="text/plain; version=0.0.4"
+    )
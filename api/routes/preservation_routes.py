@@ -1,4 +1,7 @@
-from fastapi import APIRouter, HTTPException
+import hashlib
+import json
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from db.models.preservation_model import PreservationConfigModel
 from db.schemas.preservation_schema import PreservationConfigSchema
 import logging
@@ -7,12 +10,43 @@ logger = logging.getLogger("preservation_api")
 
 router = APIRouter()
 
+# Read-through cache of GET /preservation, cleared by every write
+_configs_cache = {'configs': None, 'etag': None, 'generation': 0}
+
+async def get_cached_configs() -> tuple:
+    """
+    Returns all preservation configs and their ETag, loading from the database on a miss.
+    """
+    if _configs_cache['configs'] is not None:
+        return _configs_cache['configs'], _configs_cache['etag']
+    generation = _configs_cache['generation']
+    configs = await run_in_threadpool(PreservationConfigModel.get_all_configs_from_db)
+    etag = '"' + hashlib.sha1(json.dumps(configs, sort_keys=True, default=str).encode()).hexdigest() + '"'
+    # Don't store a result that a write invalidated while it was loading
+    if generation == _configs_cache['generation']:
+        _configs_cache.update(configs=configs, etag=etag)
+    logger.debug(f"Loaded {len(configs)} preservation configs from database")
+    return configs, etag
+
+def invalidate_configs_cache():
+    _configs_cache.update(configs=None, etag=None, generation=_configs_cache['generation'] + 1)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
 @router.get("/", response_model=list[PreservationConfigSchema])
-async def get_all_preservation_configs():
-    logger.info("Getting all preservation configs from database")
+async def get_all_preservation_configs(request: Request, response: Response):
+    logger.info("Getting all preservation configs")
     try:
-        configs = PreservationConfigModel.get_all_configs_from_db()
-        logger.debug(f"Preservation configs: {configs}")
+        configs, etag = await get_cached_configs()
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
         return configs
     except Exception as e:
         logger.error(f"Preservation: {e}")
@@ -23,13 +57,14 @@ async def add_preservation_config_to_db(config: PreservationConfigSchema):
     logger.info("Adding / updating new preservation config to database")
     try:
         data = config.dict()
-        logger.debug(f"Received preservation data: {data}")
+        logger.debug("Received preservation data: %s", data)
 
         if 'id' in data and data['id']:
             logger.info(f"Updating preservation config with ID: {data['id']}")
-            logger.debug(f"Received data: {data}")
-            if PreservationConfigModel.get_config_from_db(data['id']):
-                PreservationConfigModel.update_config_in_db(data)
+            logger.debug("Received data: %s", data)
+            if await run_in_threadpool(PreservationConfigModel.get_config_from_db, data['id']):
+                await run_in_threadpool(PreservationConfigModel.update_config_in_db, data, data['id'])
+                invalidate_configs_cache()
                 logger.info("Preservation config updated successfully")
                 return {"message": "Preservation config updated successfully"}
             else:
@@ -37,10 +72,13 @@ async def add_preservation_config_to_db(config: PreservationConfigSchema):
                 raise HTTPException(status_code=404, detail="Preservation config ID not found")
         else:
             logger.info("Adding new preservation config")
-            logger.debug(f"Received data: {data}")
-            PreservationConfigModel.add_new_config_to_db(data)
+            logger.debug("Received data: %s", data)
+            await run_in_threadpool(PreservationConfigModel.add_new_config_to_db, data)
+            invalidate_configs_cache()
             logger.info("Preservation config added successfully")
             return {"message": "Preservation config added successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Preservation: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -53,13 +91,16 @@ async def update_preservation_config(id: int, config: PreservationConfigSchema):
     logger.info(f"Updating preservation config with ID: {id}")
     try:
         data = config.dict()
-        logger.info(f"Received data: {data}")
+        logger.debug("Received data: %s", data)
 
-        if PreservationConfigModel.get_config_from_db(id):
-            PreservationConfigModel.update_config_in_db(data, id)
+        if await run_in_threadpool(PreservationConfigModel.get_config_from_db, id):
+            await run_in_threadpool(PreservationConfigModel.update_config_in_db, data, id)
+            invalidate_configs_cache()
             return {"message": "Preservation config updated successfully"}
         else:
             raise HTTPException(status_code=404, detail="Preservation config ID not found")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Preservation: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
@@ -71,11 +112,14 @@ async def delete_preservation_config(id: int):
         raise HTTPException(status_code=403, detail="Can't delete default config")
     logger.info(f"Deleting preservation config with ID: {id}")
     try:
-        if PreservationConfigModel.get_config_from_db(id):
-            PreservationConfigModel.delete_config_from_db(id)
+        if await run_in_threadpool(PreservationConfigModel.get_config_from_db, id):
+            await run_in_threadpool(PreservationConfigModel.delete_config_from_db, id)
+            invalidate_configs_cache()
             return {"message": "Preservation config deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Preservation config ID not found")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Preservation: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
@@ -0,0 +1,53 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Body, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from config import WORKER_API_TOKEN
+from preservation.aip_index import AIPIndex
+from preservation.database import DatabaseManager, LeaseLost
+from preservation.fingerprints import FingerprintIndex
+from preservation.worker_api import METHODS
+import logging
+
+logger = logging.getLogger("preservation_api")
+
+router = APIRouter()
+
+TARGETS = {'jobs': DatabaseManager, 'fingerprints': FingerprintIndex, 'aips': AIPIndex}
+# Created on the first call, an API without workers on other hosts never needs them
+_targets = {}
+
+def get_target(name: str):
+    if name not in _targets:
+        _targets[name] = TARGETS[name]()
+    return _targets[name]
+
+@router.post("/{target}/{method}")
+async def call_worker_method(
+    target: str,
+    method: str,
+    call: dict = Body(..., description='{"args": [...], "kwargs": {...}} of the call'),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Runs a job queue, fingerprint or AIP index call for a worker on another host.
+    A write to a job whose lease the worker no longer holds returns 409.
+    """
+    if not WORKER_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Worker API disabled, set WORKER_API_TOKEN")
+    if not hmac.compare_digest((authorization or '').encode(), f'Bearer {WORKER_API_TOKEN}'.encode()):
+        raise HTTPException(status_code=403, detail="Invalid worker API token")
+    if method not in METHODS.get(target, ()):
+        raise HTTPException(status_code=404, detail=f"No worker method {target}/{method}")
+    # update_job takes its keyword names as column names
+    if not all(name.isidentifier() for name in call.get('kwargs', {})):
+        raise HTTPException(status_code=422, detail="Keyword argument names must be identifiers")
+    try:
+        function = getattr(await run_in_threadpool(get_target, target), method)
+        result = await run_in_threadpool(function, *call.get('args', []), **call.get('kwargs', {}))
+    except LeaseLost as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Worker call {target}/{method}: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    return {'result': result}
@@ -0,0 +1,97 @@
+import argparse
+import json
+import multiprocessing
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from simulation.benchmark import run_shape
+from simulation.environment import DEFAULT_LATENCIES
+from simulation.shapes import SHAPES
+
+MB = 1024 ** 2
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Curate Preservation Benchmark')
+    parser.add_argument('-s', '--shapes', help='Batch shapes to run', nargs='+', choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument('--scale', help='Multiplier on the number and size of nodes in each shape', type=float, default=1)
+    parser.add_argument('-w', '--workers', help='Preservation workers processing the queue', type=int, default=1)
+    parser.add_argument('-d', '--daemons', help='a3md daemons transfers are spread across', type=int, default=1)
+    parser.add_argument('-v', '--volumes', help='Scratch volumes processing directories are spread across', type=int, default=1)
+    parser.add_argument('--hosts', help='Hosts sharing the queue, each with its own workers, daemons and volumes', type=int, default=1)
+    parser.add_argument('--dip', help='Generate DIPs and deposit them in the fake AtoM', action='store_true')
+    parser.add_argument('--config', help='Preservation config column, e.g. batch_max_file_bytes=1048576', action='append', default=[])
+    parser.add_argument('--latency', help=f"Stand-in latency, one of {', '.join(DEFAULT_LATENCIES)}, e.g. a3m_overhead=30", action='append', default=[])
+    parser.add_argument('--timeout', help='Seconds to wait for each shape before giving up', type=float, default=None)
+    parser.add_argument('--root', help='Directory for the simulated environments, a temporary directory by default')
+    parser.add_argument('--keep', help='Keep the simulated environments for inspection', action='store_true')
+    parser.add_argument('--json', help='Write the full results to this file')
+    args = parser.parse_args()
+    return args
+
+def parse_pairs(pairs: list, parse_value) -> dict:
+    values = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        values[key] = parse_value(value)
+    return values
+
+def _run(queue, *args):
+    queue.put(run_shape(*args))
+
+def run_in_process(*args) -> dict:
+    # A process per shape so each starts from a clean environment and reports its own peak RSS
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def print_report(results: list):
+    print(f"{'shape':<16}{'nodes':>7}{'done':>7}{'failed':>8}{'seconds':>10}{'nodes/h':>10}{'MB/h':>10}{'disk MB':>10}{'RSS MB':>9}{'child MB':>10}")
+    for result in results:
+        print(
+            f"{result['shape']:<16}{result['nodes']:>7}{result['jobs'].get('completed', 0):>7}{result['jobs'].get('failed', 0):>8}"
+            f"{result['elapsed_seconds']:>10.1f}{result['nodes_per_hour']:>10.0f}{result['bytes_per_hour'] / MB:>10.0f}"
+            f"{result['peak_disk_bytes'] / MB:>10.0f}{result['peak_rss_bytes'] / MB:>9.0f}{result['peak_child_rss_bytes'] / MB:>10.0f}"
+            + (' (timed out)' if result['timed_out'] else '')
+        )
+    for result in results:
+        transfers = ', '.join(f"{name} {count}" for name, count in result['a3md_transfers'].items())
+        print(f"\n{result['shape']} transfers by a3md: {transfers}")
+        placed = ', '.join(f"{name} {count}" for name, count in result['volume_jobs'].items())
+        print(f"{result['shape']} jobs by scratch volume: {placed}")
+        print(f"{result['shape']} stages{'':<6}{'count':>7}{'mean s':>10}{'p95 s':>10}{'total s':>10}")
+        for stage, summary in result['stages'].items():
+            print(f"  {stage:<18}{summary['count']:>7}{summary['mean_seconds']:>10.2f}{summary['p95_seconds']:>10.2f}{summary['total_seconds']:>10.1f}")
+
+def main():
+    args = parse_arguments()
+    if not shutil.which('7z'):
+        sys.exit("7z is required, as it is for preservation itself")
+    latencies = parse_pairs(args.latency, float)
+    unknown = set(latencies) - set(DEFAULT_LATENCIES)
+    if unknown:
+        sys.exit(f"Unknown latencies: {', '.join(sorted(unknown))}")
+    config_fields = parse_pairs(args.config, lambda value: int(value) if value.isdigit() else value)
+    root = Path(args.root or tempfile.mkdtemp(prefix='curate-benchmark-'))
+    results = []
+    try:
+        for shape in args.shapes:
+            print(f"Running {shape}...", file=sys.stderr, flush=True)
+            results.append(run_in_process(
+                shape, root / shape, args.scale, args.workers, latencies, config_fields, args.dip, args.timeout, args.daemons, args.volumes, args.hosts
+            ))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == '__main__':
+    main()
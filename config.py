@@ -2,17 +2,120 @@
 # Both
 CURATE_URL = "https://www.curate.example.co.uk"
 LOG_DIRECTORY = "/var/cells/penwern/logs"
+# 'json' for one JSON object per line carrying the job and node IDs, or 'text'
+LOG_FORMAT = 'json'
+# Records waiting for the log writer thread before new ones are dropped
+LOG_QUEUE_SIZE = 10000
+# Share of DEBUG records kept, by logger and module name, e.g. {'preservation.a3m': 0.1, 'preservation_api': 0.01}
+# The longest matching name applies, records of names not listed are all kept
+LOG_DEBUG_SAMPLING = {}
+# Preservation database of the API and the workers on its host, None for data/preservation.db in this checkout
+# Must be on a local disk, SQLite's WAL mode doesn't work over network filesystems. On other worker hosts it only
+# holds that host's disk reservations, listing cache and DIP queue, their jobs go through WORKER_API_URL
+DATABASE_PATH = None
+# Preservation API of the host holding the database, e.g. "http://preservation:8000", for workers on other hosts. None on that host
+WORKER_API_URL = None
+# Shared secret of the API's worker endpoints, the same on every host. None disables the endpoints
+WORKER_API_TOKEN = None
 
 # Preservation Only
 CURATE_VERSION = "v1.0.1"
 A3M_DOCKER_IMAGE = "ghcr.io/artefactual-labs/a3m:v0.7.9"
+A3M_NETWORK = "a3m-network"
+# a3md containers on A3M_NETWORK that transfers are spread across, each listening on A3M_DAEMON_PORT
+A3M_DAEMONS = ["a3md"]
+A3M_DAEMON_PORT = 7000
 PROCESSING_DIRECTORY = '/tmp/curate/preservation'
+# Scratch volumes processing directories are spread across, by tier, e.g.
+# {'nvme': ['/mnt/nvme0/preservation', '/mnt/nvme1/preservation'], 'bulk': ['/mnt/bulk/preservation']}
+# Every volume must be mounted into every a3md at the same path, see start_a3md_container.sh
+PROCESSING_VOLUMES = {'default': [PROCESSING_DIRECTORY]}
+# Tier of PROCESSING_VOLUMES each part of a job is placed on: 'download' holds the download and the
+# transfer a3m reads, 'extract' the AIP moved out of a3md, its extraction, compressed copy and DIP
+PROCESSING_STAGE_TIERS = {'download': 'default', 'extract': 'default'}
+# Seconds the I/O load of the scratch volumes is sampled for when a job is placed, 0 to ignore it
+PROCESSING_IO_SAMPLE_SECONDS = 0.5
+TRACING_ENABLED = True
+TRACE_DIRECTORY = '/var/cells/penwern/logs/traces'
+PROFILE_DIRECTORY = '/var/cells/penwern/logs/profiles'
+# Disk space kept free on each scratch volume, and the margin applied to each node's estimate
+ADMISSION_HEADROOM_BYTES = 5 * 1024 ** 3
+ADMISSION_SAFETY_MARGIN = 1.2
+ADMISSION_POLL_SECONDS = 30
+# Seconds between measurements of a running node's directories, which its peak disk usage is taken from
+ADMISSION_SAMPLE_SECONDS = 10
 WORKSPACE_MAPPING = {
     'appraisal': 'appraisal',
     'archive': 'archive',
     'personal': 'personal-files',
     'pydiods1': 'common-files',
     'quarantine': 'quarantine',
-} 
+}
+
+# DIP Queue
+DIP_QUEUE_DIRECTORY = '/tmp/curate/dip_queue'
+DIP_QUEUE_WORKERS = 2
+DIP_MAX_ATTEMPTS = 5
+DIP_RETRY_BACKOFF_SECONDS = 60
+DIP_RETRY_BACKOFF_MAX_SECONDS = 3600
+
+# Leases
+# Claimed jobs are held for JOB_LEASE_SECONDS and renewed every JOB_HEARTBEAT_SECONDS while they run
+JOB_LEASE_SECONDS = 300
+JOB_HEARTBEAT_SECONDS = 60
+# Claims of a job whose worker keeps disappearing before it is failed
+JOB_MAX_ATTEMPTS = 3
+# Seconds between checks of a worker's running jobs for cancel requests
+JOB_CANCEL_POLL_SECONDS = 5
+# Longest NDJSON line accepted by POST /jobs, a Curate node is a few KB
+JOB_SUBMIT_MAX_LINE_BYTES = 1024 * 1024
+
+# Scheduler
+# Queued jobs older than this are claimed first whatever their priority or user
+SCHEDULER_MAX_WAIT_SECONDS = 12 * 3600
+# Submissions of up to this many nodes without a priority are treated as interactive and queued as high
+SCHEDULER_INTERACTIVE_MAX_NODES = 10
+# How often, and for how many jobs at the front of the queue, Curate tags show queue position
+SCHEDULER_TAG_INTERVAL_SECONDS = 300
+SCHEDULER_TAG_MAX_JOBS = 100
+
+# Listing Cache
+# Child listings of folders are reused while the folder's ETag and modification time are unchanged
+LISTING_CACHE_ENABLED = True
+# Listings older than this are fetched again whatever their folder's markers say
+LISTING_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
+# Nodes whose metadata is refreshed per user-meta/search request
+LISTING_CACHE_META_BATCH = 500
+
+# Resilience
+# Curate and AtoM requests that take longer than this are failed and retried
+HTTP_TIMEOUT_SECONDS = 120
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY_SECONDS = 1
+RETRY_MAX_DELAY_SECONDS = 30
+# Retries allowed per endpoint, as a share of its calls plus a steady allowance
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_PER_SECOND = 0.1
+# Consecutive failures that open a service's circuit, and how long it stays open before a probe
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+# How long a call in progress waits for an open circuit before failing
+BREAKER_MAX_WAIT_SECONDS = 900
+
+# Reaper
+REAPER_INTERVAL_SECONDS = 900
+# Leftovers with no job, and a3md output never collected
+REAPER_ORPHAN_AGE_SECONDS = 6 * 3600
+# Failed runs are kept for inspection
+REAPER_FAILED_RETENTION_SECONDS = 24 * 3600
+# Running jobs without a live reservation, whose worker died mid-run
+REAPER_STALE_RUNNING_SECONDS = 48 * 3600
+# Retention used while free space is below REAPER_PRESSURE_FREE_RATIO of any scratch volume
+REAPER_MIN_AGE_SECONDS = 3600
+REAPER_PRESSURE_FREE_RATIO = 0.1
 
 # API Only
+ATOM_SEARCH_CACHE_SIZE = 1024
+ATOM_SEARCH_CACHE_TTL_SECONDS = 60
+ATOM_HTTP_MAX_CONNECTIONS = 20
+ATOM_HTTP_TIMEOUT_SECONDS = 10
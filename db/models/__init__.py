@@ -1,7 +1,39 @@
 import os
 import sqlite3
+import threading
+
+from config import DATABASE_PATH
+
+DB_PATH = DATABASE_PATH or os.path.join(os.path.dirname(__file__), '../../data/preservation.db')
+# Milliseconds a connection waits on a locked database before raising
+BUSY_TIMEOUT_MS = 5000
+
+_local = threading.local()
 
 def get_db_connection():
-    conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), '../../data/preservation.db'))
-    conn.row_factory = sqlite3.Row
+    """
+    Returns this thread's connection to the preservation database.
+
+    Connections are opened once per thread and reused, so handlers offloaded to
+    the threadpool don't pay for a new connection on every call.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        # WAL lets readers carry on while the workers write, but only between processes on this host
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        _local.conn = conn
     return conn
+
+def add_missing_columns(conn, table: str, columns: dict):
+    """
+    Adds columns introduced after a table was first created.
+    Expects a mapping of column name to column definition.
+    """
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
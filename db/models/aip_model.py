@@ -0,0 +1,87 @@
+from db.models import get_db_connection
+
+# Function to initialize the database schema
+def init_db():
+    with get_db_connection() as conn:
+        # One row per file in an AIP, read from its METS when the AIP is extracted
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS aip_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                aip_uuid TEXT NOT NULL,
+                job_id INTEGER,
+                node_uuid TEXT,
+                file_uuid TEXT,
+                path TEXT NOT NULL,
+                name TEXT NOT NULL,
+                original_name TEXT,
+                use TEXT,
+                size INTEGER,
+                checksum TEXT,
+                checksum_type TEXT,
+                puid TEXT,
+                format_name TEXT,
+                format_version TEXT,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+            );
+        """)
+        # Every lookup is paginated on id, which each index carries as the rowid
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_aip_files_aip ON aip_files (aip_uuid);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_aip_files_node ON aip_files (node_uuid) WHERE node_uuid IS NOT NULL;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_aip_files_name ON aip_files (name);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_aip_files_checksum ON aip_files (checksum) WHERE checksum IS NOT NULL;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_aip_files_puid ON aip_files (puid, size);")
+
+
+class AIPModel:
+    def list_files_from_db(aip_uuid: str = None, node_uuid: str = None, name: str = None, checksum: str = None,
+                           puid: str = None, use: str = None, before_id: int = None, limit: int = 100) -> list:
+        """
+        Lists indexed AIP files newest first using keyset pagination on id.
+        Pass the last id of a page as before_id to fetch the next page.
+        """
+        clauses, params = [], []
+        for column, value in (('aip_uuid', aip_uuid), ('node_uuid', node_uuid), ('name', name), ('checksum', checksum),
+                              ('puid', puid), ('use', use)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if before_id is not None:
+            clauses.append('id < ?')
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with get_db_connection() as conn:
+            cursor = conn.execute(f'SELECT * FROM aip_files {where} ORDER BY id DESC LIMIT ?', (*params, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_aip_from_db(aip_uuid: str) -> dict:
+        """
+        Summarises the files of one AIP by use. Returns None for an AIP that isn't indexed.
+        """
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT use, COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes, MIN(created) AS indexed, MAX(job_id) AS job_id
+                FROM aip_files WHERE aip_uuid = ? GROUP BY use ORDER BY use
+            ''', (aip_uuid,)).fetchall()
+        if not rows:
+            return None
+        return {
+            'aip_uuid': aip_uuid,
+            'job_id': rows[0]['job_id'],
+            'indexed': min(row['indexed'] for row in rows),
+            'files': sum(row['files'] for row in rows),
+            'bytes': sum(row['bytes'] for row in rows),
+            'uses': [{'use': row['use'], 'files': row['files'], 'bytes': row['bytes']} for row in rows],
+        }
+
+    def get_formats_from_db(aip_uuid: str = None) -> list:
+        """
+        Counts files and bytes by PUID, across every AIP or in one.
+        """
+        where, params = ('WHERE aip_uuid = ?', (aip_uuid,)) if aip_uuid else ('', ())
+        with get_db_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT puid, MAX(format_name) AS format_name, COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes,
+                       COUNT(DISTINCT aip_uuid) AS aips
+                FROM aip_files {where} GROUP BY puid ORDER BY files DESC
+            ''', params).fetchall()
+            return [dict(row) for row in rows]
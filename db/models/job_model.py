@@ -0,0 +1,413 @@
+import json
+from datetime import datetime, timedelta
+from db.models import get_db_connection, add_missing_columns
+
+JOB_STATUSES = ('queued', 'running', 'completed', 'skipped', 'failed', 'cancelled')
+# Higher priorities are claimed first
+JOB_PRIORITIES = {'low': 0, 'normal': 1, 'high': 2}
+# Recent runs used to estimate when queued jobs start
+ESTIMATE_RECENT_JOBS = 50
+# Stages in the order a job runs them
+STAGE_ORDER = ('package', 'gather', 'admission', 'download', 'prepare', 'transfer', 'extract', 'compress', 'upload', 'dip_handoff')
+# Recent completed runs of a stage its duration is predicted from, preferring runs with the same config
+ESTIMATE_STAGE_SAMPLES = 200
+ESTIMATE_MIN_SAMPLES = 5
+
+# Function to initialize the database schema
+def init_db():
+    with get_db_connection() as conn:
+        # One row per preserved node
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS preservation_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                node_uuid TEXT NOT NULL,
+                node_path TEXT NOT NULL,
+                user TEXT NOT NULL,
+                config_id INTEGER NOT NULL,
+                status TEXT DEFAULT 'queued' NOT NULL,
+                stage TEXT,
+                aip_uuid TEXT,
+                bytes_downloaded INTEGER,
+                bytes_uploaded INTEGER,
+                error TEXT,
+                created TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                started TIMESTAMP,
+                finished TIMESTAMP,
+                modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+            );
+        """)
+        add_missing_columns(conn, 'preservation_jobs', {
+            # Submitted Curate node, kept until the job completes
+            'node_json': 'TEXT',
+            'trace_path': 'TEXT',
+            'profile': 'INTEGER DEFAULT 0 NOT NULL',
+            'profile_path': 'TEXT',
+            # Curate node size, estimated and observed peak disk usage of the processing directory
+            'size_bytes': 'INTEGER',
+            'estimated_bytes': 'INTEGER',
+            'peak_bytes': 'INTEGER',
+            'processing_directory': 'TEXT',
+            'force': 'INTEGER DEFAULT 0 NOT NULL',
+            # Shared by a split directory and its part jobs
+            'split_group': 'TEXT',
+            'split_part': 'INTEGER',
+            'split_parts': 'INTEGER',
+            # Shared by small file jobs preserved as one transfer
+            'batch_id': 'TEXT',
+            'priority': f"INTEGER DEFAULT {JOB_PRIORITIES['normal']} NOT NULL",
+            # Worker holding a running job and the unix time its lease runs out
+            'lease_owner': 'TEXT',
+            'lease_expires': 'REAL',
+            'attempts': 'INTEGER DEFAULT 0 NOT NULL',
+            # Set on a running job to have its worker stop it
+            'cancel_requested': 'INTEGER DEFAULT 0 NOT NULL',
+            # Unix time before which a requeued job isn't claimed again
+            'not_before': 'REAL',
+        })
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_queue ON preservation_jobs (status, id) WHERE node_json IS NOT NULL;")
+        # Listing is paginated on id, which each index carries as the rowid, or on (created, id) within a created range
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_status ON preservation_jobs (status);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_user ON preservation_jobs (user, status);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_user_id ON preservation_jobs (user, id);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_created ON preservation_jobs (created);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_finished ON preservation_jobs (status, finished);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_config ON preservation_jobs (config_id);")
+        # Fair-share scheduling picks the head of each user's queue at each priority
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_schedule ON preservation_jobs (user, priority, id) WHERE status = 'queued' AND node_json IS NOT NULL;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_batch ON preservation_jobs (batch_id) WHERE batch_id IS NOT NULL;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_split ON preservation_jobs (split_group) WHERE split_group IS NOT NULL;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_lease ON preservation_jobs (lease_expires) WHERE status = 'running';")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_jobs_directory ON preservation_jobs (processing_directory) WHERE processing_directory IS NOT NULL;")
+
+        # One row per stage of a job
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS preservation_job_stages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL REFERENCES preservation_jobs(id) ON DELETE CASCADE,
+                stage TEXT NOT NULL,
+                started TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                finished TIMESTAMP,
+                duration REAL,
+                bytes INTEGER,
+                outcome TEXT
+            );
+        """)
+        add_missing_columns(conn, 'preservation_job_stages', {
+            # Package features the stage's duration is predicted from
+            'config_id': 'INTEGER',
+            'input_bytes': 'INTEGER',
+            'file_count': 'INTEGER',
+            'compression': 'TEXT',
+        })
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_job_stages_job ON preservation_job_stages (job_id);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_preservation_job_stages_samples ON preservation_job_stages (stage, config_id, id) WHERE outcome = 'completed';")
+        conn.commit()
+
+def queue_estimate(conn, job: dict) -> dict:
+    """
+    Estimates the position and start time of a queued job under fair-share scheduling:
+    every job of a higher priority runs first, then users with jobs of the same priority
+    take turns. The start time assumes recent run times and the current number of running jobs.
+    """
+    queued = "status = 'queued' AND node_json IS NOT NULL"
+    higher = conn.execute(
+        f"SELECT COUNT(*) FROM preservation_jobs WHERE {queued} AND priority > ?", (job['priority'],)
+    ).fetchone()[0]
+    turn = conn.execute(
+        f"SELECT COUNT(*) FROM preservation_jobs WHERE {queued} AND user = ? AND priority = ? AND id <= ?",
+        (job['user'], job['priority'], job['id'])
+    ).fetchone()[0]
+    others = conn.execute(f'''
+        SELECT COALESCE(SUM(MIN(queued, ?)), 0) FROM (
+            SELECT COUNT(*) AS queued FROM preservation_jobs
+            WHERE {queued} AND priority = ? AND user != ?
+            GROUP BY user
+        )
+    ''', (turn - 1, job['priority'], job['user'])).fetchone()[0]
+    position = higher + others + turn
+
+    average = conn.execute('''
+        SELECT AVG((julianday(finished) - julianday(started)) * 86400) FROM (
+            SELECT started, finished FROM preservation_jobs
+            WHERE status = 'completed' AND started IS NOT NULL AND finished IS NOT NULL
+            ORDER BY id DESC
+            LIMIT ?
+        )
+    ''', (ESTIMATE_RECENT_JOBS,)).fetchone()[0]
+    running = conn.execute("SELECT COUNT(*) FROM preservation_jobs WHERE status = 'running'").fetchone()[0]
+    estimated_start = None
+    if average is not None:
+        # Matches sqlite CURRENT_TIMESTAMP, which is UTC
+        start = datetime.utcnow() + timedelta(seconds=(position - 1) * average / max(running, 1))
+        estimated_start = start.strftime('%Y-%m-%d %H:%M:%S')
+    return {'id': job['id'], 'node_uuid': job['node_uuid'], 'position': position, 'estimated_start': estimated_start}
+
+def _solve(matrix: list, vector: list) -> list:
+    """
+    Solves a small linear system by Gaussian elimination. Returns None if it is singular.
+    """
+    size = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            return None
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(size):
+            if row != column:
+                factor = rows[row][column] / rows[column][column]
+                rows[row] = [value - factor * pivot_value for value, pivot_value in zip(rows[row], rows[column])]
+    return [rows[index][size] / rows[index][index] for index in range(size)]
+
+def _features(input_bytes: int, file_count: int) -> list:
+    # In MB so the coefficients are of a similar scale
+    return [1.0, (input_bytes or 0) / 1024 ** 2, float(file_count or 1)]
+
+def fit_stage(samples: list):
+    """
+    Fits seconds = overhead + per MB + per file to (input_bytes, file_count, duration) samples
+    by least squares. Returns a function of (input_bytes, file_count), or None without samples.
+    """
+    if not samples:
+        return None
+    mean = sum(duration for _, _, duration in samples) / len(samples)
+    xtx = [[0.0] * 3 for _ in range(3)]
+    xty = [0.0] * 3
+    for input_bytes, file_count, duration in samples:
+        x = _features(input_bytes, file_count)
+        for i in range(3):
+            xty[i] += x[i] * duration
+            for j in range(3):
+                xtx[i][j] += x[i] * x[j]
+    # A little ridge keeps stages whose packages are all the same size solvable
+    for i in range(1, 3):
+        xtx[i][i] += 1e-3 * len(samples)
+    coefficients = _solve(xtx, xty) if len(samples) >= 3 else None
+    if coefficients is None or any(coefficient < 0 for coefficient in coefficients[1:]):
+        return lambda input_bytes, file_count: mean
+    return lambda input_bytes, file_count: max(sum(c * x for c, x in zip(coefficients, _features(input_bytes, file_count))), 0.0)
+
+def _stage_samples(conn, stage: str, config_id: int, compression: str) -> list:
+    query = '''
+        SELECT input_bytes, file_count, duration FROM preservation_job_stages
+        WHERE stage = ? AND outcome = 'completed' AND duration IS NOT NULL {}
+        ORDER BY id DESC
+        LIMIT ?
+    '''
+    samples = conn.execute(
+        query.format('AND config_id = ? AND compression IS ?'), (stage, config_id, compression, ESTIMATE_STAGE_SAMPLES)
+    ).fetchall()
+    if len(samples) < ESTIMATE_MIN_SAMPLES:
+        samples = conn.execute(query.format(''), (stage, ESTIMATE_STAGE_SAMPLES)).fetchall()
+    return [tuple(sample) for sample in samples]
+
+def _job_stages(job: dict, config: dict) -> list:
+    """
+    Returns the stages a job runs, given its node and config.
+    """
+    node = json.loads(job['node_json']) if job['node_json'] else {}
+    skipped = set()
+    if node.get('Type') not in ('COLLECTION', 2) or job['split_part'] is not None:
+        skipped.add('gather')
+    if not (config and config['compress_aip']):
+        skipped.add('compress')
+    if not (config and config['dip_enabled']):
+        skipped.add('dip_handoff')
+    return [stage for stage in STAGE_ORDER if stage not in skipped]
+
+def remaining_estimate(conn, job: dict) -> dict:
+    """
+    Predicts the remaining seconds of each stage of a queued or running job, and its
+    finish, from the durations of recent runs of each stage against their package bytes and file count.
+    Jobs preserved in a batch are predicted as the whole batch, whose stages are recorded on its first job.
+    """
+    config = conn.execute('SELECT * FROM preservation_configs WHERE id = ?', (job['config_id'],)).fetchone()
+    compression = config['compression_algorithm'] if config else None
+    stage_job_id = job['id']
+    if job['batch_id']:
+        lead = conn.execute('''
+            SELECT job_id FROM preservation_job_stages
+            WHERE job_id IN (SELECT id FROM preservation_jobs WHERE batch_id = ?)
+            ORDER BY id LIMIT 1
+        ''', (job['batch_id'],)).fetchone()
+        stage_job_id = lead[0] if lead else job['id']
+    recorded = conn.execute('''
+        SELECT stage, finished, input_bytes, file_count, (julianday('now') - julianday(started)) * 86400 AS elapsed
+        FROM preservation_job_stages WHERE job_id = ? ORDER BY id
+    ''', (stage_job_id,)).fetchall() if job['status'] == 'running' else []
+    # The latest recorded features, the node's size until a stage has finished
+    input_bytes, file_count = job['size_bytes'], None
+    for stage in recorded:
+        if stage['input_bytes'] is not None:
+            input_bytes, file_count = stage['input_bytes'], stage['file_count']
+    finished = {stage['stage'] for stage in recorded if stage['finished'] is not None}
+    current = recorded[-1] if recorded and recorded[-1]['finished'] is None else None
+
+    stages = []
+    for name in _job_stages(job, config):
+        if name in finished:
+            continue
+        predict = fit_stage(_stage_samples(conn, name, job['config_id'], compression))
+        predicted = predict(input_bytes, file_count) if predict else None
+        elapsed = current['elapsed'] if current and current['stage'] == name else 0.0
+        remaining = None if predicted is None else max(predicted - elapsed, 0.0)
+        stages.append({'stage': name, 'predicted_seconds': predicted, 'elapsed_seconds': elapsed, 'remaining_seconds': remaining})
+
+    known = [stage['remaining_seconds'] for stage in stages if stage['remaining_seconds'] is not None]
+    remaining = sum(known) if known else None
+    estimated_finish = None
+    if remaining is not None:
+        # Matches sqlite CURRENT_TIMESTAMP, which is UTC
+        start = datetime.utcnow()
+        if job['status'] == 'queued':
+            estimated_start = queue_estimate(conn, job)['estimated_start']
+            start = datetime.strptime(estimated_start, '%Y-%m-%d %H:%M:%S') if estimated_start else start
+        estimated_finish = (start + timedelta(seconds=remaining)).strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'stage': current['stage'] if current else None,
+        'stages': stages,
+        'remaining_seconds': remaining,
+        'estimated_finish': estimated_finish,
+    }
+
+class JobModel:
+    def add_jobs_to_db(nodes: list, user: str, config_id: int, profile: bool = False, force: bool = False,
+                       priority: int = JOB_PRIORITIES['normal']) -> list:
+        """
+        Queues a job for each Curate node.
+        Returns the new job IDs in order.
+        """
+        job_ids = []
+        with get_db_connection() as conn:
+            for node in nodes:
+                cursor = conn.execute('''
+                    INSERT INTO preservation_jobs (node_uuid, node_path, user, config_id, node_json, profile, force, size_bytes, priority)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (node['Uuid'], node['Path'], user, config_id, json.dumps(node), int(profile), int(force), node.get('Size'), priority))
+                job_ids.append(cursor.lastrowid)
+            conn.commit()
+        return job_ids
+
+    def get_queue_estimate_from_db(id: int) -> dict:
+        """
+        Returns the queue position and estimated start of a queued job, or None if it isn't queued.
+        """
+        with get_db_connection() as conn:
+            job = conn.execute(
+                "SELECT * FROM preservation_jobs WHERE id = ? AND status = 'queued' AND node_json IS NOT NULL", (id,)
+            ).fetchone()
+            return queue_estimate(conn, job) if job else None
+
+    def cancel_job_in_db(id: int) -> dict:
+        """
+        Cancels a queued job at once and asks the worker of a running job to stop it.
+        Cancelling a split directory cancels its unfinished parts too.
+        Returns the jobs cancelled and those being stopped, as lists of dicts with their id and node_uuid,
+        or None if the job doesn't exist.
+        """
+        with get_db_connection() as conn:
+            # Held against workers claiming the jobs between reading and updating them
+            conn.execute("BEGIN IMMEDIATE")
+            job = conn.execute('SELECT id, split_group, split_part FROM preservation_jobs WHERE id = ?', (id,)).fetchone()
+            if not job:
+                return None
+            if job['split_group'] and job['split_part'] is None:
+                target, params = 'split_group = ?', (job['split_group'],)
+            else:
+                target, params = 'id = ?', (id,)
+            cancelled = [dict(row) for row in conn.execute(
+                f"SELECT id, node_uuid FROM preservation_jobs WHERE {target} AND status = 'queued'", params
+            ).fetchall()]
+            conn.execute(f'''
+                UPDATE preservation_jobs
+                SET status = 'cancelled', finished = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP
+                WHERE {target} AND status = 'queued'
+            ''', params)
+            stopping = [dict(row) for row in conn.execute(
+                f"SELECT id, node_uuid FROM preservation_jobs WHERE {target} AND status = 'running'", params
+            ).fetchall()]
+            conn.execute(f'''
+                UPDATE preservation_jobs SET cancel_requested = 1, modified = CURRENT_TIMESTAMP
+                WHERE {target} AND status = 'running'
+            ''', params)
+            conn.commit()
+            return {'cancelled': cancelled, 'stopping': stopping}
+
+    def get_remaining_estimate_from_db(id: int) -> dict:
+        """
+        Returns the predicted remaining time of a queued or running job, or None if it has finished.
+        """
+        with get_db_connection() as conn:
+            job = conn.execute(
+                "SELECT * FROM preservation_jobs WHERE id = ? AND status IN ('queued', 'running')", (id,)
+            ).fetchone()
+            return remaining_estimate(conn, job) if job else None
+
+    def get_job_from_db(id: int) -> dict:
+        with get_db_connection() as conn:
+            job = conn.execute('SELECT * FROM preservation_jobs WHERE id = ? LIMIT 1', (id,)).fetchone()
+            if not job:
+                return None
+            job = dict(job)
+            stages = conn.execute('SELECT * FROM preservation_job_stages WHERE job_id = ? ORDER BY id', (id,)).fetchall()
+            job['stages'] = [dict(stage) for stage in stages]
+            return job
+
+    def list_jobs_from_db(status: str = None, user: str = None, config_id: int = None, split_group: str = None,
+                          since: str = None, until: str = None, before_id: int = None, limit: int = 50) -> list:
+        """
+        Lists jobs newest first using keyset pagination on id.
+        Pass the last id of a page as before_id to fetch the next page.
+        """
+        clauses, params = [], []
+        for column, value in (('status', status), ('user', user), ('config_id', config_id), ('split_group', split_group)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        with get_db_connection() as conn:
+            # Within a created range pages follow the created index, which orders jobs as their ids do
+            created_range = since is not None or until is not None
+            if created_range and before_id is not None:
+                row = conn.execute('SELECT created FROM preservation_jobs WHERE id = ?', (before_id,)).fetchone()
+                if row is not None and (until is None or row[0] < until):
+                    # The page's last job bounds the index range instead of until
+                    clauses.append('created <= ? AND (created < ? OR id < ?)')
+                    params.extend((row[0], row[0], before_id))
+                    until = None
+                else:
+                    clauses.append('id < ?')
+                    params.append(before_id)
+            elif before_id is not None:
+                clauses.append('id < ?')
+                params.append(before_id)
+            if since is not None:
+                clauses.append('created >= ?')
+                params.append(since)
+            if until is not None:
+                clauses.append('created < ?')
+                params.append(until)
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+            order = 'created DESC, id DESC' if created_range else 'id DESC'
+            cursor = conn.execute(f'SELECT * FROM preservation_jobs {where} ORDER BY {order} LIMIT ?', (*params, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_summary_from_db(since: str) -> dict:
+        """
+        Counts jobs by status, and jobs finished since the given timestamp.
+        """
+        with get_db_connection() as conn:
+            counts = {status: 0 for status in JOB_STATUSES}
+            for row in conn.execute('SELECT status, COUNT(*) FROM preservation_jobs GROUP BY status'):
+                counts[row[0]] = row[1]
+            finished = {}
+            for status in ('completed', 'skipped', 'failed', 'cancelled'):
+                finished[status] = conn.execute(
+                    'SELECT COUNT(*) FROM preservation_jobs WHERE status = ? AND finished >= ?', (status, since)
+                ).fetchone()[0]
+            oldest_queued = conn.execute(
+                "SELECT created FROM preservation_jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            oldest_queued = oldest_queued[0] if oldest_queued else None
+            return {'counts': counts, 'finished_since': finished, 'oldest_queued': oldest_queued}
@@ -0,0 +1,43 @@
+from db.models import get_db_connection
+
+# Function to initialize the database schema
+def init_db():
+    with get_db_connection() as conn:
+        # Counters and histogram series added to by the preservation workers
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS metrics (
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL DEFAULT '',
+                family TEXT NOT NULL,
+                type TEXT NOT NULL,
+                value REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (name, labels)
+            ) WITHOUT ROWID;
+        """)
+        conn.commit()
+
+class MetricsModel:
+    def get_all_metrics_from_db() -> list:
+        """
+        Returns (family, type, name, labels, value) samples.
+        """
+        with get_db_connection() as conn:
+            cursor = conn.execute('SELECT family, type, name, labels, value FROM metrics')
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def get_job_gauges_from_db() -> dict:
+        """
+        Counts preservation jobs by status, running jobs by stage and DIPs waiting for AtoM.
+        """
+        with get_db_connection() as conn:
+            statuses = {row[0]: row[1] for row in conn.execute('SELECT status, COUNT(*) FROM preservation_jobs GROUP BY status')}
+            stages = {row[0]: row[1] for row in conn.execute(
+                "SELECT stage, COUNT(*) FROM preservation_jobs WHERE status = 'running' AND stage IS NOT NULL GROUP BY stage"
+            )}
+            dip_queue = {}
+            # Created by the first DIP hand-off
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dip_queue'").fetchone():
+                dip_queue = {row[0]: row[1] for row in conn.execute(
+                    "SELECT status, COUNT(*) FROM dip_queue WHERE status IN ('queued', 'uploading') GROUP BY status"
+                )}
+            return {'statuses': statuses, 'stages': stages, 'dip_queue': dip_queue}
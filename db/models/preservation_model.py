@@ -1,4 +1,4 @@
-from db.models import get_db_connection
+from db.models import get_db_connection, add_missing_columns
 
 # Function to initialize the database schema
 def init_db():
@@ -25,6 +25,16 @@ def init_db():
                 dip_enabled INTEGER DEFAULT 0
             );
         """)
+        add_missing_columns(conn, 'preservation_configs', {
+            # Split directory packages into parts of at most this many bytes or files, 0 to disable
+            'split_max_bytes': 'INTEGER DEFAULT 0 NOT NULL',
+            'split_max_files': 'INTEGER DEFAULT 0 NOT NULL',
+            # Preserve files up to this size together in one transfer, 0 to disable
+            'batch_max_file_bytes': 'INTEGER DEFAULT 0 NOT NULL',
+            'batch_max_nodes': 'INTEGER DEFAULT 100 NOT NULL',
+            # Jobs using the config that may run at once, 0 for no limit
+            'max_concurrent_jobs': 'INTEGER DEFAULT 0 NOT NULL',
+        })
 
         if not conn.execute("SELECT 1 FROM preservation_configs LIMIT 1;").fetchone():
             conn.execute("""
@@ -61,7 +71,7 @@ def init_db():
         conn.commit()
 
 class PreservationConfigModel:
-    def __init__(self, id: int, name: str, process_type: str, compress_aip: int, gen_transfer_struct_report: int, document_empty_directories: int, extract_packages: int, delete_packages_after_extraction: int, normalize: int, compression_level: int, compression_algorithm: str, image_normalization_tiff: int, description: str, user: str, dip_enabled: int):
+    def __init__(self, id: int, name: str, process_type: str, compress_aip: int, gen_transfer_struct_report: int, document_empty_directories: int, extract_packages: int, delete_packages_after_extraction: int, normalize: int, compression_level: int, compression_algorithm: str, image_normalization_tiff: int, description: str, user: str, dip_enabled: int, split_max_bytes: int, split_max_files: int, batch_max_file_bytes: int, batch_max_nodes: int, max_concurrent_jobs: int):
         self.id = id
         self.name = name
         self.process_type = process_type
@@ -77,6 +87,11 @@ class PreservationConfigModel:
         self.description = description
         self.user = user
         self.dip_enabled = dip_enabled
+        self.split_max_bytes = split_max_bytes
+        self.split_max_files = split_max_files
+        self.batch_max_file_bytes = batch_max_file_bytes
+        self.batch_max_nodes = batch_max_nodes
+        self.max_concurrent_jobs = max_concurrent_jobs
         
     def add_new_config_to_db(data: dict):
         with get_db_connection() as conn:
@@ -84,14 +99,18 @@ class PreservationConfigModel:
                 INSERT INTO preservation_configs (name, process_type, compress_aip, gen_transfer_struct_report,
                     document_empty_directories, extract_packages, delete_packages_after_extraction,
                     normalize, compression_level, compression_algorithm, image_normalization_tiff,
-                    description, user, dip_enabled)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    description, user, dip_enabled, split_max_bytes, split_max_files,
+                    batch_max_file_bytes, batch_max_nodes, max_concurrent_jobs)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (data['name'], data['process_type'], data.get('compress_aip', 0),
                 data.get('gen_transfer_struct_report', 0), data.get('document_empty_directories', 0),
                 data.get('extract_packages', 0), data.get('delete_packages_after_extraction', 0),
                 data.get('normalize', 0), data.get('compression_level', 1),
                 data.get('compression_algorithm', 's7_bzip2'), data.get('image_normalization_tiff', 0),
-                data.get('description', None), data['user'], data.get('dip_enabled', 0)))
+                data.get('description', None), data['user'], data.get('dip_enabled', 0),
+                data.get('split_max_bytes', 0), data.get('split_max_files', 0),
+                data.get('batch_max_file_bytes', 0), data.get('batch_max_nodes', 100),
+                data.get('max_concurrent_jobs', 0)))
             conn.commit()
 
     def update_config_in_db(data: dict, id: int):
@@ -101,14 +120,19 @@ class PreservationConfigModel:
                 SET name=?, process_type=?, compress_aip=?, gen_transfer_struct_report=?, 
                     document_empty_directories=?, extract_packages=?, delete_packages_after_extraction=?,
                     normalize=?, compression_level=?, compression_algorithm=?, image_normalization_tiff=?,
-                    modified=CURRENT_TIMESTAMP, description=?, user=?, dip_enabled=?
+                    modified=CURRENT_TIMESTAMP, description=?, user=?, dip_enabled=?,
+                    split_max_bytes=?, split_max_files=?, batch_max_file_bytes=?, batch_max_nodes=?,
+                    max_concurrent_jobs=?
                 WHERE id=?
             ''', (data['name'], data['process_type'], data.get('compress_aip', 0),
                 data.get('gen_transfer_struct_report', 0), data.get('document_empty_directories', 0),
                 data.get('extract_packages', 0), data.get('delete_packages_after_extraction', 0),
                 data.get('normalize', 0), data.get('compression_level', 1),
                 data.get('compression_algorithm', 's7_bzip2'), data.get('image_normalization_tiff', 0),
-                data.get('description', None), data['user'], data.get('dip_enabled', 0), id))
+                data.get('description', None), data['user'], data.get('dip_enabled', 0),
+                data.get('split_max_bytes', 0), data.get('split_max_files', 0),
+                data.get('batch_max_file_bytes', 0), data.get('batch_max_nodes', 100),
+                data.get('max_concurrent_jobs', 0), id))
             conn.commit()
 
     def get_config_from_db(id: int) -> dict:
@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class AIPFileSchema(BaseModel):
+    id: int
+    aip_uuid: str
+    job_id: Optional[int] = None
+    node_uuid: Optional[str] = None
+    file_uuid: Optional[str] = None
+    path: str
+    name: str
+    original_name: Optional[str] = None
+    use: Optional[str] = None
+    size: Optional[int] = None
+    checksum: Optional[str] = None
+    checksum_type: Optional[str] = None
+    puid: Optional[str] = None
+    format_name: Optional[str] = None
+    format_version: Optional[str] = None
+    created: str
+
+class AIPFileListSchema(BaseModel):
+    files: list[AIPFileSchema]
+    next_cursor: Optional[int] = None
+
+class AIPUseSchema(BaseModel):
+    use: Optional[str] = None
+    files: int
+    bytes: int
+
+class AIPSchema(BaseModel):
+    aip_uuid: str
+    job_id: Optional[int] = None
+    indexed: str
+    files: int
+    bytes: int
+    uses: list[AIPUseSchema]
+
+class AIPFormatSchema(BaseModel):
+    puid: Optional[str] = None
+    format_name: Optional[str] = None
+    files: int
+    bytes: int
+    aips: int
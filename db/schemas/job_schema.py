@@ -0,0 +1,99 @@
+from pydantic import BaseModel
+from typing import Literal, Optional, Union
+
+JobStatus = Literal['queued', 'running', 'completed', 'skipped', 'failed', 'cancelled']
+JobPriority = Literal['low', 'normal', 'high']
+
+class JobStageSchema(BaseModel):
+    stage: str
+    started: str
+    finished: Optional[str] = None
+    duration: Optional[float] = None
+    bytes: Optional[int] = None
+    outcome: Optional[str] = None
+
+class JobSchema(BaseModel):
+    id: int
+    node_uuid: str
+    node_path: str
+    user: str
+    config_id: int
+    status: JobStatus
+    stage: Optional[str] = None
+    aip_uuid: Optional[str] = None
+    bytes_downloaded: Optional[int] = None
+    bytes_uploaded: Optional[int] = None
+    error: Optional[str] = None
+    trace_path: Optional[str] = None
+    profile: bool = False
+    profile_path: Optional[str] = None
+    force: bool = False
+    priority: int
+    split_group: Optional[str] = None
+    split_part: Optional[int] = None
+    split_parts: Optional[int] = None
+    batch_id: Optional[str] = None
+    size_bytes: Optional[int] = None
+    estimated_bytes: Optional[int] = None
+    peak_bytes: Optional[int] = None
+    processing_directory: Optional[str] = None
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[float] = None
+    attempts: int = 0
+    cancel_requested: bool = False
+    created: str
+    started: Optional[str] = None
+    finished: Optional[str] = None
+    modified: str
+
+class JobDetailSchema(JobSchema):
+    stages: list[JobStageSchema] = []
+
+class JobListSchema(BaseModel):
+    jobs: list[JobSchema]
+    next_cursor: Optional[int] = None
+
+class JobQueueSchema(BaseModel):
+    id: int
+    node_uuid: str
+    position: int
+    estimated_start: Optional[str] = None
+
+class JobCancelSchema(BaseModel):
+    cancelled: list[int]
+    stopping: list[int]
+
+class JobStageEstimateSchema(BaseModel):
+    stage: str
+    predicted_seconds: Optional[float] = None
+    elapsed_seconds: float = 0
+    remaining_seconds: Optional[float] = None
+
+class JobEstimateSchema(BaseModel):
+    id: int
+    status: JobStatus
+    stage: Optional[str] = None
+    stages: list[JobStageEstimateSchema]
+    remaining_seconds: Optional[float] = None
+    estimated_finish: Optional[str] = None
+
+class JobSummarySchema(BaseModel):
+    counts: dict[str, int]
+    finished_since: dict[str, int]
+    since: str
+    oldest_queued: Optional[str] = None
+
+class CurateNodeSchema(BaseModel, extra='allow'):
+    Uuid: str
+    Path: str
+    Type: Union[str, int]
+    MetaStore: dict
+    Size: Optional[int] = None
+
+class JobSubmissionErrorSchema(BaseModel):
+    line: int
+    error: str
+
+class JobSubmissionSchema(BaseModel):
+    jobs: list[int]
+    errors: list[JobSubmissionErrorSchema] = []
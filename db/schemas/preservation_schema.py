@@ -17,9 +17,26 @@ class PreservationConfigSchema(BaseModel):
     description: str = ''
     user: str
     dip_enabled: Literal[0, 1] = 0
+    split_max_bytes: int = 0
+    split_max_files: int = 0
+    batch_max_file_bytes: int = 0
+    batch_max_nodes: int = 100
+    max_concurrent_jobs: int = 0
 
     @field_validator('compression_level')
     def check_compression_level(cls, value):
         if not (1 <= value <= 9):
             raise ValueError('compression_level must be between 1 and 9')
         return value
+
+    @field_validator('batch_max_nodes')
+    def check_batch_max_nodes(cls, value):
+        if value < 1:
+            raise ValueError('batch_max_nodes must be at least 1')
+        return value
+
+    @field_validator('split_max_bytes', 'split_max_files', 'batch_max_file_bytes', 'max_concurrent_jobs')
+    def check_split_limit(cls, value):
+        if value < 0:
+            raise ValueError('split, batch and concurrency limits must be 0 (disabled) or positive')
+        return value
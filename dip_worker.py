@@ -0,0 +1,28 @@
+import argparse
+import signal
+
+from config import DIP_QUEUE_WORKERS
+from preservation import logs, metrics
+from preservation.dip_queue import DIPWorker
+
+logger = logs.configure("preservation", 'preservation_dip.log')
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Curate DIP Worker')
+    parser.add_argument('-w', '--workers', help='Number of concurrent AtoM uploads', type=int, default=DIP_QUEUE_WORKERS)
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    metrics.start_flusher()
+    worker = DIPWorker(workers=args.workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+
+if __name__ == '__main__':
+    logger.info(' =============== DIP WORKER STARTED =============== ')
+    main()
+    logger.info(' =============== DIP WORKER STOPPED =============== \n')
@@ -0,0 +1,110 @@
+import argparse
+import json
+import multiprocessing
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from simulation.loadtest import MIXES, MODES, baseline_key, compare, run_mix
+
+MB = 1024 ** 2
+DEFAULT_BASELINES = Path(__file__).resolve().parent / 'data' / 'loadtest_baselines.json'
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Curate Preservation API Load Test')
+    parser.add_argument('-m', '--mixes', help='Request mixes to run', nargs='+', choices=list(MIXES), default=list(MIXES))
+    parser.add_argument('--mode', help='asgi calls the app in-process, uvicorn serves it over HTTP', choices=MODES, default='asgi')
+    parser.add_argument('-u', '--users', help='Concurrent virtual users', type=int, default=20)
+    parser.add_argument('-t', '--seconds', help='Seconds each mix is measured for, hours for a soak test', type=float, default=30)
+    parser.add_argument('--warmup', help='Seconds run before measuring', type=float, default=5)
+    parser.add_argument('--think', help='Mean seconds each user waits between requests, 0 to send back to back', type=float, default=0)
+    parser.add_argument('--atom-latency', help='Seconds the stand-in AtoM takes per search', type=float, default=0.05)
+    parser.add_argument('--interval', help='Seconds per row of the over-time report', type=float, default=10)
+    parser.add_argument('--baselines', help='Baselines file to compare against', default=str(DEFAULT_BASELINES))
+    parser.add_argument('--save-baseline', help='Store the results as the baselines of their mix, mode and users', action='store_true')
+    parser.add_argument('--tolerance', help='Fraction a result may be worse than its baseline', type=float, default=0.2)
+    parser.add_argument('--root', help='Directory for the databases and logs, a temporary directory by default')
+    parser.add_argument('--keep', help='Keep the databases and logs for inspection', action='store_true')
+    parser.add_argument('--json', help='Write the full results to this file')
+    args = parser.parse_args()
+    return args
+
+def _run(queue, *args):
+    queue.put(run_mix(*args))
+
+def run_in_process(*args) -> dict:
+    # A process per mix so each starts with cold caches and reports its own RSS
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def print_report(results: list):
+    print(f"{'mix':<10}{'mode':<9}{'users':>6}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'RSS MB':>9}")
+    for result in results:
+        print(
+            f"{result['mix']:<10}{result['mode']:<9}{result['users']:>6}{result['requests']:>10}{result['errors']:>8}"
+            f"{result['throughput']:>9.0f}{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['rss_end_bytes'] / MB:>9.0f}"
+        )
+    for result in results:
+        print(f"\n{result['mix']} operations{'':<9}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+        for name, summary in result['operations'].items():
+            print(f"  {name:<26}{summary['requests']:>10}{summary['errors']:>8}{summary['throughput']:>9.0f}{summary['p50_ms']:>9.1f}{summary['p99_ms']:>9.1f}")
+        if len(result['intervals']) > 1:
+            print(f"{result['mix']} over time{'':<10}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'RSS MB':>9}")
+            for interval in result['intervals']:
+                print(
+                    f"  {interval['start_seconds']:>8.0f}s{'':<17}{interval['requests']:>10}{interval['errors']:>8}{interval['throughput']:>9.0f}"
+                    f"{interval['p50_ms']:>9.1f}{interval['p99_ms']:>9.1f}{interval['peak_rss_bytes'] / MB:>9.0f}"
+                )
+
+def check_baselines(results: list, baselines: dict, tolerance: float) -> bool:
+    """
+    Prints how each result compares with its baseline. Returns whether any regressed.
+    """
+    regressed = False
+    print()
+    for result in results:
+        key = baseline_key(result)
+        if key not in baselines:
+            print(f"{key}: no baseline, store one with --save-baseline")
+            continue
+        regressions = compare(result, baselines[key], tolerance)
+        regressed = regressed or bool(regressions)
+        print(f"{key}: " + ('; '.join(regressions) if regressions else f"within {tolerance:.0%} of baseline"))
+    return regressed
+
+def main():
+    args = parse_arguments()
+    baselines_path = Path(args.baselines)
+    baselines = json.loads(baselines_path.read_text()) if baselines_path.exists() else {}
+    root = Path(args.root or tempfile.mkdtemp(prefix='curate-loadtest-'))
+    results = []
+    try:
+        for mix in args.mixes:
+            print(f"Running {mix}...", file=sys.stderr, flush=True)
+            results.append(run_in_process(
+                mix, root / mix, args.mode, args.users, args.seconds, args.warmup, args.think, args.atom_latency, args.interval
+            ))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    print_report(results)
+    regressed = check_baselines(results, baselines, args.tolerance)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.save_baseline:
+        baselines.update({baseline_key(result): result for result in results})
+        baselines_path.parent.mkdir(parents=True, exist_ok=True)
+        baselines_path.write_text(json.dumps(baselines, indent=2))
+        print(f"Stored baselines in {baselines_path}")
+    elif regressed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,99 @@
 import argparse
 import json
-import logging
 import sys
 import time
 
-from config import LOG_DIRECTORY
+from config import SCHEDULER_INTERACTIVE_MAX_NODES, WORKER_API_URL
+from db.models.job_model import JOB_PRIORITIES
+from preservation import logs, metrics
+from preservation.database import DatabaseManager
+from preservation.batching import plan_batches
 from preservation.preservation import Preservation
-from preservation.preservation import process_node
+from preservation.preservation import process_batch, process_node
+from preservation.submission import Submission
 
-logger = logging.getLogger("preservation")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(f'{LOG_DIRECTORY}/preservation.log')
-file_handler.setFormatter(logging.Formatter("%(asctime)s %(filename)s:%(lineno)d %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
-logger.addHandler(file_handler)
+logger = logs.configure("preservation", 'preservation.log')
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Curate Preservation')
     parser.add_argument('-c', '--config_id', help='Config ID', type=int, required=True)
-    parser.add_argument('-n', '--nodes', help='Array of node submitted from Curate', required=True)
+    nodes = parser.add_mutually_exclusive_group(required=True)
+    nodes.add_argument('-n', '--nodes', help='Array of node submitted from Curate')
+    nodes.add_argument('-f', '--nodes-file', help='NDJSON file of nodes submitted from Curate, one per line. Use - for stdin. Nodes are queued for the preservation worker')
     parser.add_argument('-u', '--user', help='User', required=True)
+    parser.add_argument('--profile', help='Record CPU and allocation profiles of each stage', action='store_true')
+    parser.add_argument('--force', help='Preserve nodes even if they are unchanged since their last AIP', action='store_true')
+    parser.add_argument('--priority', help=f'Scheduling priority of queued nodes. Defaults to high for up to {SCHEDULER_INTERACTIVE_MAX_NODES} nodes and normal for more',
+                        choices=list(JOB_PRIORITIES))
     args = parser.parse_args()
     return args
     
 
+def read_ndjson(stream):
+    """
+    Yields one node per non-empty line.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+
+def print_queued(queued: list):
+    for job_id, node in queued:
+        logger.info(f"Queued job {job_id} for {node['Path']}")
+        print(json.dumps({'job_id': job_id, 'Uuid': node['Uuid']}), flush=True)
+
+def enqueue_nodes(args: argparse.Namespace):
+    """
+    Queues each node as it is read and prints its job ID.
+    """
+    if WORKER_API_URL:
+        # Submission writes to this host's database, which workers here don't claim from
+        raise ValueError("Nodes are queued on the host holding the job database, or through its POST /jobs")
+    DatabaseManager().get_preservation_processing_configs(args.config_id)
+    submission = Submission(args.user, args.config_id, args.profile, args.force, args.priority)
+    stream = sys.stdin if args.nodes_file == '-' else open(args.nodes_file)
+    try:
+        for node in read_ndjson(stream):
+            print_queued(submission.add([node]))
+    finally:
+        # Nodes read before an invalid line stay queued
+        print_queued(submission.finish())
+        if stream is not sys.stdin:
+            stream.close()
+
 def main():
     # logger.debug(f"Arguments: {sys.argv}")
     args = parse_arguments()
+    metrics.start_flusher()
+    if args.nodes_file:
+        enqueue_nodes(args)
+        return
     preserver = Preservation(config_id = args.config_id, user=args.user)
 
     # logger.debug(args.nodes)
-    for node in json.loads(args.nodes):
+    batches, nodes = plan_batches(
+        json.loads(args.nodes),
+        preserver.processing_config['batch_max_file_bytes'],
+        preserver.processing_config['batch_max_nodes']
+    )
+    for batch in batches:
+        processing_directory = preserver.get_new_processing_directory()
+        try:
+            process_batch(preserver, [{'node': node, 'force': args.force} for node in batch], processing_directory, profile=args.profile)
+        except Exception as e:
+            logger.error(f"Failed to preserve batch of {len(batch)} nodes: {e}")
+            continue
+    for node in nodes:
         processing_directory = preserver.get_new_processing_directory()
         try:
-            process_node(preserver, node, processing_directory)
+            process_node(preserver, node, processing_directory, profile=args.profile, force=args.force)
         except Exception as e:
+            logger.error(f"Failed to preserve {node.get('Path')}: {e}")
             continue
 
 if __name__ == '__main__':
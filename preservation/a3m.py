@@ -1,5 +1,7 @@
 import os
 import re
+import socket
+import threading
 from uuid import uuid4
 import docker
 import logging
@@ -7,14 +9,114 @@ import time
 import re
 from pathlib import Path
 
+from config import A3M_DAEMON_PORT, A3M_DAEMONS, A3M_NETWORK, BREAKER_MAX_WAIT_SECONDS
+from preservation import cancellation, metrics, resilience, tracing
+from preservation.scratch import volumes
+
 docker_client = docker.from_env()
+# Labels on a3m client containers so leftovers can be found by the reaper
+CLIENT_CONTAINER_LABEL = 'curate.preservation.a3m-client'
+OWNER_HOST_LABEL = 'curate.preservation.host'
+OWNER_PID_LABEL = 'curate.preservation.pid'
+# The a3md a client container submitted its transfer to
+DAEMON_LABEL = 'curate.preservation.a3md'
+# Client errors meaning the daemon couldn't be reached, rather than the transfer failing
+UNREACHABLE_PATTERN = re.compile(r'StatusCode\.UNAVAILABLE|StatusCode\.DEADLINE_EXCEEDED|failed to connect|Connection refused')
+# How often a transfer waiting for a healthy daemon checks again
+DAEMON_POLL_SECONDS = 5
 logger = logging.getLogger("preservation")
 
+
+class A3MDaemonPool:
+    """
+    Routes transfers to the least loaded healthy a3md of A3M_DAEMONS.
+
+    Load is the number of running client containers labelled with the daemon, so it is
+    shared by every worker process on the host. A daemon whose container isn't running,
+    or that clients fail to reach BREAKER_FAILURE_THRESHOLD times in a row, is taken out
+    of rotation until its circuit lets a probe transfer through.
+    """
+    def __init__(self):
+        # Held from choosing a daemon until its client container is running, so it counts towards the load
+        self._lock = threading.Lock()
+
+    def breaker(self, name: str) -> resilience.CircuitBreaker:
+        return resilience.policy.breaker(f'a3md/{name}')
+
+    def container(self, name: str):
+        """
+        Returns the daemon's container, or None when it is missing or not running.
+        """
+        try:
+            container = docker_client.containers.get(name)
+        except Exception as e:
+            logger.warning(f"A3M Daemon container {name} not found: {e}")
+            return None
+        if container.status != 'running':
+            logger.warning(f"A3M Daemon container {name} is {container.status}")
+            return None
+        return container
+
+    def load(self, name: str) -> int:
+        return len(docker_client.containers.list(filters={'label': f'{DAEMON_LABEL}={name}', 'status': 'running'}))
+
+    def start_client(self, run) -> tuple:
+        """
+        Calls run(name) with the least loaded healthy daemon to start a client container.
+        Waits up to BREAKER_MAX_WAIT_SECONDS for one to be healthy. Returns the daemon's name and container and the client.
+        A probe is released if run raises.
+        """
+        waited = time.monotonic()
+        while True:
+            with self._lock:
+                candidates = []
+                for name in A3M_DAEMONS:
+                    if not self.breaker(name).available():
+                        continue
+                    container = self.container(name)
+                    if container is not None:
+                        candidates.append((self.load(name), A3M_DAEMONS.index(name), name, container))
+                for load, _, name, container in sorted(candidates):
+                    # A daemon out of rotation only takes the one probe transfer
+                    if not self.breaker(name).allow():
+                        continue
+                    logger.info(f"Routing transfer to {name} ({load} running)")
+                    metrics.inc('preservation_a3md_transfers_total', labels={'daemon': name})
+                    try:
+                        client = run(name)
+                    except BaseException:
+                        # A client that never started can't report on the daemon, the next transfer probes instead
+                        self.release(name)
+                        raise
+                    return name, container, client
+            if time.monotonic() - waited >= BREAKER_MAX_WAIT_SECONDS:
+                raise resilience.CircuitOpenError(f"No a3md has been healthy for {BREAKER_MAX_WAIT_SECONDS}s")
+            logger.warning("No healthy a3md, waiting")
+            cancellation.sleep(DAEMON_POLL_SECONDS)
+
+    def record_result(self, name: str, exit_code: int, client_logs: str):
+        breaker = self.breaker(name)
+        if exit_code != 0 and UNREACHABLE_PATTERN.search(client_logs):
+            logger.error(f"a3m client could not reach {name}")
+            breaker.record_failure()
+        else:
+            # The daemon answered, whether or not the transfer succeeded
+            breaker.record_success()
+
+    def release(self, name: str):
+        self.breaker(name).release()
+
+
+daemon_pool = A3MDaemonPool()
+
+
 class A3MManager:
     def __init__(self, config: dict, a3m_docker_image: str):
         self.processing_config = config
         self.a3m_docker_image = a3m_docker_image
-        self.daemon = self._a3md_checks()
+        self._a3md_checks()
+        # The daemon each AIP was produced by, which its AIP and DIP are collected from
+        self.daemons = {}
 
     def _construct_processing_config_string(self) -> str:
         config_string = ""
@@ -24,11 +126,12 @@ class A3MManager:
     
     def _a3md_checks(self):
         """
-        Ensures docker network a3m_network exists.
-        Ensures docker container a3md exists.
+        Ensures docker network A3M_NETWORK exists.
+        Ensures at least one of the A3M_DAEMONS containers exists, and that each mounts
+        every scratch volume at the same path, as transfers and AIPs are passed by path.
         """
         try:
-            docker_client.networks.get("a3m-network")
+            docker_client.networks.get(A3M_NETWORK)
             logger.debug('A3M network found')
         except docker.errors.NotFound as e:
             err_msg = f"A3M network not found: {e}"
@@ -39,19 +142,33 @@ class A3MManager:
             logger.error(err_msg)
             raise RuntimeError(err_msg) from e
 
-        try:
-            a3md_container = docker_client.containers.get("a3md")
-            logger.debug('A3M Daemon container found')
-        except docker.errors.NotFound as e:
-            err_msg = f"A3M Daemon container not found: {e}"
-            logger.error(err_msg)
-            raise RuntimeError(err_msg) from e
-        except Exception as e:
-            err_msg = f"Unexpected error: {e}"
+        found = []
+        for name in A3M_DAEMONS:
+            try:
+                container = docker_client.containers.get(name)
+                found.append(name)
+                logger.debug(f'A3M Daemon container {name} found')
+            except docker.errors.NotFound as e:
+                logger.error(f"A3M Daemon container not found: {e}")
+            except Exception as e:
+                err_msg = f"Unexpected error: {e}"
+                logger.error(err_msg)
+                raise RuntimeError(err_msg) from e
+            else:
+                self._mount_checks(container)
+        if not found:
+            raise RuntimeError(f"A3M Daemon containers not found: {', '.join(A3M_DAEMONS)}")
+
+    def _mount_checks(self, container):
+        """
+        Ensures a daemon container bind mounts every scratch volume at the path it has on the host.
+        """
+        mounts = [Path(mount['Destination']) for mount in container.attrs.get('Mounts', []) if mount.get('Source') == mount.get('Destination')]
+        missing = [str(volume) for volume in volumes() if not any(volume.is_relative_to(mount) for mount in mounts)]
+        if missing:
+            err_msg = f"A3M Daemon container {container.name} does not mount scratch volumes {', '.join(missing)} at the same path"
             logger.error(err_msg)
-            raise RuntimeError(err_msg) from e
-        
-        return a3md_container
+            raise RuntimeError(err_msg)
 
     def _sanitize_container_name(self, input_string: str) -> str:
         """
@@ -71,38 +188,64 @@ class A3MManager:
 
     def execute_a3m_transfer(self, transfer_path: Path, transfer_name: str) -> str:
         """
-        Execute an A3M transfer.
+        Execute an A3M transfer on the least loaded healthy a3md.
         """
-        commands = [
-            "-m", "a3m.cli.client",
-            "--address=a3md:7000",
-            "--no-input",
-            "--name", transfer_name,
-            str(transfer_path)
-        ]
-        for k, v in self.processing_config.items():
-            commands.append("--processing-config")
-            commands.append(f"{k}={v}")
         container_name = self._sanitize_container_name(transfer_name)
-        logger.debug(f'Creating Container {container_name}')
-        logger.debug(f'Starting A3M transfer {transfer_path}')
-        container = docker_client.containers.run(
-            self.a3m_docker_image,
-            name=container_name,
-            detach=True,
-            network="a3m-network",
-            entrypoint="python",
-            command=commands,
-            environment=["A3M_DEBUG=yes"],
-        )
-        exit_status = container.wait()
-        container_logs = container.logs().decode('utf-8')
-        container.remove()
+
+        def run(daemon_name: str):
+            commands = [
+                "-m", "a3m.cli.client",
+                f"--address={daemon_name}:{A3M_DAEMON_PORT}",
+                "--no-input",
+                "--name", transfer_name,
+                str(transfer_path)
+            ]
+            for k, v in self.processing_config.items():
+                commands.append("--processing-config")
+                commands.append(f"{k}={v}")
+            logger.debug(f'Creating Container {container_name}')
+            logger.debug(f'Starting A3M transfer {transfer_path} on {daemon_name}')
+            return docker_client.containers.run(
+                self.a3m_docker_image,
+                name=container_name,
+                detach=True,
+                network=A3M_NETWORK,
+                entrypoint="python",
+                command=commands,
+                environment=["A3M_DEBUG=yes"],
+                labels={
+                    CLIENT_CONTAINER_LABEL: 'true',
+                    OWNER_HOST_LABEL: socket.gethostname(),
+                    OWNER_PID_LABEL: str(os.getpid()),
+                    DAEMON_LABEL: daemon_name,
+                },
+            )
+
+        with tracing.span('a3m client container', 'docker', container=container_name, transfer=transfer_path) as span:
+            daemon_name, daemon, container = daemon_pool.start_client(run)
+            span['daemon'] = daemon_name
+            recorded = False
+            try:
+                with cancellation.stopping(container):
+                    exit_status = container.wait()
+                container_logs = container.logs().decode('utf-8')
+                # A killed client says nothing about the daemon
+                if not cancellation.cancelled():
+                    daemon_pool.record_result(daemon_name, exit_status['StatusCode'], container_logs)
+                    recorded = True
+            finally:
+                container.remove(force=True)
+                # Let a probe cut short by cancellation or an error go, so the daemon doesn't stay out of rotation
+                if not recorded:
+                    daemon_pool.release(daemon_name)
+            span['exit_code'] = exit_status['StatusCode']
+        # a3m has no way to abort a package, the daemon's output is left to the reaper
+        cancellation.check()
 
         if exit_status['StatusCode'] != 0:
             err_msg = f"Transfer failed with exit code: {exit_status['StatusCode']}"
             logger.error(err_msg)
-            logger.debug(f"Container logs: {container_logs}")
+            logger.debug("Container logs: %s", container_logs)
             raise RuntimeError(err_msg)
 
         # Flip the log so we get last uuid (when debugging)
@@ -115,14 +258,17 @@ class A3MManager:
             err_msg = "Could not find AIP UUID"
             logger.error(err_msg)
             raise RuntimeError(err_msg)
-        logger.debug(f"AIP UUID: {aip_uuid}")
+        logger.debug(f"AIP UUID: {aip_uuid} on {daemon_name}")
+        self.daemons[aip_uuid] = daemon
         return aip_uuid
     
-    def move_file_in_container(self, src_path: Path, dst_path: Path) -> Path:
+    def move_file_in_container(self, aip_uuid: str, src_path: Path, dst_path: Path) -> Path:
         """
-        Move a file within the running a3m daemon.
+        Move a file within the a3m daemon that produced the AIP.
         """
-        mv_exec_result = self.daemon.exec_run(f'mv "{src_path}" "{dst_path}"', user="root")
+        daemon = self.daemons[aip_uuid]
+        with tracing.span('a3md exec mv', 'docker', daemon=daemon.name, src=src_path, dst=dst_path):
+            mv_exec_result = daemon.exec_run(f'mv "{src_path}" "{dst_path}"', user="root")
         new_path = dst_path / src_path.name
 
         if mv_exec_result.exit_code != 0:
@@ -131,7 +277,8 @@ class A3MManager:
             raise RuntimeError(err_msg)
         
         # Change ownership of the file to the current user
-        chown_exec_result = self.daemon.exec_run(f'chown -R {os.getuid()}:{os.getgid()} "{new_path}"', user="root")
+        with tracing.span('a3md exec chown', 'docker', daemon=daemon.name, path=new_path):
+            chown_exec_result = daemon.exec_run(f'chown -R {os.getuid()}:{os.getgid()} "{new_path}"', user="root")
 
         if chown_exec_result.exit_code != 0:
             err_msg = f"Failed to change ownership of the file within the container: {chown_exec_result.output}"
@@ -0,0 +1,278 @@
+import logging
+import os
+import shutil
+import socket
+import sqlite3 as sqlite
+import statistics
+import threading
+from typing import Optional
+
+from config import ADMISSION_HEADROOM_BYTES, ADMISSION_POLL_SECONDS, ADMISSION_SAFETY_MARGIN, ADMISSION_SAMPLE_SECONDS
+from preservation import cancellation
+from preservation.database import DB_PATH
+from preservation.jobs import path_size
+from preservation.scratch import volume_of
+
+logger = logging.getLogger("preservation")
+
+# Observed peak / node size ratios needed before they replace the default estimate
+MIN_OBSERVATIONS = 5
+MAX_OBSERVATIONS = 50
+
+def node_size(node: dict) -> int:
+    """
+    Returns the Curate node size in bytes, which Cells reports recursively for folders.
+    """
+    try:
+        return int(node.get('Size') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def per_volume(shares: dict) -> dict:
+    """
+    Adds up the estimated bytes of the directories in shares that are on the same volume.
+    """
+    totals = {}
+    for directory, estimated in shares.items():
+        volume = str(volume_of(directory))
+        totals[volume] = totals.get(volume, 0) + estimated
+    return totals
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Reservation:
+    """
+    Disk space held for one node while it is processed, on each volume its directories are on.
+    Tracks the peak usage of its directories together, measured after each stage and every
+    ADMISSION_SAMPLE_SECONDS from a thread of its own, so usage within a long stage is caught too.
+    """
+    def __init__(self, controller: 'AdmissionController', reservation_ids: dict, shares: dict):
+        self.controller = controller
+        # Reservation ID of each directory
+        self.ids = reservation_ids
+        self.estimated = sum(shares.values())
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='disk-sampler', daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(ADMISSION_SAMPLE_SECONDS):
+            try:
+                self.observe()
+            except Exception as e:
+                logger.error(f"Failed to measure disk usage: {e}")
+
+    def observe(self):
+        """
+        Measures the directories and records each against its reservation.
+        """
+        total = 0
+        for directory, reservation_id in self.ids.items():
+            try:
+                used = path_size(directory) if directory.exists() else 0
+            except OSError:
+                return
+            self.controller.update_usage(reservation_id, used)
+            total += used
+        with self._lock:
+            self.peak = max(self.peak, total)
+
+    def release(self) -> int:
+        """
+        Frees the reserved space. Returns the peak usage observed.
+        """
+        self._stop.set()
+        self._sampler.join()
+        self.observe()
+        for reservation_id in self.ids.values():
+            self.controller.release(reservation_id)
+        logger.info(f"Disk usage peaked at {self.peak} bytes against an estimate of {self.estimated} bytes")
+        return self.peak
+
+
+class AdmissionController:
+    """
+    Admits nodes for processing only when their estimated peak disk footprint fits.
+
+    Reservations are stored in the preservation database of this host, one per scratch volume
+    a node's directories are on, so that every process sharing a volume sees the same budget.
+    Peak usage is learned from the jobs of every host, through db_manager.
+    """
+    def __init__(self, db_manager):
+        self.db_file = DB_PATH
+        self.db_manager = db_manager
+        self.host = socket.gethostname()
+        self._init_table()
+
+    def _connect(self):
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        return conn
+
+    def _init_table(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS disk_reservations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    volume TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    used_bytes INTEGER DEFAULT 0 NOT NULL,
+                    job_id INTEGER,
+                    host TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+                );
+            """)
+        finally:
+            conn.close()
+
+    def default_factor(self, processing_config: dict, a3m_config: dict) -> float:
+        """
+        Peak footprint as a multiple of the node size before any runs have been observed.
+        Download (moved into the transfer), AIP archive, extracted AIP and compressed copy.
+        """
+        factor = 3.0
+        if processing_config.get('compress_aip'):
+            factor += 1.0
+        # Normalized derivatives and the DIP add to the AIP
+        if a3m_config.get('normalize'):
+            factor += 0.5
+        if a3m_config.get('dip_enabled'):
+            factor += 0.5
+        return factor
+
+    def learned_factor(self, config_id: int) -> Optional[float]:
+        """
+        Returns the median observed peak / node size ratio of recent jobs with this config.
+        """
+        ratios = self.db_manager.get_peak_ratios(config_id, MAX_OBSERVATIONS)
+        if len(ratios) < MIN_OBSERVATIONS:
+            return None
+        return statistics.median(ratios)
+
+    def estimate(self, size: int, config_id: int, processing_config: dict, a3m_config: dict) -> int:
+        factor = self.learned_factor(config_id) or self.default_factor(processing_config, a3m_config)
+        return int(size * factor * ADMISSION_SAFETY_MARGIN)
+
+    def _release_dead(self, conn):
+        for row in conn.execute('SELECT id, pid FROM disk_reservations').fetchall():
+            if not pid_alive(row['pid']):
+                conn.execute('DELETE FROM disk_reservations WHERE id = ?', (row['id'],))
+                logger.info(f"Released disk reservation {row['id']} of dead process {row['pid']}")
+
+    def _outstanding(self, conn, volume: str) -> int:
+        # Space a running job has already used is no longer in the free figure
+        return conn.execute('''
+            SELECT COALESCE(SUM(MAX(bytes - used_bytes, 0)), 0) FROM disk_reservations WHERE volume = ?
+        ''', (volume,)).fetchone()[0]
+
+    def try_reserve(self, shares: dict, job_id: int = None) -> Optional[dict]:
+        """
+        Reserves the bytes of each directory in shares if they all fit alongside every other reservation.
+        Returns the reservation ID of each directory, or None when they don't fit yet.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._release_dead(conn)
+            for volume, estimated in per_volume(shares).items():
+                available = shutil.disk_usage(volume).free - self._outstanding(conn, volume) - ADMISSION_HEADROOM_BYTES
+                if estimated > available:
+                    conn.execute("COMMIT")
+                    return None
+            reservation_ids = {}
+            for directory, estimated in shares.items():
+                cursor = conn.execute('''
+                    INSERT INTO disk_reservations (volume, bytes, job_id, host, pid) VALUES (?, ?, ?, ?, ?)
+                ''', (str(volume_of(directory)), estimated, job_id, self.host, os.getpid()))
+                reservation_ids[directory] = cursor.lastrowid
+            conn.execute("COMMIT")
+            return reservation_ids
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def active_job_ids(self) -> set:
+        """
+        Returns the jobs holding a reservation of a live process.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._release_dead(conn)
+            rows = conn.execute('SELECT job_id FROM disk_reservations WHERE job_id IS NOT NULL').fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return {row['job_id'] for row in rows}
+
+    def volume_usage(self) -> dict:
+        """
+        Returns the bytes still reserved and the number of reservations on each volume.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT volume, COALESCE(SUM(MAX(bytes - used_bytes, 0)), 0), COUNT(*) FROM disk_reservations GROUP BY volume
+            ''').fetchall()
+        finally:
+            conn.close()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def update_usage(self, reservation_id: int, used: int):
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE disk_reservations SET used_bytes = ? WHERE id = ?', (used, reservation_id))
+        except Exception as e:
+            logger.error(f"Failed to update disk reservation {reservation_id}: {e}")
+        finally:
+            conn.close()
+
+    def release(self, reservation_id: int):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM disk_reservations WHERE id = ?', (reservation_id,))
+        finally:
+            conn.close()
+
+    def admit(self, shares: dict, job_id: int = None, on_wait=None, wait: bool = True) -> Optional[Reservation]:
+        """
+        Blocks until the estimated bytes of each directory in shares can be reserved and returns the reservation.
+        on_wait is called once if the node has to wait. Without wait, returns None instead of waiting.
+        """
+        for volume, estimated in per_volume(shares).items():
+            capacity = shutil.disk_usage(volume).total - ADMISSION_HEADROOM_BYTES
+            if estimated > capacity:
+                raise RuntimeError(
+                    f"Estimated peak disk usage of {estimated} bytes exceeds the {capacity} bytes available for processing on {volume}"
+                )
+        estimated = sum(shares.values())
+        reservation_ids = self.try_reserve(shares, job_id)
+        if reservation_ids is None and not wait:
+            logger.info(f"{estimated} bytes of disk space aren't free yet")
+            return None
+        if reservation_ids is None:
+            logger.info(f"Waiting for {estimated} bytes of disk space")
+            if on_wait:
+                on_wait()
+            while reservation_ids is None:
+                cancellation.sleep(ADMISSION_POLL_SECONDS)
+                reservation_ids = self.try_reserve(shares, job_id)
+        logger.debug(f"Reserved {estimated} bytes of disk space (reservations {list(reservation_ids.values())})")
+        return Reservation(self, reservation_ids, shares)
@@ -0,0 +1,200 @@
+import logging
+import sqlite3 as sqlite
+import xml.etree.ElementTree as ET
+from pathlib import Path, PurePosixPath
+
+from db.models.aip_model import init_db as init_aip_db
+from preservation import cancellation, metrics, tracing, worker_api
+from preservation.database import DB_PATH
+
+logger = logging.getLogger("preservation")
+
+METS = '{http://www.loc.gov/METS/}'
+PREMIS = '{http://www.loc.gov/premis/v3}'
+XLINK = '{http://www.w3.org/1999/xlink}'
+# Rows written per executemany while a METS is parsed
+INSERT_BATCH = 500
+# a3m records where each original file was in the transfer with this prefix
+TRANSFER_DIRECTORY = '%transferDirectory%'
+
+def _text(element: ET.Element, path: str) -> str:
+    value = element.findtext(path)
+    return value.strip() if value else None
+
+def _premis_object(element: ET.Element) -> dict:
+    characteristics = f'{PREMIS}objectCharacteristics'
+    size = _text(element, f'{characteristics}/{PREMIS}size')
+    original_name = _text(element, f'{PREMIS}originalName')
+    if original_name and original_name.startswith(TRANSFER_DIRECTORY):
+        original_name = original_name[len(TRANSFER_DIRECTORY):]
+    return {
+        'file_uuid': _text(element, f'{PREMIS}objectIdentifier/{PREMIS}objectIdentifierValue'),
+        'original_name': original_name,
+        'size': int(size) if size and size.isdigit() else None,
+        'checksum': _text(element, f'{characteristics}/{PREMIS}fixity/{PREMIS}messageDigest'),
+        'checksum_type': _text(element, f'{characteristics}/{PREMIS}fixity/{PREMIS}messageDigestAlgorithm'),
+        'puid': _text(element, f'{characteristics}/{PREMIS}format/{PREMIS}formatRegistry/{PREMIS}formatRegistryKey'),
+        'format_name': _text(element, f'{characteristics}/{PREMIS}format/{PREMIS}formatDesignation/{PREMIS}formatName'),
+        'format_version': _text(element, f'{characteristics}/{PREMIS}format/{PREMIS}formatDesignation/{PREMIS}formatVersion'),
+    }
+
+def read_mets(mets_path: Path):
+    """
+    Yields a dict for every file of a METS document, joining its fileSec entry to the
+    PREMIS object in its amdSec.
+
+    The document is parsed incrementally and each element is dropped once read, so memory
+    holds the files whose other half hasn't been reached yet rather than the whole tree.
+    a3m writes the amdSecs before the fileSec, but either order is joined.
+    """
+    objects, files = {}, {}
+    stack = []
+    # Depth inside a premis:object or mets:file, whose subtree is read at its end
+    reading = 0
+    amd_id, use = None, None
+    for event, element in ET.iterparse(mets_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if element.tag == f'{METS}amdSec':
+                amd_id = element.get('ID')
+            elif element.tag == f'{METS}fileGrp':
+                use = element.get('USE')
+            elif element.tag in (f'{PREMIS}object', f'{METS}file'):
+                reading += 1
+            continue
+        stack.pop()
+        if element.tag == f'{PREMIS}object':
+            reading -= 1
+            # Only the techMD object describes the file, rights and events objects carry no characteristics
+            if amd_id and element.find(f'{PREMIS}objectCharacteristics') is not None:
+                premis_object = _premis_object(element)
+                waiting = files.pop(amd_id, None)
+                if waiting:
+                    for entry in waiting:
+                        yield {**entry, **premis_object}
+                else:
+                    objects[amd_id] = premis_object
+        elif element.tag == f'{METS}file':
+            reading -= 1
+            location = element.find(f'{METS}FLocat')
+            href = location.get(f'{XLINK}href') if location is not None else None
+            if href:
+                entry = {'path': href, 'name': PurePosixPath(href).name, 'use': use}
+                adm_ids = (element.get('ADMID') or '').split()
+                # Each amdSec describes one file, so its object is dropped once joined
+                premis_object = next((objects.pop(adm_id) for adm_id in adm_ids if adm_id in objects), None)
+                if premis_object is not None:
+                    yield {**entry, **premis_object}
+                elif adm_ids:
+                    files.setdefault(adm_ids[0], []).append(entry)
+                else:
+                    yield entry
+        if not reading and stack:
+            stack[-1].remove(element)
+    # Files whose amdSec never turned up are still indexed, without their characteristics
+    for entries in files.values():
+        yield from entries
+
+
+class AIPIndex:
+    """
+    Records the files of each AIP, read from its METS once a3m has made it, so what an
+    AIP holds can be looked up without retrieving it.
+
+    Each file carries the Curate node it was preserved from, matched on its original
+    path in the transfer, so a node's files can be found across AIPs.
+    """
+    def __init__(self):
+        self.db_file = DB_PATH
+        init_aip_db()
+
+    def _connect(self):
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        return conn
+
+    def _node_paths(self, package) -> dict:
+        """
+        Maps the transfer path of a package and each of its children to its Curate node.
+        """
+        packages = ([package] if package.uuid else []) + package.children
+        return {str(PurePosixPath(child.object_path)): child.uuid for child in packages if child.uuid}
+
+    def _node_of(self, node_paths: dict, entry: dict) -> str:
+        path = PurePosixPath(entry.get('original_name') or entry['path'])
+        for candidate in (path, *path.parents):
+            if str(candidate) in node_paths:
+                return node_paths[str(candidate)]
+        return None
+
+    def index(self, extracted_aip_path: Path, aip_uuid: str, package, job_id: int = None) -> int:
+        """
+        Replaces the indexed files of an AIP with those in its METS. Returns the number of files.
+        """
+        mets_path = extracted_aip_path / 'data' / f'METS.{aip_uuid}.xml'
+        node_paths = self._node_paths(package)
+        count = 0
+        try:
+            with tracing.span('index AIP', 'mets', path=mets_path, bytes=mets_path.stat().st_size):
+                self.delete_files(aip_uuid)
+                rows = []
+                for entry in read_mets(mets_path):
+                    rows.append({
+                        'file_uuid': None, 'original_name': None, 'size': None, 'checksum': None, 'checksum_type': None,
+                        'puid': None, 'format_name': None, 'format_version': None, **entry,
+                        'aip_uuid': aip_uuid, 'job_id': job_id, 'node_uuid': self._node_of(node_paths, entry),
+                    })
+                    if len(rows) >= INSERT_BATCH:
+                        count += self.insert_files(rows)
+                        rows = []
+                        cancellation.check()
+                if rows:
+                    count += self.insert_files(rows)
+        except BaseException:
+            # A partial index would pass for the whole AIP
+            self.delete_files(aip_uuid)
+            raise
+        metrics.inc('preservation_aip_files_indexed_total', count)
+        logger.info(f"Indexed {count} files of AIP {aip_uuid}")
+        return count
+
+    def delete_files(self, aip_uuid: str):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM aip_files WHERE aip_uuid = ?', (aip_uuid,))
+        finally:
+            conn.close()
+
+    def insert_files(self, rows: list) -> int:
+        """
+        Writes a batch of rows in its own transaction, so other writers aren't held up for the whole METS.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany('''
+                INSERT INTO aip_files (
+                    aip_uuid, job_id, node_uuid, file_uuid, path, name, original_name, use,
+                    size, checksum, checksum_type, puid, format_name, format_version
+                )
+                VALUES (
+                    :aip_uuid, :job_id, :node_uuid, :file_uuid, :path, :name, :original_name, :use,
+                    :size, :checksum, :checksum_type, :puid, :format_name, :format_version
+                )
+            ''', rows)
+            conn.execute("COMMIT")
+        finally:
+            # Closing rolls back a batch that failed
+            conn.close()
+        return len(rows)
+
+
+class RemoteAIPIndex(AIPIndex):
+    """
+    The AIPIndex of the host holding the job database, written through its worker API by workers on other hosts.
+    """
+    def delete_files(self, aip_uuid: str):
+        worker_api.call('aips', 'delete_files', aip_uuid)
+
+    def insert_files(self, rows: list) -> int:
+        return worker_api.call('aips', 'insert_files', rows)
@@ -6,6 +6,9 @@ import requests
 from pathlib import Path
 from urllib.parse import urlparse
 
+from config import HTTP_TIMEOUT_SECONDS
+from preservation import metrics, resilience, tracing
+
 logger = logging.getLogger("preservation")
 
 class AtoMManager():
@@ -20,7 +23,9 @@ class AtoMManager():
         hostname = urlparse(self.atom_url).netloc
 
         # Check SSH connection
-        if not check_ssh_connection(hostname):
+        with tracing.span('ssh check', 'atom', host=hostname):
+            ssh_ok = check_ssh_connection(hostname)
+        if not ssh_ok:
             raise Exception(f"SSH connection to {hostname} failed.")
 
         # RSync to AtoM
@@ -28,7 +33,8 @@ class AtoMManager():
         print(rsync_command)
         
         # Execute RSync
-        subprocess.run(rsync_command, capture_output=True, text=True, check=True)
+        with tracing.span('rsync', 'subprocess', path=dip_path, host=hostname):
+            subprocess.run(rsync_command, capture_output=True, text=True, check=True)
         
         self._deposit_dip(Path(dip_path), slug)
 
@@ -45,9 +51,15 @@ class AtoMManager():
             'Content-Type': 'application/zip'
         }
         auth = requests.auth.HTTPBasicAuth(self.atom_username, self.atom_password)
-        response = requests.request("POST", deposit_url, headers=headers, auth=auth, allow_redirects=False)
-        
-        response.raise_for_status()
+
+        def deposit():
+            with tracing.span('atom sword/deposit', 'atom', slug=slug), \
+                    metrics.timed('preservation_http_request', {'service': 'atom', 'endpoint': 'sword/deposit'}):
+                response = requests.request("POST", deposit_url, headers=headers, auth=auth, allow_redirects=False,
+                                            timeout=HTTP_TIMEOUT_SECONDS)
+                response.raise_for_status()
+
+        resilience.call('atom', 'sword/deposit', deposit)
 
 def check_ssh_connection(hostname):
     """Tests SSH connection and returns True if successful, False if not."""
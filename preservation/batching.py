@@ -0,0 +1,34 @@
+from preservation.admission import node_size
+from preservation.splitting import is_collection
+
+ATOM_SLUG_KEY = 'usermeta-atom-linked-description'
+
+def batchable(node: dict, max_file_bytes: int) -> bool:
+    """
+    Returns whether a node can share a transfer with other small files.
+    Nodes linked to an AtoM description need a DIP of their own, so are never batched.
+    """
+    meta_store = node.get('MetaStore') or {}
+    return (
+        bool(max_file_bytes)
+        and not is_collection(node)
+        and 'SplitPart' not in node
+        and not meta_store.get(ATOM_SLUG_KEY)
+        and node_size(node) <= max_file_bytes
+    )
+
+def plan_batches(nodes: list, max_file_bytes: int, max_nodes: int) -> tuple:
+    """
+    Groups the small file nodes of a submission into batches of at most max_nodes.
+    Returns the batches and the nodes to preserve on their own, including any batch of one.
+    """
+    small = [node for node in nodes if batchable(node, max_file_bytes)]
+    singles = [node for node in nodes if not batchable(node, max_file_bytes)]
+    batches = []
+    for start in range(0, len(small), max_nodes):
+        batch = small[start:start + max_nodes]
+        if len(batch) > 1:
+            batches.append(batch)
+        else:
+            singles += batch
+    return batches, singles
@@ -0,0 +1,167 @@
+import contextvars
+import logging
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("preservation")
+
+# Reason a job is stopped when its worker no longer holds its lease, rather than because it was asked to
+LEASE_LOST = 'lease lost'
+
+
+class Cancelled(Exception):
+    """
+    Raised in a job's thread once the job has been cancelled.
+    """
+
+
+class CancelToken:
+    """
+    Cancels a running job: kills the subprocesses and a3m client containers registered
+    on it, and makes the job raise Cancelled at its next stage or check.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self.reason = None
+        self._processes = set()
+        self._containers = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(f"Job stopped: {self.reason}" if self.reason else "Job cancelled")
+
+    def sleep(self, seconds: float):
+        self._cancelled.wait(seconds)
+        self.check()
+
+    def cancel(self, reason: str = None):
+        with self._lock:
+            # The first reason stands, a lost lease doesn't turn a requested cancel into a requeue
+            if not self._cancelled.is_set():
+                self.reason = reason
+            self._cancelled.set()
+            processes, containers = list(self._processes), list(self._containers)
+        for process in processes:
+            logger.info(f"Killing {process.args[0]} ({process.pid}) of cancelled job")
+            try:
+                process.kill()
+            except OSError:
+                continue
+        for container in containers:
+            logger.info(f"Stopping a3m client container {container.name} of cancelled job")
+            try:
+                container.kill()
+            except Exception as e:
+                logger.error(f"Failed to stop container {container.name}: {e}")
+
+    @contextmanager
+    def stopping(self, container):
+        """
+        Kills container if the job is cancelled while the block runs.
+        """
+        with self._lock:
+            self._containers.add(container)
+        try:
+            if self.cancelled:
+                container.kill()
+            yield
+        finally:
+            with self._lock:
+                self._containers.discard(container)
+
+    def run(self, args: list, check: bool = False, capture_output: bool = False, timeout: float = None,
+            **kwargs) -> subprocess.CompletedProcess:
+        self.check()
+        if capture_output:
+            kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+        with subprocess.Popen(args, **kwargs) as process:
+            with self._lock:
+                self._processes.add(process)
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+        self.check()
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+# The token of the job running in this thread
+_current = contextvars.ContextVar('cancel_token', default=None)
+
+@contextmanager
+def activate(token: CancelToken):
+    """
+    Makes token the current job's for the block.
+    """
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+def current() -> CancelToken:
+    return _current.get()
+
+def cancelled() -> bool:
+    token = _current.get()
+    return token is not None and token.cancelled
+
+def lease_lost() -> bool:
+    """
+    Whether the current job was stopped because its worker lost the lease on it.
+    """
+    token = _current.get()
+    return token is not None and token.cancelled and token.reason == LEASE_LOST
+
+def check():
+    """
+    Raises Cancelled if the current job has been cancelled.
+    """
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+def sleep(seconds: float):
+    """
+    time.sleep that ends early, raising Cancelled, when the current job is cancelled.
+    """
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+def run(args: list, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run that the current job's cancellation kills, raising Cancelled.
+    """
+    token = _current.get()
+    if token is None:
+        return subprocess.run(args, **kwargs)
+    return token.run(args, **kwargs)
+
+@contextmanager
+def stopping(container):
+    """
+    Kills container if the current job is cancelled while the block runs.
+    """
+    token = _current.get()
+    if token is None:
+        yield
+        return
+    with token.stopping(container):
+        yield
@@ -5,19 +5,24 @@ import requests
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from config import HTTP_TIMEOUT_SECONDS
+from preservation import cancellation, metrics, resilience, tracing
+
 logger = logging.getLogger("preservation")
 
 token_timeout_minutes = 5
 
 class CurateManager:
-    def __init__(self, user: str, curate_url: str):
+    def __init__(self, user: str, curate_url: str, configure_client: bool = True):
         self._user: str = user
         self._url: str = curate_url
         self._token: str = None
         self._token_timeout: datetime = datetime.min
         self._admin_token: str = None
         self._admin_token_timeout: datetime = datetime.min
-        self._configure_cells_client()
+        # Workers that only update tags must not repoint the shared cec config
+        if configure_client:
+            self._configure_cells_client()
 
     def token(self, user) -> str:
         if user == 'admin':
@@ -37,14 +42,15 @@ class CurateManager:
     def _gen_new_token(self, user):
         commands = ['cells', 'admin', 'user', 'token', '-u', user, '-e', f'{token_timeout_minutes}m', '--quiet']
         try:
-            result = subprocess.run(commands, capture_output=True, text=True, check=True, timeout=5)
+            with tracing.span('cells admin user token', 'subprocess', user=user):
+                result = subprocess.run(commands, capture_output=True, text=True, check=True, timeout=5)
             result.check_returncode()
         except subprocess.TimeoutExpired as e:
             logger.error("Token generation timed out. Is cells running?")
-            raise RuntimeError("Token generation timed out. Is cells running?") from e
+            raise resilience.TransientError("Token generation timed out. Is cells running?") from e
         except subprocess.CalledProcessError as e:
             logger.error("Failed to generate token.")
-            raise RuntimeError("Failed to generate token.") from e
+            raise resilience.TransientError("Failed to generate token.") from e
 
         token = result.stdout.strip()
         if not token:
@@ -55,89 +61,106 @@ class CurateManager:
     def _configure_cells_client(self):
         commands = ['cec', 'configure', 'token', '--url', self._url, '--login', self._user, '--token', self.token(self._user)]
         try:
-            output = subprocess.run(commands, capture_output=True, text=True, check=True)
+            with tracing.span('cec configure', 'subprocess', user=self._user):
+                output = subprocess.run(commands, capture_output=True, text=True, check=True)
             output.check_returncode()
         except subprocess.CalledProcessError as e:
             logger.error("Failed to configure Cells Client.")
             raise RuntimeError("Failed to configure Cells Client.") from e
 
-    def update_tag(self, node_id: str, tag: str):
+    def update_tag(self, node_id: str, tag: str, dip: bool = False):
         try:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f"Bearer {self.token('admin')}"
-            }
-            payload = json.dumps({
-                "MetaDatas": [
-                    {
-                        "JsonValue": f"\"{tag}\"",
-                        "Namespace": "usermeta-a3m-progress",
-                        "NodeUuid": node_id
-                    }
-                ],
-                "Operation": "PUT"
-            })
-            endpoint = f'{self._url}/a/user-meta/update'
-            response = requests.put(endpoint, headers=headers, data=payload)
-            response.raise_for_status()
-            logger.debug(f"Tag: {tag} updated for node: {node_id}")
+            resilience.call('curate', 'user-meta/update', lambda: self._update_tag(node_id, tag, dip))
+            logger.info(f"{'usermeta-dip-progress' if dip else 'usermeta-a3m-progress'}: {tag} updated for node: {node_id}")
         except Exception as e:
             err_msg = f"Unexpected error: {e}"
             logger.error(err_msg)
             raise RuntimeError(err_msg) from e
 
-    def update_tag(self, node_id: str, tag: str, dip: bool = False):
-        try:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f"Bearer {self.token('admin')}"
-            }
-            payload = json.dumps({
-                "MetaDatas": [
-                    {
-                        "JsonValue": f"\"{tag}\"",
-                        "Namespace": f"{'usermeta-dip-progress' if dip else 'usermeta-a3m-progress'}",
-                        "NodeUuid": node_id
-                    }
-                ],
-                "Operation": "PUT"
-            })
-            endpoint = f'{self._url}/a/user-meta/update'
-            response = requests.put(endpoint, headers=headers, data=payload)
+    def _update_tag(self, node_id: str, tag: str, dip: bool):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f"Bearer {self.token('admin')}"
+        }
+        payload = json.dumps({
+            "MetaDatas": [
+                {
+                    "JsonValue": f"\"{tag}\"",
+                    "Namespace": f"{'usermeta-dip-progress' if dip else 'usermeta-a3m-progress'}",
+                    "NodeUuid": node_id
+                }
+            ],
+            "Operation": "PUT"
+        })
+        endpoint = f'{self._url}/a/user-meta/update'
+        with tracing.span('curate user-meta/update', 'curate', node_uuid=node_id, tag=tag), \
+                metrics.timed('preservation_http_request', {'service': 'curate', 'endpoint': 'user-meta/update'}):
+            response = requests.put(endpoint, headers=headers, data=payload, timeout=HTTP_TIMEOUT_SECONDS)
             response.raise_for_status()
-            logger.info(f"{'usermeta-dip-progress' if dip else 'usermeta-a3m-progress'}: {tag} updated for node: {node_id}")
+
+    def gather_child_nodes(self, parent_curate_node_path: str, recursive: bool = True) -> list:
+        logger.info(f"Gathering {'descendants' if recursive else 'children'} of {parent_curate_node_path}")
+        try:
+            response = resilience.call('curate', 'tree/admin/list', lambda: self._list_children(parent_curate_node_path, recursive))
         except Exception as e:
             err_msg = f"Unexpected error: {e}"
             logger.error(err_msg)
             raise RuntimeError(err_msg) from e
+        return response.json().get('Children', [])
 
-    def gather_child_nodes(self, parent_curate_node_path: str) -> list:
-        logger.info(f"Gathering children of {parent_curate_node_path}")
-        try:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f"Bearer {self.token('admin')}"
-            }
-            payload = json.dumps({
-                "Node": {
-                    "Path": str(parent_curate_node_path)
-                },
-                "Recursive": True
-            })
-            endpoint = f"{self._url}/a/tree/admin/list"
-            response = requests.post(endpoint, headers=headers, data=payload)
+    def _list_children(self, parent_curate_node_path: str, recursive: bool) -> requests.Response:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f"Bearer {self.token('admin')}"
+        }
+        payload = json.dumps({
+            "Node": {
+                "Path": str(parent_curate_node_path)
+            },
+            "Recursive": recursive
+        })
+        endpoint = f"{self._url}/a/tree/admin/list"
+        with tracing.span('curate tree/admin/list', 'curate', path=parent_curate_node_path, recursive=recursive) as span, \
+                metrics.timed('preservation_http_request', {'service': 'curate', 'endpoint': 'tree/admin/list'}):
+            response = requests.post(endpoint, headers=headers, data=payload, timeout=HTTP_TIMEOUT_SECONDS)
             response.raise_for_status()
-        
+            span['bytes'] = len(response.content)
+        return response
+
+    def search_user_meta(self, node_uuids: list) -> dict:
+        """
+        Returns the user metadata of each node as a MetaStore, keyed by node UUID.
+        """
+        try:
+            response = resilience.call('curate', 'user-meta/search', lambda: self._search_user_meta(node_uuids))
         except Exception as e:
             err_msg = f"Unexpected error: {e}"
             logger.error(err_msg)
             raise RuntimeError(err_msg) from e
-        return response.json().get('Children', [])
+        meta_stores = {node_uuid: {} for node_uuid in node_uuids}
+        for meta in response.json().get('Metadatas', []):
+            meta_stores.setdefault(meta['NodeUuid'], {})[meta['Namespace']] = meta['JsonValue']
+        return meta_stores
+
+    def _search_user_meta(self, node_uuids: list) -> requests.Response:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f"Bearer {self.token('admin')}"
+        }
+        payload = json.dumps({"NodeUuids": list(node_uuids)})
+        endpoint = f"{self._url}/a/user-meta/search"
+        with tracing.span('curate user-meta/search', 'curate', nodes=len(node_uuids)) as span, \
+                metrics.timed('preservation_http_request', {'service': 'curate', 'endpoint': 'user-meta/search'}):
+            response = requests.post(endpoint, headers=headers, data=payload, timeout=HTTP_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            span['bytes'] = len(response.content)
+        return response
 
     def download_node(self, destination_path: Path, node_path: Path) -> Path:
         destination_path.mkdir(parents=True, exist_ok=True)
         commands = ['cec', 'scp', f'cells:///{str(node_path)}', str(destination_path)]
-        subprocess.run(commands, capture_output=True, text=True, check=True)
+        with tracing.span('cec scp download', 'subprocess', path=node_path):
+            cancellation.run(commands, capture_output=True, text=True, check=True)
         
         downloaded_files = list(destination_path.iterdir())
         if len(downloaded_files) == 1:
@@ -147,5 +170,6 @@ class CurateManager:
 
     def upload_node(self, file_path: Path, curate_destination: str) -> Path:
         commands = ['cec', 'scp', str(file_path), f'cells://{curate_destination}/']
-        subprocess.run(commands, capture_output=True, text=True, check=True)
+        with tracing.span('cec scp upload', 'subprocess', path=file_path, destination=curate_destination):
+            cancellation.run(commands, capture_output=True, text=True, check=True)
         return Path(curate_destination) / file_path.name
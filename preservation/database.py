@@ -1,14 +1,37 @@
 import os
+import json
 import logging
 import sqlite3 as sqlite
+import time
+
+from config import DATABASE_PATH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, SCHEDULER_MAX_WAIT_SECONDS
+from db.models.job_model import JOB_PRIORITIES, init_db as init_job_db, queue_estimate, remaining_estimate
+from db.models.metrics_model import init_db as init_metrics_db
+from db.models.preservation_model import init_db as init_preservation_db
 
 logger = logging.getLogger("preservation")
 
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/preservation.db'))
+DB_PATH = DATABASE_PATH or os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/preservation.db'))
+
+class LeaseLost(Exception):
+    """
+    Raised when a job is written to by a worker that no longer holds its lease.
+    """
+
+def _lease(owner: str) -> tuple:
+    # Restricts a job update to the lease owner, when there is one
+    return ("AND lease_owner = ?", (owner,)) if owner is not None else ('', ())
+
+def _check_owned(cursor, job_id: int, owner: str):
+    if owner is not None and cursor.rowcount == 0:
+        raise LeaseLost(f"Job {job_id} is no longer leased to {owner}")
 
 class DatabaseManager:
     def __init__(self):
         self.db_file = DB_PATH
+        init_preservation_db()
+        init_job_db()
+        init_metrics_db()
 
     def get_preservation_processing_configs(self, config_id):
         """
@@ -17,6 +40,7 @@ class DatabaseManager:
         Returns processing config and a3m config.
         """
         with sqlite.connect(self.db_file) as conn:
+            conn.row_factory = sqlite.Row
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM preservation_configs WHERE id = ?", (config_id,))
             matching_row = cursor.fetchone()
@@ -29,7 +53,11 @@ class DatabaseManager:
             'description': matching_row[14],
             'process_type': matching_row[2],
             'compress_aip': bool(matching_row[3]),
-            'image_normalization_tiff': bool(matching_row[11])
+            'image_normalization_tiff': bool(matching_row[11]),
+            'split_max_bytes': matching_row['split_max_bytes'],
+            'split_max_files': matching_row['split_max_files'],
+            'batch_max_file_bytes': matching_row['batch_max_file_bytes'],
+            'batch_max_nodes': matching_row['batch_max_nodes']
         }
         a3m_config = {
             "generate_transfer_structure_report": bool(matching_row[4]),
@@ -42,8 +70,8 @@ class DatabaseManager:
             "dip_enabled": bool(matching_row[16])
         }
         logger.debug(f"Loaded processing configs from database.")
-        logger.debug(f"Processing config: {processing_config}.")
-        logger.debug(f"A3M config: {a3m_config}.")
+        logger.debug("Processing config: %s.", processing_config)
+        logger.debug("A3M config: %s.", a3m_config)
         return processing_config, a3m_config
             
     def get_atom_config(self):
@@ -61,5 +89,400 @@ class DatabaseManager:
                 "password": matching_row[4]
             }
         logger.debug(f"Loaded AtoM configs from database.")
-        logger.debug(f"AtoM config: {atom_config}.")
+        logger.debug("AtoM config: %s.", atom_config)
         return atom_config
+
+    def create_job(self, node_uuid: str, node_path: str, user: str, config_id: int, node: dict = None,
+                   profile: bool = False, force: bool = False, priority: int = JOB_PRIORITIES['normal']) -> int:
+        """
+        Records a new queued preservation job.
+        Jobs created with their Curate node can be claimed by a worker.
+        Returns the job ID.
+        """
+        node_json = json.dumps(node) if node is not None else None
+        size = str((node or {}).get('Size', ''))
+        size_bytes = int(size) if size.isdigit() else None
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            cursor = conn.execute('''
+                INSERT INTO preservation_jobs (node_uuid, node_path, user, config_id, node_json, profile, force, size_bytes, priority)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (node_uuid, str(node_path), user, config_id, node_json, int(profile), int(force), size_bytes, priority))
+            return cursor.lastrowid
+
+    def _reclaim_expired_leases(self, conn):
+        """
+        Requeues running jobs whose worker stopped renewing its lease, or fails them
+        once they have been claimed JOB_MAX_ATTEMPTS times. Jobs asked to stop are cancelled.
+        """
+        now = time.time()
+        expired = "status = 'running' AND lease_expires < ?"
+        conn.execute(f'''
+            UPDATE preservation_jobs
+            SET status = 'cancelled', stage = NULL, lease_owner = NULL, lease_expires = NULL,
+                finished = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP
+            WHERE {expired} AND cancel_requested = 1
+        ''', (now,))
+        requeued = conn.execute(f'''
+            UPDATE preservation_jobs
+            SET status = 'queued', stage = NULL, lease_owner = NULL, lease_expires = NULL, modified = CURRENT_TIMESTAMP
+            WHERE {expired} AND attempts < ? AND node_json IS NOT NULL
+        ''', (now, JOB_MAX_ATTEMPTS)).rowcount
+        failed = conn.execute(f'''
+            UPDATE preservation_jobs
+            SET status = 'failed', error = 'Lease expired after ' || attempts || ' attempts', stage = NULL,
+                lease_owner = NULL, lease_expires = NULL, finished = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP
+            WHERE {expired}
+        ''', (now,)).rowcount
+        if requeued or failed:
+            logger.info(f"Reclaimed expired leases: requeued {requeued} jobs, failed {failed}")
+
+    def claim_next_job(self, owner: str) -> dict:
+        """
+        Claims the next queued job for owner, leasing it for JOB_LEASE_SECONDS.
+        Jobs whose lease has expired are reclaimed first.
+
+        Jobs queued for longer than SCHEDULER_MAX_WAIT_SECONDS go first, oldest first.
+        Otherwise the highest priority waiting wins, and between users waiting at that
+        priority the one with the fewest running jobs, then the longest waiting, gets
+        the turn. Configs at their max_concurrent_jobs are passed over.
+        Returns the job with its Curate node, or None when nothing can be claimed.
+        """
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._reclaim_expired_leases(conn)
+            running_users, running_configs = {}, {}
+            for row in conn.execute("SELECT user, config_id, COUNT(*) FROM preservation_jobs WHERE status = 'running' GROUP BY user, config_id"):
+                running_users[row[0]] = running_users.get(row[0], 0) + row[2]
+                running_configs[row[1]] = running_configs.get(row[1], 0) + row[2]
+            capped = [
+                config_id for config_id, cap in conn.execute('SELECT id, max_concurrent_jobs FROM preservation_configs WHERE max_concurrent_jobs > 0')
+                if running_configs.get(config_id, 0) >= cap
+            ]
+            uncapped = f"AND config_id NOT IN ({', '.join('?' * len(capped))})" if capped else ''
+            queued = f"status = 'queued' AND node_json IS NOT NULL AND (not_before IS NULL OR not_before <= ?) {uncapped}"
+            queued_params = (time.time(), *capped)
+
+            row = conn.execute(f'''
+                SELECT * FROM preservation_jobs
+                WHERE {queued} AND created <= datetime('now', ?)
+                ORDER BY id
+                LIMIT 1
+            ''', (*queued_params, f"-{SCHEDULER_MAX_WAIT_SECONDS} seconds")).fetchone()
+            if row is None:
+                heads = conn.execute(f'''
+                    SELECT user, priority, MIN(id) AS id FROM preservation_jobs
+                    WHERE {queued}
+                    GROUP BY user, priority
+                ''', queued_params).fetchall()
+                if heads:
+                    head = max(heads, key=lambda head: (head['priority'], -running_users.get(head['user'], 0), -head['id']))
+                    row = conn.execute('SELECT * FROM preservation_jobs WHERE id = ?', (head['id'],)).fetchone()
+            lease_expires = time.time() + JOB_LEASE_SECONDS
+            if row:
+                conn.execute('''
+                    UPDATE preservation_jobs
+                    SET status = 'running', started = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP,
+                        lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                    WHERE id = ?
+                ''', (owner, lease_expires, row['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if not row:
+            return None
+        job = dict(row)
+        job.update(status='running', lease_owner=owner, lease_expires=lease_expires, attempts=job['attempts'] + 1)
+        job['node'] = json.loads(job.pop('node_json'))
+        return job
+
+    def claim_batch_jobs(self, job: dict, limit: int, max_file_bytes: int) -> list:
+        """
+        Claims up to limit more queued jobs that can share a transfer with job:
+        same user and config, and batchable with at most max_file_bytes.
+        They are leased to the owner of job.
+        """
+        # Batching imports admission, which imports this module
+        from preservation.batching import batchable
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        jobs = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute('''
+                SELECT * FROM preservation_jobs
+                WHERE status = 'queued' AND node_json IS NOT NULL AND user = ? AND config_id = ?
+                    AND size_bytes <= ? AND split_group IS NULL AND (not_before IS NULL OR not_before <= ?)
+                ORDER BY id
+                LIMIT ?
+            ''', (job['user'], job['config_id'], max_file_bytes, time.time(), limit * 2)).fetchall()
+            for row in rows:
+                node = json.loads(row['node_json'])
+                if len(jobs) == limit or not batchable(node, max_file_bytes):
+                    continue
+                conn.execute('''
+                    UPDATE preservation_jobs
+                    SET status = 'running', started = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP,
+                        lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                    WHERE id = ?
+                ''', (job['lease_owner'], job['lease_expires'], row['id']))
+                claimed = dict(row)
+                claimed.update(status='running', lease_owner=job['lease_owner'], lease_expires=job['lease_expires'],
+                               attempts=row['attempts'] + 1)
+                claimed['node'] = node
+                del claimed['node_json']
+                jobs.append(claimed)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return jobs
+
+    def renew_leases(self, job_ids: list, owner: str) -> list:
+        """
+        Extends the leases owner holds on running jobs by JOB_LEASE_SECONDS.
+        Returns the IDs of the jobs whose lease owner no longer holds.
+        """
+        lease_expires = time.time() + JOB_LEASE_SECONDS
+        lost = []
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            for job_id in job_ids:
+                cursor = conn.execute('''
+                    UPDATE preservation_jobs SET lease_expires = ?
+                    WHERE id = ? AND lease_owner = ? AND status = 'running'
+                ''', (lease_expires, job_id, owner))
+                # A job this owner has finished keeps its lease owner, one reclaimed by another worker doesn't
+                if cursor.rowcount == 0 and not conn.execute(
+                        "SELECT 1 FROM preservation_jobs WHERE id = ? AND lease_owner = ?", (job_id, owner)).fetchone():
+                    lost.append(job_id)
+        return lost
+
+    def get_cancel_requests(self, job_ids: list) -> set:
+        """
+        Returns the IDs of the running jobs that have been asked to stop.
+        """
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            rows = conn.execute(f'''
+                SELECT id FROM preservation_jobs
+                WHERE id IN ({', '.join('?' * len(job_ids))}) AND cancel_requested = 1
+            ''', list(job_ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def requeue_jobs(self, job_ids: list, owner: str = None, delay: float = 0):
+        """
+        Puts running jobs back in the queue, for the rest of a batch stopped by one of its jobs being cancelled
+        or a job whose node doesn't fit on disk yet. They aren't claimed again for delay seconds,
+        and the claim doesn't count towards JOB_MAX_ATTEMPTS.
+        Given an owner, only the jobs it still holds the lease on.
+        """
+        lease, lease_params = _lease(owner)
+        not_before = time.time() + delay if delay else None
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            conn.executemany(f'''
+                UPDATE preservation_jobs
+                SET status = 'queued', stage = NULL, started = NULL, batch_id = NULL, lease_owner = NULL,
+                    lease_expires = NULL, not_before = ?, attempts = MAX(attempts - 1, 0), modified = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running' {lease}
+            ''', [(not_before, job_id, *lease_params) for job_id in job_ids])
+
+    # Given the owner of a job's lease, the job writes below raise LeaseLost once it no longer holds it,
+    # so a worker whose job was reclaimed can't overwrite what the new owner records
+
+    def start_job(self, job_id: int, owner: str = None):
+        lease, lease_params = _lease(owner)
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            cursor = conn.execute(f'''
+                UPDATE preservation_jobs
+                SET status = 'running', started = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP
+                WHERE id = ? {lease}
+            ''', (job_id, *lease_params))
+            _check_owned(cursor, job_id, owner)
+
+    def update_job(self, job_id: int, owner: str = None, **fields):
+        """
+        Updates the given columns of a job.
+        """
+        columns = ', '.join(f"{column} = ?" for column in fields)
+        lease, lease_params = _lease(owner)
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            cursor = conn.execute(
+                f"UPDATE preservation_jobs SET {columns}, modified = CURRENT_TIMESTAMP WHERE id = ? {lease}",
+                (*fields.values(), job_id, *lease_params)
+            )
+            _check_owned(cursor, job_id, owner)
+
+    def finish_job(self, job_id: int, status: str, error: str = None, owner: str = None):
+        lease, lease_params = _lease(owner)
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            cursor = conn.execute(f'''
+                UPDATE preservation_jobs
+                SET status = ?, error = ?, stage = NULL, finished = CURRENT_TIMESTAMP, modified = CURRENT_TIMESTAMP,
+                    node_json = CASE WHEN ? = 'completed' THEN NULL ELSE node_json END
+                WHERE id = ? {lease}
+            ''', (status, error, status, job_id, *lease_params))
+            _check_owned(cursor, job_id, owner)
+
+    def get_queue_estimates(self, limit: int) -> list:
+        """
+        Returns the queue position and estimated start of the jobs at the front of the queue.
+        """
+        conn = sqlite.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite.Row
+        try:
+            jobs = conn.execute('''
+                SELECT id, node_uuid, user, priority FROM preservation_jobs
+                WHERE status = 'queued' AND node_json IS NOT NULL
+                ORDER BY priority DESC, id
+                LIMIT ?
+            ''', (limit,)).fetchall()
+            return [queue_estimate(conn, job) for job in jobs]
+        finally:
+            conn.close()
+
+    def claim_interval(self, name: str, interval: float) -> bool:
+        """
+        Returns True to one caller per interval across every process, for periodic work
+        that only one worker should do.
+        """
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS scheduler_state (name TEXT PRIMARY KEY, last_run REAL NOT NULL)")
+            now = time.time()
+            conn.execute("INSERT OR IGNORE INTO scheduler_state (name, last_run) VALUES (?, 0)", (name,))
+            cursor = conn.execute(
+                "UPDATE scheduler_state SET last_run = ? WHERE name = ? AND last_run <= ?", (now, name, now - interval)
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def is_job_queued(self, job_id: int) -> bool:
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            row = conn.execute("SELECT 1 FROM preservation_jobs WHERE id = ? AND status = 'queued'", (job_id,)).fetchone()
+        return row is not None
+
+    def get_job_priority(self, job_id: int) -> int:
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            row = conn.execute('SELECT priority FROM preservation_jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else JOB_PRIORITIES['normal']
+
+    def get_jobs_by_processing_directory(self) -> dict:
+        """
+        Returns the latest job of each recorded processing directory, keyed by path.
+        """
+        conn = sqlite.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite.Row
+        try:
+            rows = conn.execute('''
+                SELECT processing_directory, id, status, aip_uuid, lease_expires FROM preservation_jobs
+                WHERE processing_directory IS NOT NULL
+                ORDER BY id
+            ''').fetchall()
+        finally:
+            conn.close()
+        return {row['processing_directory']: dict(row) for row in rows}
+
+    def get_peak_ratios(self, config_id: int, limit: int) -> list:
+        """
+        Returns the observed peak disk usage / node size of the latest jobs of a config that recorded one.
+        """
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            rows = conn.execute('''
+                SELECT peak_bytes * 1.0 / size_bytes FROM preservation_jobs
+                WHERE config_id = ? AND peak_bytes IS NOT NULL AND size_bytes > 0
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (config_id, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_split_progress(self, split_group: str) -> dict:
+        """
+        Counts the part jobs of a split directory by status.
+        """
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            rows = conn.execute('''
+                SELECT status, COUNT(*) FROM preservation_jobs
+                WHERE split_group = ? AND split_part IS NOT NULL
+                GROUP BY status
+            ''', (split_group,)).fetchall()
+        return {status: count for status, count in rows}
+
+    def get_running_aip_uuids(self) -> set:
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            rows = conn.execute('''
+                SELECT aip_uuid FROM preservation_jobs WHERE status = 'running' AND aip_uuid IS NOT NULL
+            ''').fetchall()
+        return {row[0] for row in rows}
+
+    def start_job_stage(self, job_id: int, stage: str, owner: str = None) -> int:
+        """
+        Records the start of a job stage.
+        Returns the stage ID.
+        """
+        lease, lease_params = _lease(owner)
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            cursor = conn.execute(f'''
+                UPDATE preservation_jobs SET stage = ?, modified = CURRENT_TIMESTAMP WHERE id = ? {lease}
+            ''', (stage, job_id, *lease_params))
+            _check_owned(cursor, job_id, owner)
+            cursor = conn.execute('''
+                INSERT INTO preservation_job_stages (job_id, stage) VALUES (?, ?)
+            ''', (job_id, stage))
+            return cursor.lastrowid
+
+    def finish_job_stage(self, job_id: int, stage_id: int, duration: float, outcome: str, bytes: int = None,
+                         features: dict = None, owner: str = None):
+        """
+        Records the end of a job stage, with the config_id, input_bytes, file_count and
+        compression of the package it handled in features.
+        """
+        features = features or {}
+        lease, lease_params = _lease(owner)
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            conn.execute('''
+                UPDATE preservation_job_stages
+                SET finished = CURRENT_TIMESTAMP, duration = ?, bytes = ?, outcome = ?,
+                    config_id = ?, input_bytes = ?, file_count = ?, compression = ?
+                WHERE id = ?
+            ''', (duration, bytes, outcome, features.get('config_id'), features.get('input_bytes'),
+                  features.get('file_count'), features.get('compression'), stage_id))
+            # The job is between stages until the next one starts
+            cursor = conn.execute(f'''
+                UPDATE preservation_jobs
+                SET stage = CASE WHEN stage = (SELECT stage FROM preservation_job_stages WHERE id = ?) THEN NULL ELSE stage END
+                WHERE id = ? {lease}
+            ''', (stage_id, job_id, *lease_params))
+            _check_owned(cursor, job_id, owner)
+
+    def get_remaining_estimate(self, job_id: int) -> dict:
+        """
+        Returns the predicted remaining time of a queued or running job, or None if it has finished.
+        """
+        conn = sqlite.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite.Row
+        try:
+            job = conn.execute(
+                "SELECT * FROM preservation_jobs WHERE id = ? AND status IN ('queued', 'running')", (job_id,)
+            ).fetchone()
+            return remaining_estimate(conn, job) if job else None
+        finally:
+            conn.close()
+
+    def add_metric_samples(self, samples: list):
+        """
+        Adds (family, type, name, labels, value) samples to the shared metrics store.
+        Counters and histograms are added to, gauges take the new value.
+        """
+        with sqlite.connect(self.db_file, timeout=30) as conn:
+            conn.executemany('''
+                INSERT INTO metrics (family, type, name, labels, value)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name, labels) DO UPDATE
+                SET value = CASE WHEN excluded.type = 'gauge' THEN excluded.value ELSE value + excluded.value END
+            ''', samples)
@@ -0,0 +1,255 @@
+import logging
+import shutil
+import sqlite3 as sqlite
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import (
+    CURATE_URL, DIP_QUEUE_DIRECTORY, DIP_QUEUE_WORKERS, DIP_MAX_ATTEMPTS,
+    DIP_RETRY_BACKOFF_SECONDS, DIP_RETRY_BACKOFF_MAX_SECONDS
+)
+from preservation import logs, resilience, tracing
+from preservation.atom import AtoMManager
+from preservation.curate import CurateManager
+from preservation.database import DB_PATH
+from preservation.worker_api import database_manager
+
+logger = logging.getLogger("preservation")
+
+class DIPQueue:
+    """
+    Durable queue of DIPs waiting to be deposited in AtoM.
+
+    Entries are stored in the preservation database so DIPs survive restarts
+    and drain independently of the AIP workflow.
+    """
+    def __init__(self):
+        self.db_file = DB_PATH
+        self.staging_directory = Path(DIP_QUEUE_DIRECTORY)
+        self.staging_directory.mkdir(parents=True, exist_ok=True)
+        self._init_table()
+
+    def _connect(self):
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        return conn
+
+    def _init_table(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dip_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_uuid TEXT NOT NULL,
+                    node_path TEXT NOT NULL,
+                    aip_uuid TEXT NOT NULL,
+                    slug TEXT NOT NULL,
+                    dip_path TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    status TEXT CHECK(status IN ('queued', 'uploading', 'completed', 'failed')) DEFAULT 'queued' NOT NULL,
+                    attempts INTEGER DEFAULT 0 NOT NULL,
+                    last_error TEXT,
+                    next_attempt_at REAL DEFAULT 0 NOT NULL,
+                    created TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+                );
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_dip_queue_status ON dip_queue (status, next_attempt_at);")
+        finally:
+            conn.close()
+
+    def stage(self, dip_path: Path) -> Path:
+        """
+        Moves a DIP out of its processing directory into the queue staging directory.
+        Returns the staged DIP path.
+        """
+        staged_path = self.staging_directory / dip_path.name
+        if staged_path.exists():
+            shutil.rmtree(staged_path)
+        shutil.move(str(dip_path), str(staged_path))
+        logger.debug(f"Staged DIP {dip_path} to {staged_path}")
+        return staged_path
+
+    def enqueue(self, node_uuid: str, node_path: str, aip_uuid: str, slug: str, dip_path: Path, user: str) -> int:
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO dip_queue (node_uuid, node_path, aip_uuid, slug, dip_path, user, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (node_uuid, str(node_path), aip_uuid, slug, str(dip_path), user, time.time()))
+            entry_id = cursor.lastrowid
+        finally:
+            conn.close()
+        logger.info(f"Queued DIP {aip_uuid} for AtoM description {slug} (entry {entry_id})")
+        return entry_id
+
+    def claim(self) -> dict:
+        """
+        Claims the next due entry and marks it as uploading.
+        Returns None when nothing is due.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute('''
+                SELECT * FROM dip_queue
+                WHERE status = 'queued' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT 1
+            ''', (time.time(),)).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return None
+            conn.execute('''
+                UPDATE dip_queue
+                SET status = 'uploading', attempts = attempts + 1, modified = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (row['id'],))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        entry = dict(row)
+        entry['status'] = 'uploading'
+        entry['attempts'] += 1
+        return entry
+
+    def complete(self, entry_id: int):
+        self._set_status(entry_id, 'completed', None, 0)
+
+    def fail(self, entry_id: int, error: str, retry_at: float = None):
+        """
+        Records a failed attempt. The entry is re-queued when retry_at is given.
+        """
+        if retry_at is None:
+            self._set_status(entry_id, 'failed', error, 0)
+        else:
+            self._set_status(entry_id, 'queued', error, retry_at)
+
+    def requeue_interrupted(self) -> int:
+        """
+        Returns entries left uploading by a worker that died back to the queue.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                UPDATE dip_queue
+                SET status = 'queued', modified = CURRENT_TIMESTAMP
+                WHERE status = 'uploading'
+            ''')
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _set_status(self, entry_id: int, status: str, error: str, next_attempt_at: float):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE dip_queue
+                SET status = ?, last_error = ?, next_attempt_at = ?, modified = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, error, next_attempt_at, entry_id))
+        finally:
+            conn.close()
+
+
+class DIPWorker:
+    """
+    Drains the DIP queue into AtoM with a fixed pool of upload threads.
+    """
+    def __init__(self, workers: int = DIP_QUEUE_WORKERS, poll_interval: float = 5):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.queue = DIPQueue()
+        self.db_manager = database_manager()
+        self.curate_manager = CurateManager('admin', CURATE_URL, configure_client=False)
+        self._stop = threading.Event()
+
+    def _atom_manager(self) -> AtoMManager:
+        # Read per upload so credential changes apply without a restart
+        atom_config = self.db_manager.get_atom_config()
+        if not atom_config:
+            raise RuntimeError("AtoM config not found in database.")
+        return AtoMManager(atom_config)
+
+    def _retry_at(self, attempts: int) -> float:
+        if attempts >= DIP_MAX_ATTEMPTS:
+            return None
+        delay = min(DIP_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), DIP_RETRY_BACKOFF_MAX_SECONDS)
+        return time.time() + delay
+
+    def process_entry(self, entry: dict):
+        path = tracing.trace_path(f"dip-{entry['id']}-{entry['aip_uuid']}")
+        with logs.context(dip_id=entry['id'], node_uuid=entry['node_uuid'], aip_uuid=entry['aip_uuid']), \
+                tracing.trace('dip_upload', path, node_uuid=entry['node_uuid'], node_path=entry['node_path'],
+                              aip_uuid=entry['aip_uuid'], attempt=entry['attempts']):
+            self._upload_entry(entry)
+
+    def _upload_entry(self, entry: dict):
+        dip_path = Path(entry['dip_path'])
+        logger.info(f"Uploading DIP {entry['aip_uuid']} for {entry['node_path']} (attempt {entry['attempts']}/{DIP_MAX_ATTEMPTS})")
+        try:
+            self.curate_manager.update_tag(entry['node_uuid'], 'Uploading DIP...', dip=True)
+            self._atom_manager().upload_dip(dip_path, entry['slug'])
+        except Exception as e:
+            logger.error(f"DIP upload failed for {entry['node_path']}: {e}")
+            retry_at = self._retry_at(entry['attempts'])
+            self.queue.fail(entry['id'], str(e), retry_at)
+            try:
+                if retry_at is None:
+                    self.curate_manager.update_tag(entry['node_uuid'], 'DIP Failed', dip=True)
+                else:
+                    self.curate_manager.update_tag(entry['node_uuid'], 'DIP Queued - Retrying', dip=True)
+            except Exception as tag_error:
+                logger.error(f"Failed to update DIP tag for {entry['node_path']}: {tag_error}")
+            return
+
+        self.queue.complete(entry['id'])
+        logger.info(f"Uploaded DIP {entry['aip_uuid']} to AtoM")
+        shutil.rmtree(dip_path, ignore_errors=True)
+        try:
+            self.curate_manager.update_tag(entry['node_uuid'], 'DIP Uploaded', dip=True)
+        except Exception as e:
+            logger.error(f"Failed to update DIP tag for {entry['node_path']}: {e}")
+
+    def _run_loop(self):
+        while not self._stop.is_set():
+            # Nothing reads the executor's futures, so an error must not end the thread
+            try:
+                self._run_once()
+            except Exception as e:
+                logger.error(f"DIP worker iteration failed: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _run_once(self):
+        # DIPs stay queued while AtoM is down rather than using up their attempts,
+        # checking for stop between waits
+        try:
+            resilience.wait_until_available(('atom',), timeout=self.poll_interval)
+        except resilience.CircuitOpenError:
+            return
+        try:
+            entry = self.queue.claim()
+        except Exception as e:
+            logger.error(f"Failed to claim DIP queue entry: {e}")
+            entry = None
+        if entry is None:
+            self._stop.wait(self.poll_interval)
+            return
+        self.process_entry(entry)
+
+    def run(self):
+        requeued = self.queue.requeue_interrupted()
+        if requeued:
+            logger.info(f"Re-queued {requeued} interrupted DIP uploads")
+        logger.info(f"Starting DIP worker with {self.workers} upload threads")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dip') as executor:
+            for _ in range(self.workers):
+                executor.submit(self._run_loop)
+
+    def stop(self):
+        self._stop.set()
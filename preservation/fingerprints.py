@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import sqlite3 as sqlite
+
+from preservation import worker_api
+from preservation.database import DB_PATH
+
+logger = logging.getLogger("preservation")
+
+# Tags written by preservation itself, which must not count as changes
+PROGRESS_NAMESPACES = ('usermeta-a3m-progress', 'usermeta-dip-progress')
+
+def _node_state(node: dict) -> dict:
+    meta_store = node.get('MetaStore') or {}
+    return {
+        'Path': node.get('Path'),
+        'Etag': node.get('Etag'),
+        'Size': str(node.get('Size') or ''),
+        'MTime': str(node.get('MTime') or ''),
+        'Metadata': {
+            key: value for key, value in meta_store.items()
+            if key.startswith('usermeta-') and key not in PROGRESS_NAMESPACES
+        }
+    }
+
+def children_hash(children: list) -> str:
+    """
+    Hashes the state and metadata of every child node, independent of listing order.
+    """
+    digest = hashlib.sha256()
+    for child in sorted(children, key=lambda child: child.get('Path', '')):
+        digest.update(json.dumps(_node_state(child), sort_keys=True).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class FingerprintIndex:
+    """
+    Remembers the state of each node when its AIP was made, so unchanged nodes can be skipped.
+
+    A node is unchanged when its ETag, size, modification time and metadata, the hash
+    over its children and the config ID all match its last successful preservation.
+    """
+    def __init__(self):
+        self.db_file = DB_PATH
+        self._init_table()
+
+    def _connect(self):
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        return conn
+
+    def _init_table(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS node_fingerprints (
+                    node_uuid TEXT PRIMARY KEY,
+                    node_path TEXT NOT NULL,
+                    etag TEXT,
+                    size TEXT,
+                    mtime TEXT,
+                    metadata_hash TEXT NOT NULL,
+                    children_hash TEXT NOT NULL,
+                    config_id INTEGER NOT NULL,
+                    aip_uuid TEXT NOT NULL,
+                    job_id INTEGER,
+                    modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+                );
+            """)
+        finally:
+            conn.close()
+
+    def fingerprint(self, node: dict, children: list, config_id: int) -> dict:
+        state = _node_state(node)
+        return {
+            'etag': state['Etag'],
+            'size': state['Size'],
+            'mtime': state['MTime'],
+            'metadata_hash': hashlib.sha256(json.dumps(state['Metadata'], sort_keys=True).encode('utf-8')).hexdigest(),
+            'children_hash': children_hash(children),
+            'config_id': config_id
+        }
+
+    def unchanged(self, node_uuid: str, fingerprint: dict) -> dict:
+        """
+        Returns the last preservation of the node if it matches the fingerprint, otherwise None.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM node_fingerprints WHERE node_uuid = ?', (node_uuid,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or any(row[key] != value for key, value in fingerprint.items()):
+            return None
+        return dict(row)
+
+    def record(self, node_uuid: str, node_path: str, fingerprint: dict, aip_uuid: str, job_id: int = None):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO node_fingerprints (
+                    node_uuid, node_path, etag, size, mtime, metadata_hash, children_hash, config_id, aip_uuid, job_id
+                )
+                VALUES (:node_uuid, :node_path, :etag, :size, :mtime, :metadata_hash, :children_hash, :config_id, :aip_uuid, :job_id)
+                ON CONFLICT (node_uuid) DO UPDATE SET
+                    node_path = excluded.node_path, etag = excluded.etag, size = excluded.size, mtime = excluded.mtime,
+                    metadata_hash = excluded.metadata_hash, children_hash = excluded.children_hash,
+                    config_id = excluded.config_id, aip_uuid = excluded.aip_uuid, job_id = excluded.job_id,
+                    modified = CURRENT_TIMESTAMP
+            ''', {'node_uuid': node_uuid, 'node_path': str(node_path), 'aip_uuid': aip_uuid, 'job_id': job_id, **fingerprint})
+        finally:
+            conn.close()
+
+
+class RemoteFingerprintIndex(FingerprintIndex):
+    """
+    The FingerprintIndex of the host holding the job database, used through its worker API by workers on other hosts.
+    """
+    def unchanged(self, node_uuid: str, fingerprint: dict) -> dict:
+        return worker_api.call('fingerprints', 'unchanged', node_uuid, fingerprint)
+
+    def record(self, node_uuid: str, node_path: str, fingerprint: dict, aip_uuid: str, job_id: int = None):
+        worker_api.call('fingerprints', 'record', node_uuid, node_path, fingerprint, aip_uuid, job_id)
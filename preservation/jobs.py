@@ -0,0 +1,131 @@
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from preservation import cancellation, metrics, resilience, tracing
+from preservation.profiling import JobProfiler
+from preservation.database import DatabaseManager, LeaseLost
+
+logger = logging.getLogger("preservation")
+
+# Stages that call out to Curate, which don't start while its circuit is open
+STAGE_SERVICES = {
+    'gather': ('curate',),
+    'download': ('curate',),
+    'upload': ('curate',),
+}
+
+def format_remaining(seconds: float) -> str:
+    if seconds < 60:
+        return "<1 min"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} min"
+    return f"{minutes // 60} h {minutes % 60} min"
+
+def path_size(path: Path) -> int:
+    """
+    Returns the size in bytes of a file, or of all files under a directory.
+    """
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(child.stat().st_size for child in path.rglob('*') if child.is_file())
+
+
+class JobRecorder:
+    """
+    Records the progress of a preservation job in the preservation_jobs table.
+
+    Recording is best effort: a database error is logged and never fails the preservation.
+    Given the worker holding the job's lease as owner, a write the worker is no longer
+    allowed to make stops the job instead, as another worker may have reclaimed it.
+    """
+    def __init__(self, db_manager: DatabaseManager, job_id: int, owner: str = None):
+        self.db_manager = db_manager
+        self.job_id = job_id
+        self.owner = owner
+        self.profiler: JobProfiler = None
+        self.reservation = None
+        # Preserve even if the node is unchanged since its last AIP
+        self.force = False
+        # Package features recorded with each stage, which remaining time is predicted from
+        self.features = {}
+
+    @classmethod
+    def create(cls, db_manager: DatabaseManager, node: dict, user: str, config_id: int) -> 'JobRecorder':
+        try:
+            job_id = db_manager.create_job(node['Uuid'], node['Path'], user, config_id)
+        except Exception as e:
+            logger.error(f"Failed to record preservation job for {node['Path']}: {e}")
+            job_id = None
+        return cls(db_manager, job_id)
+
+    def _record(self, method, *args, **kwargs):
+        if self.job_id is None:
+            return None
+        try:
+            return method(*args, **kwargs)
+        except LeaseLost as e:
+            logger.warning(f"{e}, stopping it")
+            token = cancellation.current()
+            if token is not None:
+                token.cancel(cancellation.LEASE_LOST)
+            return None
+        except Exception as e:
+            logger.error(f"Failed to record preservation job {self.job_id}: {e}")
+            return None
+
+    def start(self):
+        self._record(self.db_manager.start_job, self.job_id, self.owner)
+
+    def update(self, **fields):
+        self._record(self.db_manager.update_job, self.job_id, self.owner, **fields)
+
+    def with_eta(self, message: str) -> str:
+        """
+        Appends the predicted remaining time of the job to a progress message, when there is one.
+        """
+        estimate = self._record(self.db_manager.get_remaining_estimate, self.job_id)
+        if not estimate or estimate['remaining_seconds'] is None:
+            return message
+        return f"{message} ~{format_remaining(estimate['remaining_seconds'])} left"
+
+    def finish(self, status: str, error: str = None):
+        metrics.inc('preservation_jobs_finished_total', labels={'status': status})
+        self._record(self.db_manager.finish_job, self.job_id, status, error, self.owner)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Records the duration and outcome of a stage.
+        Yields a dict, set 'bytes' on it to record the bytes the stage handled.
+        Waits first for the services the stage depends on to be available.
+        Raises Cancelled instead of starting the stage if the job has been cancelled.
+        """
+        cancellation.check()
+        resilience.wait_until_available(STAGE_SERVICES.get(name, ()))
+        stage_id = self._record(self.db_manager.start_job_stage, self.job_id, name, self.owner)
+        start = time.time()
+        outcome = 'failed'
+        details = {}
+        try:
+            with tracing.span(name, 'stage', job_id=self.job_id) as details, \
+                    (self.profiler.stage(name) if self.profiler else nullcontext()):
+                yield details
+            outcome = 'completed'
+        finally:
+            duration = time.time() - start
+            if outcome == 'failed' and cancellation.cancelled():
+                outcome = 'lease_lost' if cancellation.lease_lost() else 'cancelled'
+            if self.reservation:
+                self.reservation.observe()
+            metrics.observe('preservation_stage_duration_seconds', duration, {'stage': name})
+            if outcome == 'failed':
+                metrics.inc('preservation_stage_failures_total', labels={'stage': name})
+            if details.get('bytes'):
+                metrics.inc('preservation_stage_bytes_total', details['bytes'], {'stage': name})
+            if stage_id is not None:
+                self._record(self.db_manager.finish_job_stage, self.job_id, stage_id, duration, outcome, details.get('bytes'),
+                             self.features, self.owner)
@@ -0,0 +1,149 @@
+import json
+import logging
+import sqlite3 as sqlite
+import time
+
+from config import LISTING_CACHE_MAX_AGE_SECONDS, LISTING_CACHE_META_BATCH
+from preservation import metrics
+from preservation.curate import CurateManager
+from preservation.database import DB_PATH
+from preservation.splitting import is_collection
+
+logger = logging.getLogger("preservation")
+
+# Cells marks a folder's ETag dirty until it has been recomputed from its children
+DIRTY_ETAGS = ('', '-1')
+
+def _marker(node: dict) -> tuple:
+    return (node.get('Path'), node.get('Etag'), str(node.get('MTime') or ''))
+
+def _parent_path(node: dict) -> str:
+    return node['Path'].rstrip('/').rsplit('/', 1)[0]
+
+
+class ListingCache:
+    """
+    Remembers the children of each folder listed from Curate, so unchanged sub-trees aren't walked again.
+
+    Cells recomputes a folder's ETag and modification time whenever anything below it
+    changes, so a folder whose path, ETag and modification time match its cached listing
+    is served from the cache along with everything below it. Changed folders are listed
+    again one level at a time, and folders never seen before with one recursive listing.
+    User metadata isn't covered by those markers, so it is always refreshed for cached nodes.
+    """
+    def __init__(self):
+        self.db_file = DB_PATH
+        self._init_table()
+
+    def _connect(self):
+        conn = sqlite.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite.Row
+        return conn
+
+    def _init_table(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS child_listings (
+                    folder_uuid TEXT PRIMARY KEY,
+                    folder_path TEXT NOT NULL,
+                    etag TEXT,
+                    mtime TEXT,
+                    children_json TEXT NOT NULL,
+                    listed REAL NOT NULL
+                );
+            """)
+        finally:
+            conn.close()
+
+    def _cached(self, conn, folder: dict) -> list:
+        """
+        Returns the cached children of folder if its markers are unchanged, otherwise None.
+        """
+        if folder.get('Etag') in DIRTY_ETAGS:
+            return None
+        row = conn.execute('SELECT * FROM child_listings WHERE folder_uuid = ?', (folder['Uuid'],)).fetchone()
+        if row is None or time.time() - row['listed'] > LISTING_CACHE_MAX_AGE_SECONDS:
+            return None
+        if (row['folder_path'], row['etag'], row['mtime']) != _marker(folder):
+            return None
+        return json.loads(row['children_json'])
+
+    def _known(self, conn, folder: dict) -> bool:
+        return conn.execute('SELECT 1 FROM child_listings WHERE folder_uuid = ?', (folder['Uuid'],)).fetchone() is not None
+
+    def _store(self, conn, folder: dict, children: list):
+        path, etag, mtime = _marker(folder)
+        conn.execute('''
+            INSERT INTO child_listings (folder_uuid, folder_path, etag, mtime, children_json, listed)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (folder_uuid) DO UPDATE SET
+                folder_path = excluded.folder_path, etag = excluded.etag, mtime = excluded.mtime,
+                children_json = excluded.children_json, listed = excluded.listed
+        ''', (folder['Uuid'], path, etag, mtime, json.dumps(children), time.time()))
+
+    def _store_recursive(self, conn, folder: dict, descendants: list):
+        """
+        Caches the children of folder and of every folder below it from one recursive listing.
+        """
+        folders = {folder['Path'].rstrip('/'): folder}
+        folders.update({node['Path'].rstrip('/'): node for node in descendants if is_collection(node)})
+        children = {path: [] for path in folders}
+        for node in descendants:
+            children.setdefault(_parent_path(node), []).append(node)
+        conn.execute("BEGIN")
+        for path, node in folders.items():
+            self._store(conn, node, children[path])
+        conn.execute("COMMIT")
+
+    def _walk(self, conn, curate_manager: CurateManager, folder: dict, descendants: list, cached: list, stats: dict):
+        children = self._cached(conn, folder)
+        if children is not None:
+            stats['cached'] += 1
+            cached.extend(children)
+        elif not self._known(conn, folder):
+            stats['listed'] += 1
+            listing = curate_manager.gather_child_nodes(folder['Path'])
+            self._store_recursive(conn, folder, listing)
+            descendants.extend(listing)
+            return
+        else:
+            stats['listed'] += 1
+            children = curate_manager.gather_child_nodes(folder['Path'], recursive=False)
+            self._store(conn, folder, children)
+        descendants.extend(children)
+        for child in children:
+            if is_collection(child):
+                self._walk(conn, curate_manager, child, descendants, cached, stats)
+
+    def _refresh_metadata(self, curate_manager: CurateManager, nodes: list):
+        """
+        Replaces the cached user metadata of nodes with their current metadata.
+        """
+        for start in range(0, len(nodes), LISTING_CACHE_META_BATCH):
+            batch = nodes[start:start + LISTING_CACHE_META_BATCH]
+            meta_stores = curate_manager.search_user_meta([node['Uuid'] for node in batch])
+            for node in batch:
+                meta_store = {key: value for key, value in (node.get('MetaStore') or {}).items() if not key.startswith('usermeta-')}
+                meta_store.update(meta_stores.get(node['Uuid'], {}))
+                node['MetaStore'] = meta_store
+
+    def gather(self, curate_manager: CurateManager, folder: dict) -> list:
+        """
+        Returns every node below folder, as gather_child_nodes does, listing only what changed.
+        """
+        descendants, cached = [], []
+        stats = {'cached': 0, 'listed': 0}
+        conn = self._connect()
+        try:
+            self._walk(conn, curate_manager, folder, descendants, cached, stats)
+        finally:
+            conn.close()
+        self._refresh_metadata(curate_manager, cached)
+        metrics.inc('preservation_listing_cache_folders_total', stats['cached'], {'result': 'hit'})
+        metrics.inc('preservation_listing_cache_folders_total', stats['listed'], {'result': 'miss'})
+        logger.info(
+            f"Gathered {len(descendants)} children of {folder['Path']}: "
+            f"{stats['cached']} folders from cache, {stats['listed']} listed"
+        )
+        return descendants
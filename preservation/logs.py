@@ -0,0 +1,147 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+
+from config import LOG_DEBUG_SAMPLING, LOG_DIRECTORY, LOG_FORMAT, LOG_QUEUE_SIZE
+from preservation import metrics
+
+TEXT_FORMAT = "%(asctime)s %(filename)s:%(lineno)d %(levelname)s %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Attributes every record has, anything else on a record came from extra or the log context
+RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'taskName'}
+
+# Fields such as job_id and node_uuid added to every record logged inside context()
+_context = contextvars.ContextVar('log_context', default={})
+# The queue handler and writer thread of each configured log file
+_pipelines = []
+
+@contextmanager
+def context(**fields):
+    """
+    Adds fields to every record logged inside the block. Fields set to None are left out.
+    """
+    token = _context.set({**_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, with their context and extra fields.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'source': f"{record.filename}:{record.lineno}",
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of DEBUG records by logger and module name, as '{logger}.{module}'.
+    """
+    def __init__(self, rates: dict):
+        super().__init__()
+        # Longest names first, so the most specific match applies
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        name = f"{record.name}.{record.module}"
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(f"{prefix}."):
+                return random.random() < rate
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Hands records to a writer thread, so the logging thread never waits on the disk.
+
+    The message, exception and log context are resolved here, in the logging thread.
+    Records are dropped rather than blocking when the writer falls LOG_QUEUE_SIZE behind.
+    """
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.exception_formatter = logging.Formatter()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in _context.get().items():
+            record.__dict__.setdefault(key, value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc('preservation_log_records_dropped_total', labels={'logger': record.name})
+
+
+def configure(name: str, filename: str, level: int = logging.INFO, text_format: str = TEXT_FORMAT) -> logging.Logger:
+    """
+    Sends the records of logger name to filename in LOG_DIRECTORY through a writer thread,
+    formatted as LOG_FORMAT and sampled by LOG_DEBUG_SAMPLING. Returns the logger.
+    """
+    file_handler = logging.FileHandler(Path(LOG_DIRECTORY) / filename)
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(text_format, datefmt=DATE_FORMAT))
+    handler = ContextQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLING))
+    listener = QueueListener(handler.queue, file_handler)
+    listener.start()
+    _pipelines.append((handler, listener))
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    return logger
+
+def stop():
+    """
+    Writes out the records still queued and stops the writer threads.
+    """
+    while _pipelines:
+        handler, listener = _pipelines.pop()
+        listener.stop()
+        for file_handler in listener.handlers:
+            file_handler.close()
+
+def _restart_after_fork():
+    # Writer threads don't survive a fork, so a forked worker process starts its own
+    for index, (handler, listener) in enumerate(_pipelines):
+        handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        listener = QueueListener(handler.queue, *listener.handlers)
+        listener.start()
+        _pipelines[index] = (handler, listener)
+
+atexit.register(stop)
+os.register_at_fork(after_in_child=_restart_after_fork)
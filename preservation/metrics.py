@@ -0,0 +1,185 @@
+import atexit
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from preservation.database import DatabaseManager
+
+logger = logging.getLogger("preservation")
+
+# Stages run from seconds to hours
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200)
+# Curate and AtoM calls
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LE_LABEL = re.compile(r'le="([^"]+)",?')
+
+def format_labels(labels: dict) -> str:
+    """
+    Returns labels in Prometheus exposition form without braces, sorted by name.
+    """
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return ','.join(f'{key}="{value}"' for key, value in escaped)
+
+def _sample_order(sample: tuple) -> tuple:
+    # Keeps each histogram's buckets together and in ascending le order
+    family, _, name, labels, _ = sample
+    match = LE_LABEL.search(labels)
+    if not match:
+        return (family, LE_LABEL.sub('', labels), name, 0.0)
+    return (family, LE_LABEL.sub('', labels), name, float(match.group(1)))
+
+def render_samples(samples) -> str:
+    """
+    Renders (family, type, name, labels, value) samples in the Prometheus text format.
+    """
+    lines = []
+    typed = set()
+    for family, kind, name, labels, value in sorted(samples, key=_sample_order):
+        if family not in typed:
+            lines.append(f'# TYPE {family} {kind}')
+            typed.add(family)
+        series = f'{name}{{{labels}}}' if labels else name
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        lines.append(f'{series} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """
+    Thread-safe in-process store of counters, gauges and histograms.
+
+    Histograms are kept as their _bucket, _sum and _count series so that samples
+    from several processes can be merged by adding them up.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> [family, type, value]
+        self._series = {}
+        # Gauges set since they were last drained
+        self._dirty = set()
+
+    def _add(self, family: str, kind: str, name: str, labels: str, value: float):
+        series = self._series.get((name, labels))
+        if series is None:
+            self._series[(name, labels)] = [family, kind, value]
+        else:
+            series[2] += value
+
+    def inc(self, family: str, value: float = 1, labels: dict = None):
+        with self._lock:
+            self._add(family, 'counter', family, format_labels(labels), value)
+
+    def set(self, family: str, value: float, labels: dict = None):
+        with self._lock:
+            self._series[(family, format_labels(labels))] = [family, 'gauge', value]
+            self._dirty.add((family, format_labels(labels)))
+
+    def observe(self, family: str, value: float, labels: dict = None, buckets: tuple = DURATION_BUCKETS):
+        labels = dict(labels or {})
+        base_labels = format_labels(labels)
+        with self._lock:
+            for bound in buckets:
+                labels['le'] = f'{bound:g}'
+                self._add(family, 'histogram', f'{family}_bucket', format_labels(labels), 1 if value <= bound else 0)
+            labels['le'] = '+Inf'
+            self._add(family, 'histogram', f'{family}_bucket', format_labels(labels), 1)
+            self._add(family, 'histogram', f'{family}_sum', base_labels, value)
+            self._add(family, 'histogram', f'{family}_count', base_labels, 1)
+
+    @contextmanager
+    def timed(self, family: str, labels: dict = None, buckets: tuple = LATENCY_BUCKETS):
+        """
+        Observes the duration of the block, and counts failures in {family}_failures_total.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f'{family}_failures_total', labels=labels)
+            raise
+        finally:
+            self.observe(f'{family}_seconds', time.perf_counter() - start, labels, buckets)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(family, kind, name, labels, value) for (name, labels), (family, kind, value) in self._series.items()]
+
+    def drain(self) -> list:
+        """
+        Returns counter and histogram samples and resets them, for flushing deltas to a shared store,
+        along with the last value of each gauge set since the previous drain.
+        """
+        with self._lock:
+            samples = [
+                (family, kind, name, labels, value)
+                for (name, labels), (family, kind, value) in self._series.items()
+                if kind != 'gauge' or (name, labels) in self._dirty
+            ]
+            self._series = {key: series for key, series in self._series.items() if series[1] == 'gauge'}
+            self._dirty = set()
+            return samples
+
+    def restore(self, samples: list):
+        """
+        Adds drained samples back, when they could not be flushed.
+        """
+        with self._lock:
+            for family, kind, name, labels, value in samples:
+                if kind == 'gauge':
+                    # The gauge still holds its value, or a newer one
+                    self._dirty.add((name, labels))
+                else:
+                    self._add(family, kind, name, labels, value)
+
+
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+timed = registry.timed
+
+_flusher: threading.Thread = None
+_db_manager: DatabaseManager = None
+
+def flush():
+    """
+    Adds this process's counters and histograms to the shared store in the preservation database,
+    and replaces the gauges it has set there.
+    """
+    global _db_manager
+    samples = registry.drain()
+    if not samples:
+        return
+    try:
+        if _db_manager is None:
+            # Imported here, the worker API client imports this module through resilience
+            from preservation.worker_api import database_manager
+            _db_manager = database_manager()
+        _db_manager.add_metric_samples(samples)
+    except Exception as e:
+        logger.error(f"Failed to flush metrics: {e}")
+        registry.restore(samples)
+
+def start_flusher(interval: float = 15):
+    """
+    Flushes metrics in the background every interval seconds and once more at exit.
+    """
+    global _flusher
+    if _flusher is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    _flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+    _flusher.start()
+    atexit.register(flush)
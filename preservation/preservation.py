@@ -7,12 +7,24 @@ import zipfile
 import xml.etree.ElementTree as ET
 from uuid import uuid4
 from pathlib import Path
+from typing import Optional
 
-from config import A3M_DOCKER_IMAGE, PROCESSING_DIRECTORY, CURATE_VERSION, CURATE_URL, WORKSPACE_MAPPING
+from config import A3M_DOCKER_IMAGE, ADMISSION_POLL_SECONDS, ADMISSION_SAFETY_MARGIN, CURATE_VERSION, CURATE_URL, WORKSPACE_MAPPING, LISTING_CACHE_ENABLED, WORKER_API_URL
+from db.models.job_model import JOB_PRIORITIES
 from preservation.curate import CurateManager
 from preservation.a3m import A3MManager
-from preservation.database import DatabaseManager
+from preservation.worker_api import database_manager
 from preservation.atom import AtoMManager
+from preservation.dip_queue import DIPQueue
+from preservation.jobs import JobRecorder, path_size
+from preservation import cancellation, logs, tracing
+from preservation.profiling import JobProfiler, profile_directory
+from preservation.admission import AdmissionController, Reservation, node_size
+from preservation.aip_index import AIPIndex, RemoteAIPIndex
+from preservation.fingerprints import FingerprintIndex, RemoteFingerprintIndex
+from preservation.listings import ListingCache
+from preservation.scratch import ScratchSpace
+from preservation.splitting import is_collection, part_node, plan_parts
 
 logger = logging.getLogger("preservation")
 
@@ -25,9 +37,7 @@ for prefix, uri in namespaces.items():
 
 class Package():
     
-    children = []
-    
-    def __init__(self, node_json: dict, curate_prefix: Path = None):
+    def __init__(self, node_json: dict, curate_prefix: Path = None, data_path: Path = None):
         """
         - Expects curate node data.
         - Builds dc and isadg metadata json.
@@ -37,6 +47,9 @@ class Package():
         meta_store = node_json['MetaStore']
 
         self.uuid = node_json['Uuid']
+        self.children = []
+        # Set when the package is one part of a split directory
+        self.split = node_json.get('SplitPart')
         
         self.is_dir = True if node_json['Type'] in ('COLLECTION', 2) else False
         self.mime_type = self._strip_quotes(meta_store.get('mime', None))
@@ -48,11 +61,19 @@ class Package():
         # Path updated as package is processed
         self.current_path: Path = None
         
-        relative_path = self.curate_path.relative_to(self.curate_prefix)
+        # Path under the transfer data directory
+        relative_path = data_path if data_path else self.curate_path.relative_to(self.curate_prefix)
         self.object_path = f'objects/data/{relative_path}'
     
         # Metadata
         self.metadata = self._construct_metadata_json(meta_store)
+        if self.split:
+            # Links the AIPs of every part of the directory
+            self.metadata = {
+                'filename': self.object_path,
+                **self.metadata,
+                'dc.relation': f"isPartOf:{self.split['group']} part {self.split['index']} of {self.split['count']}"
+            }
         
         # Premis
         premis_raw = (
@@ -171,6 +192,13 @@ class Package():
 
         return object_elem
         
+    @property
+    def transfer_name(self) -> str:
+        name = self.curate_path.stem.strip().replace(' ', '')
+        if self.split:
+            name += f"-part{self.split['index']}of{self.split['count']}"
+        return name
+
     def get_curate_alt_path(self) -> Path:
         # Adapt node path for Cells Client
         curate_path_parts = self.curate_path.parts
@@ -253,6 +281,29 @@ class Package():
             raise FileExistsError(f"New local path {new_path} does not exist.")
 
 
+class PackageBatch(Package):
+    """
+    Small file packages preserved together as one transfer and one AIP.
+    The files are the batch's children, so its metadata.json and premis.xml cover them all.
+    """
+    def __init__(self, packages: list, batch_id: str):
+        self.batch_id = batch_id
+        self.uuid = None
+        self.is_dir = True
+        self.split = None
+        self.atom_slug = None
+        self.curate_path = Path(batch_directory_name(batch_id))
+        self.current_path: Path = None
+        self.metadata = {}
+        self.premis_xml_object = None
+        self.premis_xml_events_list = None
+        self.children = packages
+
+
+def batch_directory_name(batch_id: str) -> str:
+    return f"batch-{batch_id}"
+
+
 class Preservation():
     def __init__(self, config_id: int, user: str):
         """
@@ -260,10 +311,7 @@ class Preservation():
         """
         self.config_id = config_id
         self.user = user
-        self.processing_directory = Path(PROCESSING_DIRECTORY)
-        self.processing_directory.mkdir(parents=True, exist_ok=True)
-        
-        self.db_manager = DatabaseManager()
+        self.db_manager = database_manager()
         logger.info("Created database manager")
         
         self.curate_manager = CurateManager(self.user, CURATE_URL)
@@ -277,6 +325,13 @@ class Preservation():
         self.atom_manager = AtoMManager(self.atom_config) if self.atom_config else None
         if self.atom_config:
             logger.info(f"Created atom manager for {self.atom_manager.atom_url}")
+
+        self.dip_queue = DIPQueue()
+        self.admission = AdmissionController(self.db_manager)
+        self.scratch = ScratchSpace(self.admission)
+        self.fingerprints = RemoteFingerprintIndex() if WORKER_API_URL else FingerprintIndex()
+        self.aip_index = RemoteAIPIndex() if WORKER_API_URL else AIPIndex()
+        self.listings = ListingCache() if LISTING_CACHE_ENABLED else None
         
         self.premis_agents = [
             {
@@ -313,7 +368,8 @@ class Preservation():
 
         command = ['7z', 'x', str(archive_path), '-o' + str(target_folder)]
         try:
-            subprocess.run(command, check=True)
+            with tracing.span('7z extract', 'subprocess', path=archive_path, bytes=archive_path.stat().st_size):
+                cancellation.run(command, check=True)
         except subprocess.CalledProcessError as e:
             logger.error("An error occurred during extraction")
             raise RuntimeError("An error occurred during extraction.") from e
@@ -322,12 +378,50 @@ class Preservation():
 
     def get_new_processing_directory(self) -> Path:
         """
-        Returns processing directory with a new UUID directory.
+        Returns a new UUID processing directory on the scratch volumes least loaded for each tier.
         """
-        new_dir = self.processing_directory / str(uuid4())
-        new_dir.mkdir()
-        logger.debug(f"Created new processing directory {new_dir}")
-        return new_dir
+        return self.scratch.place()
+
+    def record_fingerprint(self, package: Package, fingerprint: dict, aip_uuid: str, job: JobRecorder):
+        """
+        Records the node state an AIP was made from. Never fails the preservation.
+        Split directories record their split ID in place of an AIP UUID.
+        """
+        try:
+            self.fingerprints.record(package.uuid, package.curate_path, fingerprint, aip_uuid, job.job_id if job else None)
+        except Exception as e:
+            logger.error(f"Failed to record fingerprint of {package.curate_path}: {e}")
+
+    def index_aip(self, package: Package, extracted_aip_path: Path, aip_uuid: str, job: JobRecorder):
+        """
+        Records the files of an AIP from its METS. Never fails the preservation.
+        """
+        try:
+            self.aip_index.index(extracted_aip_path, aip_uuid, package, job.job_id if job else None)
+        except cancellation.Cancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to index AIP {aip_uuid}: {e}")
+
+    def admit(self, node: dict, processing_directory: Path, job: JobRecorder) -> Optional[Reservation]:
+        """
+        Reserves the estimated peak disk usage of a node, waiting until it fits.
+        A job claimed from the queue doesn't wait, None is returned for it to be put back instead,
+        so its worker can take on jobs that do fit in the meantime.
+        The download and transfer are reserved on the download tier's volume, the rest on the extract tier's.
+        """
+        size = node_size(node)
+        estimated = self.admission.estimate(size, self.config_id, self.processing_config, self.a3m_manager.processing_config)
+        job.update(size_bytes=size, estimated_bytes=estimated)
+        download_share = min(estimated, int(size * ADMISSION_SAFETY_MARGIN))
+        shares = {processing_directory: download_share}
+        extract_directory = self.scratch.directory(processing_directory, 'extract')
+        shares[extract_directory] = shares.get(extract_directory, 0) + estimated - download_share
+        return self.admission.admit(
+            shares, job.job_id,
+            on_wait=lambda: self.curate_manager.update_tag(node['Uuid'], 'Waiting for disk space...'),
+            wait=job.owner is None
+        )
     
     def download_package(self, package: Package, download_path_prefix: Path) -> Path:
         """
@@ -339,6 +433,68 @@ class Preservation():
         logger.debug(f"Downloaded {downloaded_path}")
         return downloaded_path
     
+    def download_part(self, package: Package, download_path_prefix: Path) -> Path:
+        """
+        Downloads only the files of one part of a split directory, keeping their folder structure.
+        Returns the download path of the directory.
+        """
+        download_path = download_path_prefix / 'curate_download' / package.curate_path.name
+        for child in package.children:
+            destination = download_path / child.curate_path.relative_to(package.curate_path).parent
+            if child.is_dir:
+                (download_path / child.curate_path.relative_to(package.curate_path)).mkdir(parents=True, exist_ok=True)
+                continue
+            staging_path = download_path_prefix / 'curate_part_download'
+            downloaded_path = self.curate_manager.download_node(staging_path, child.get_curate_alt_path())
+            destination.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(downloaded_path), str(destination / downloaded_path.name))
+        shutil.rmtree(download_path_prefix / 'curate_part_download', ignore_errors=True)
+        download_path.mkdir(parents=True, exist_ok=True)
+        logger.debug(f"Downloaded {len(package.children)} nodes of part {package.split['index']} to {download_path}")
+        return download_path
+
+    def download_batch(self, batch: PackageBatch, download_path_prefix: Path) -> Path:
+        """
+        Downloads every file of a batch to {batch}/{node uuid}/{name}.
+        Returns the download path of the batch.
+        """
+        download_path = download_path_prefix / 'curate_download' / batch.curate_path.name
+        for package in batch.children:
+            downloaded_path = self.curate_manager.download_node(download_path / package.uuid, package.get_curate_alt_path())
+            package.update_current_path(downloaded_path)
+        logger.debug(f"Downloaded {len(batch.children)} files of batch {batch.batch_id} to {download_path}")
+        return download_path
+
+    def queue_split_parts(self, node: dict, parts: list, fingerprint: dict, job: JobRecorder) -> str:
+        """
+        Queues a job for each part of a split directory so workers can process them concurrently.
+        Returns the shared split identifier.
+        """
+        group = str(uuid4())
+        # Parts keep the place their directory earned in the schedule
+        priority = self.db_manager.get_job_priority(job.job_id) if job.job_id else JOB_PRIORITIES['normal']
+        for index, children in enumerate(parts, start=1):
+            part = part_node(node, group, index, children, len(parts), fingerprint)
+            part_job_id = self.db_manager.create_job(node['Uuid'], node['Path'], self.user, self.config_id, part,
+                                                     profile=job.profiler is not None, force=True, priority=priority)
+            self.db_manager.update_job(part_job_id, split_group=group, split_part=index, split_parts=len(parts))
+        job.update(split_group=group, split_parts=len(parts))
+        logger.info(f"Split {node['Path']} into {len(parts)} parts with split ID {group}")
+        return group
+
+    def finish_split_part(self, package: Package):
+        """
+        Marks the directory preserved once every part of it has been.
+        """
+        progress = self.db_manager.get_split_progress(package.split['group'])
+        completed = progress.get('completed', 0)
+        if completed < package.split['count']:
+            self.curate_manager.update_tag(package.uuid, f"Preserved {completed} of {package.split['count']} parts")
+            return
+        self.record_fingerprint(package, package.split['fingerprint'], package.split['group'], None)
+        self.curate_manager.update_tag(package.uuid, '🔒 Preserved')
+        logger.info(f"Preserved every part of {package.curate_path} (split ID {package.split['group']})")
+
     def prepare_package_for_transfer(self, package: Package, processing_directory: Path) -> Path:
         """
         Transforms the submitted package into archive transfer state.
@@ -383,20 +539,37 @@ class Preservation():
         Extracts 7z AIP.
         Returns AIP Path.
         """
-        transfer_name = package.curate_path.stem.strip().replace(' ', '')
-        
         logger.info(f'Submitting AIP to A3M')
-        aip_uuid = self.a3m_manager.execute_a3m_transfer(package.current_path, transfer_name)
+        aip_uuid = self.a3m_manager.execute_a3m_transfer(package.current_path, package.transfer_name)
         logger.info(f'Successfully created AIP with UUID {aip_uuid}')
         
         return aip_uuid
     
-    def move_and_extract_aip(self, processing_directoy: Path, expected_container_aip_path: Path):
+    def package_features(self, size: int, file_count: int = None) -> dict:
+        """
+        Returns the features of a package that stage durations are predicted from.
+        """
+        return {
+            'config_id': self.config_id,
+            'input_bytes': size,
+            'file_count': file_count,
+            'compression': self.a3m_manager.processing_config['aip_compression_algorithm'],
+        }
+
+    def gather_child_nodes(self, node: dict) -> list:
+        """
+        Lists every node below a directory node, reusing cached listings of unchanged folders.
+        """
+        if self.listings is None:
+            return self.curate_manager.gather_child_nodes(node['Path'])
+        return self.listings.gather(self.curate_manager, node)
+
+    def move_and_extract_aip(self, processing_directoy: Path, aip_uuid: str, expected_container_aip_path: Path):
         
         # Move AIP to Shared Volume
-        package_aip_directoy = processing_directoy / 'aip'
+        package_aip_directoy = self.scratch.directory(processing_directoy, 'extract') / 'aip'
         package_aip_directoy.mkdir()
-        aip_path = self.a3m_manager.move_file_in_container(expected_container_aip_path, package_aip_directoy)
+        aip_path = self.a3m_manager.move_file_in_container(aip_uuid, expected_container_aip_path, package_aip_directoy)
         logger.debug(f'Moved AIP to shared volume {aip_path}')
 
         # Extract 7z aip - we do this here as it allows us to compress using user specified compression algorithm
@@ -412,6 +585,7 @@ class Preservation():
         zip_path = package.current_path.with_suffix('.zip')
         with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             for file_path in package.current_path.rglob('*'):
+                cancellation.check()
                 arcname = file_path.relative_to(package.current_path)
                 zipf.write(file_path, arcname=arcname)
         logger.info(f"Compressed {package.current_path} to {zip_path}.")
@@ -423,92 +597,359 @@ class Preservation():
         self.curate_manager.upload_node(package.current_path, curate_destination)
         logger.info(f"Uploaded {curate_destination / package.current_path.name}")
 
-    def upload_dip_to_atom(self, aip_uuid: str, processing_directoy: Path, slug: str):
-        package_dip_directoy = processing_directoy / 'dip'
+    def queue_dip(self, package: Package, aip_uuid: str, processing_directoy: Path):
+        """
+        Moves the DIP out of the a3m daemon and hands it to the DIP queue.
+        The AtoM deposit itself is run by the DIP worker.
+        """
+        if not self.atom_manager:
+            raise RuntimeError("AtoM config not found in database.")
+        package_dip_directoy = self.scratch.directory(processing_directoy, 'extract') / 'dip'
         package_dip_directoy.mkdir()
         expected_dip_path = Path(f"/home/a3m/.local/share/a3m/share/dips/{aip_uuid}")
-        dip_path = self.a3m_manager.move_file_in_container(expected_dip_path, package_dip_directoy)
+        dip_path = self.a3m_manager.move_file_in_container(aip_uuid, expected_dip_path, package_dip_directoy)
         logger.info(f'Moved DIP to shared volume {dip_path}')
-        logger.info(f'Uploading DIP to AtoM')
-        self.atom_manager.upload_dip(dip_path, slug)
-        logger.info(f'Uploaded DIP to AtoM')
-        
-        
-def process_node(preserver: Preservation, node: dict, processing_directory: Path):
+        staged_dip_path = self.dip_queue.stage(dip_path)
+        self.dip_queue.enqueue(package.uuid, package.curate_path, aip_uuid, package.atom_slug, staged_dip_path, self.user)
+        
+        
+def process_node(preserver: Preservation, node: dict, processing_directory: Path, job_id: int = None,
+                 profile: bool = False, force: bool = False, owner: str = None):
+    if job_id is None:
+        job = JobRecorder.create(preserver.db_manager, node, preserver.user, preserver.config_id)
+    else:
+        job = JobRecorder(preserver.db_manager, job_id, owner)
+    job.force = force
+    job.start()
+    job.features = preserver.package_features(node_size(node), None if is_collection(node) else 1)
+
+    if profile:
+        job.profiler = JobProfiler(profile_directory(job.job_id, node['Uuid']))
+        job.update(profile_path=str(job.profiler.directory))
+
+    path = tracing.trace_path(f"{job.job_id or 'nojob'}-{node['Uuid']}")
+    job.update(trace_path=str(path), processing_directory=str(processing_directory))
+    with logs.context(job_id=job.job_id, node_uuid=node['Uuid']), \
+            tracing.trace('process_node', path, job_id=job.job_id, node_uuid=node['Uuid'], node_path=node['Path'],
+                          config_id=preserver.config_id, user=preserver.user):
+        try:
+            _process_node(preserver, node, processing_directory, job)
+        finally:
+            if job.reservation:
+                job.update(peak_bytes=job.reservation.release())
+            if job.profiler:
+                job.profiler.write_summary()
+
+def process_batch(preserver: Preservation, jobs: list, processing_directory: Path, profile: bool = False):
+    """
+    Preserves small file nodes together as one transfer and one AIP.
+    Each job is a dict with the Curate 'node', its job 'id' (None to record a new job), 'force'
+    and the 'lease_owner' of a claimed job.
+    Stages are recorded on the first job preserved, every job records the batch ID and AIP UUID
+    and every node gets its own tag.
+    """
+    batch_id = str(uuid4())
+    entries = []
+    for entry in jobs:
+        node = entry['node']
+        if entry.get('id') is None:
+            job = JobRecorder.create(preserver.db_manager, node, preserver.user, preserver.config_id)
+        else:
+            job = JobRecorder(preserver.db_manager, entry['id'], entry.get('lease_owner'))
+        job.force = bool(entry.get('force'))
+        job.start()
+        job.update(processing_directory=str(processing_directory), batch_id=batch_id)
+
+        # Skip nodes unchanged since their last AIP
+        fingerprint = preserver.fingerprints.fingerprint(node, [], preserver.config_id)
+        previous = None if job.force else preserver.fingerprints.unchanged(node['Uuid'], fingerprint)
+        if previous:
+            logger.info(f"Skipping {node['Path']}, unchanged since AIP {previous['aip_uuid']}")
+            job.update(aip_uuid=previous['aip_uuid'])
+            job.finish('skipped')
+            preserver.curate_manager.update_tag(node['Uuid'], '🔒 Preserved')
+            continue
+        entries.append((node, job, fingerprint))
+
+    if not entries:
+        preserver.scratch.remove(processing_directory)
+        return
+
+    lead = entries[0][1]
+    lead.features = preserver.package_features(sum(node_size(node) for node, _, _ in entries), len(entries))
+    if profile:
+        lead.profiler = JobProfiler(profile_directory(lead.job_id, batch_directory_name(batch_id)))
+        lead.update(profile_path=str(lead.profiler.directory))
+
+    path = tracing.trace_path(f"{lead.job_id or 'nojob'}-{batch_directory_name(batch_id)}")
+    for _, job, _ in entries:
+        job.update(trace_path=str(path))
+    with logs.context(job_id=lead.job_id, batch_id=batch_id), \
+            tracing.trace('process_batch', path, job_id=lead.job_id, batch_id=batch_id, nodes=len(entries),
+                          config_id=preserver.config_id, user=preserver.user):
+        try:
+            _process_batch(preserver, entries, lead, processing_directory, batch_id)
+        finally:
+            if lead.reservation:
+                lead.update(peak_bytes=lead.reservation.release())
+            if lead.profiler:
+                lead.profiler.write_summary()
+
+def _process_batch(preserver: Preservation, entries: list, lead: JobRecorder, processing_directory: Path, batch_id: str):
+    start = time.time()
+    finished = set()
+    try:
+        logger.info(f"Processing batch {batch_id} of {len(entries)} nodes")
+
+        with lead.stage('package'):
+            batch_name = batch_directory_name(batch_id)
+            packages = [Package(node, data_path=Path(batch_name, node['Uuid'], Path(node['Path']).name)) for node, _, _ in entries]
+            batch = PackageBatch(packages, batch_id)
+        message = lead.with_eta('Processing in batch...')
+        for package in packages:
+            preserver.curate_manager.update_tag(package.uuid, message)
+
+        # Hold disk space for the whole batch, waiting while it doesn't fit
+        with lead.stage('admission'):
+            batch_node = {'Uuid': packages[0].uuid, 'Size': sum(node_size(node) for node, _, _ in entries)}
+            lead.reservation = preserver.admit(batch_node, processing_directory, lead)
+        if lead.reservation is None:
+            preserver.db_manager.requeue_jobs([job.job_id for _, job, _ in entries], lead.owner, ADMISSION_POLL_SECONDS)
+            preserver.scratch.remove(processing_directory)
+            for package in packages:
+                preserver.curate_manager.update_tag(package.uuid, 'Waiting for disk space...')
+            logger.info(f"============= Requeued batch {batch_id} until disk space frees up =============")
+            return
+
+        with lead.stage('download') as stage:
+            downloaded_path = preserver.download_batch(batch, processing_directory)
+            for package, (_, job, _) in zip(packages, entries):
+                job.update(bytes_downloaded=path_size(package.current_path))
+            batch.update_current_path(downloaded_path)
+            stage['bytes'] = path_size(downloaded_path)
+
+        with lead.stage('prepare'):
+            transfer_directory = preserver.prepare_package_for_transfer(batch, processing_directory)
+            batch.update_current_path(transfer_directory)
+
+        # Per stage tags would cost a Curate call per node, each node is tagged once preserved
+        aip_uuid = _archive_transfer(preserver, batch, processing_directory, lead, lambda message: None)
+
+        for package, (_, job, fingerprint) in zip(packages, entries):
+            job.update(aip_uuid=aip_uuid)
+            job.finish('completed')
+            finished.add(package.uuid)
+            preserver.curate_manager.update_tag(package.uuid, '🔒 Preserved')
+            preserver.record_fingerprint(package, fingerprint, aip_uuid, job)
+    except Exception as e:
+        if cancellation.cancelled():
+            _cancel_batch(preserver, entries, finished, processing_directory, batch_id)
+            raise
+        logger.error(e)
+        length = time.time() - start
+        logger.info(f"============= Batch Failed {batch_id} in {length:.2f} seconds =============")
+        for node, job, _ in entries:
+            if node['Uuid'] not in finished:
+                job.finish('failed', str(e))
+                preserver.curate_manager.update_tag(node['Uuid'], 'Preservation Failed - Try Again')
+        raise
+
+    preserver.scratch.remove(processing_directory)
+    length = time.time() - start
+    logger.info(f"============= Completed batch {batch_id} of {len(entries)} nodes in {length:.2f} seconds =============")
+
+def _cancel_batch(preserver: Preservation, entries: list, finished: set, processing_directory: Path, batch_id: str):
+    """
+    Cancels the jobs of a batch that were asked to stop and puts the others back in the queue.
+    Once the lease on one of them is lost, the others still held are only requeued.
+    """
+    unfinished = [(node, job) for node, job, _ in entries if node['Uuid'] not in finished]
+    if cancellation.lease_lost():
+        preserver.db_manager.requeue_jobs([job.job_id for _, job in unfinished], entries[0][1].owner)
+        preserver.scratch.remove(processing_directory)
+        logger.info(f"============= Stopped batch {batch_id}, its lease was lost =============")
+        return
+    requested = preserver.db_manager.get_cancel_requests([job.job_id for _, job in unfinished if job.job_id is not None])
+    for node, job in unfinished:
+        if job.job_id in requested:
+            job.finish('cancelled')
+            preserver.curate_manager.update_tag(node['Uuid'], 'Cancelled')
+    preserver.db_manager.requeue_jobs([job.job_id for _, job in unfinished if job.job_id not in requested], entries[0][1].owner)
+    preserver.scratch.remove(processing_directory)
+    logger.info(f"============= Cancelled batch {batch_id}, requeued {len(unfinished) - len(requested)} jobs =============")
+
+def _archive_transfer(preserver: Preservation, package: Package, processing_directory: Path, job: JobRecorder, tag) -> str:
+    """
+    Runs a prepared transfer through a3m and uploads the AIP to Curate.
+    Progress messages are passed to tag. Returns the AIP UUID.
+    """
+    # Execute A3M transfer on package
+    tag('Submitting package...')
+    with job.stage('transfer'):
+        aip_uuid = preserver.execute_transfer(package)
+    job.update(aip_uuid=aip_uuid)
+    
+    # Extract and move AIP
+    tag('Extracting AIP...')
+    with job.stage('extract'):
+        expected_container_aip_path = Path(f"/home/a3m/.local/share/a3m/share/completed/{package.transfer_name}-{aip_uuid}.7z")
+        extracted_aip_path = preserver.move_and_extract_aip(processing_directory, aip_uuid, expected_container_aip_path)
+        package.update_current_path(extracted_aip_path)
+        preserver.index_aip(package, extracted_aip_path, aip_uuid, job)
+    
+    # Compress AIP if enabled in processing config
+    if preserver.processing_config['compress_aip']:
+        tag('Compressing AIP...')
+        with job.stage('compress'):
+            compressed_path = preserver.compress_package(package)
+            package.update_current_path(compressed_path)
+    
+    # Upload to Curate
+    tag('Uploading AIP...')
+    with job.stage('upload') as stage:
+        stage['bytes'] = path_size(package.current_path)
+        preserver.upload_aip(package)
+    job.update(bytes_uploaded=stage['bytes'])
+    return aip_uuid
+
+def _process_node(preserver: Preservation, node: dict, processing_directory: Path, job: JobRecorder):
+    start = time.time()
+
     # A3M
     try:
         logger.info(f"Processing {node['Path']} with UUID {node['Uuid']}")
         
-        start = time.time()
-        
         # Populate main package
-        package = Package(node)
-        
-        # Populate child packages of directory packages
-        if package.is_dir:
-            for child_node in preserver.curate_manager.gather_child_nodes(package.curate_path):
-                package.children.append(Package(child_node, package.curate_prefix))
+        with job.stage('package'):
+            package = Package(node)
         
+        # Populate child packages of directory packages, a split part carries its share of the children
+        child_nodes = []
+        def count_files() -> int:
+            return sum(1 for child_node in child_nodes if not is_collection(child_node))
+
+        if package.split:
+            child_nodes = package.split['children']
+            job.features['file_count'] = count_files()
+        elif package.is_dir:
+            with job.stage('gather'):
+                child_nodes = preserver.gather_child_nodes(node)
+                job.features['file_count'] = count_files()
+        for child_node in child_nodes:
+            package.children.append(Package(child_node, package.curate_prefix))
+        
+        # Skip nodes unchanged since their last AIP
+        fingerprint = preserver.fingerprints.fingerprint(node, child_nodes, preserver.config_id)
+        if not job.force and not package.split:
+            previous = preserver.fingerprints.unchanged(package.uuid, fingerprint)
+            if previous:
+                logger.info(f"Skipping {node['Path']}, unchanged since AIP {previous['aip_uuid']}")
+                job.update(aip_uuid=previous['aip_uuid'])
+                job.finish('skipped')
+                preserver.scratch.remove(processing_directory)
+                preserver.curate_manager.update_tag(package.uuid, '🔒 Preserved')
+                return
+        
+        # Split oversized directories into parts processed as separate jobs
+        split_max_bytes = preserver.processing_config['split_max_bytes']
+        split_max_files = preserver.processing_config['split_max_files']
+        if package.is_dir and not package.split and (split_max_bytes or split_max_files):
+            parts = plan_parts(child_nodes, split_max_bytes, split_max_files)
+            if len(parts) > 1:
+                with job.stage('split'):
+                    preserver.queue_split_parts(node, parts, fingerprint, job)
+                job.finish('completed')
+                preserver.scratch.remove(processing_directory)
+                preserver.curate_manager.update_tag(package.uuid, f'Queued {len(parts)} parts...')
+                return
+        
+        # Hold disk space for the node's peak footprint, waiting or going back in the queue while it doesn't fit
+        with job.stage('admission'):
+            job.reservation = preserver.admit(node, processing_directory, job)
+        if job.reservation is None:
+            preserver.db_manager.requeue_jobs([job.job_id], job.owner, ADMISSION_POLL_SECONDS)
+            preserver.scratch.remove(processing_directory)
+            logger.info(f"Requeued {node['Path']} until disk space frees up")
+            preserver.curate_manager.update_tag(package.uuid, 'Waiting for disk space...')
+            return
+        
+        # Progress tags carry the predicted remaining time
+        def tag(message: str):
+            preserver.curate_manager.update_tag(package.uuid, job.with_eta(message))
+
         # Download the package
-        preserver.curate_manager.update_tag(package.uuid, 'Processing package...')
-        downloaded_path = preserver.download_package(package, processing_directory)
-        package.update_current_path(downloaded_path)
+        tag('Processing package...')
+        with job.stage('download') as stage:
+            if package.split:
+                downloaded_path = preserver.download_part(package, processing_directory)
+            else:
+                downloaded_path = preserver.download_package(package, processing_directory)
+            package.update_current_path(downloaded_path)
+            stage['bytes'] = path_size(downloaded_path)
+        job.update(bytes_downloaded=stage['bytes'])
         
         # Manipulate package to transfer state
-        preserver.curate_manager.update_tag(package.uuid, 'Preparing package...')
-        transfer_directory = preserver.prepare_package_for_transfer(package, processing_directory)
-        package.update_current_path(transfer_directory)
-        
-        # Execute A3M transfer on package
-        preserver.curate_manager.update_tag(package.uuid, 'Submitting package...')
-        aip_uuid = preserver.execute_transfer(package)
-        
-        # Extract and move AIP
-        preserver.curate_manager.update_tag(package.uuid, 'Extracting AIP...')
-        expected_container_aip_path = Path(f"/home/a3m/.local/share/a3m/share/completed/{(package.curate_path.stem).replace(' ', '')}-{aip_uuid}.7z")
-        extracted_aip_path = preserver.move_and_extract_aip(processing_directory, expected_container_aip_path)
-        package.update_current_path(extracted_aip_path)
+        tag('Preparing package...')
+        with job.stage('prepare'):
+            transfer_directory = preserver.prepare_package_for_transfer(package, processing_directory)
+            package.update_current_path(transfer_directory)
         
-        # Compress AIP if enabled in processing config
-        if preserver.processing_config['compress_aip']:
-            preserver.curate_manager.update_tag(package.uuid, 'Compressing AIP...')
-            compressed_path = preserver.compress_package(package)
-            package.update_current_path(compressed_path)
-        
-        # Upload to Curate
-        preserver.curate_manager.update_tag(package.uuid, 'Uploading AIP...')
-        preserver.upload_aip(package)
+        aip_uuid = _archive_transfer(preserver, package, processing_directory, job, tag)
 
-        if preserver.user in ['admin']:
+        if package.split:
+            preserver.curate_manager.update_tag(package.uuid, f"Preserved part {package.split['index']} of {package.split['count']}")
+        elif preserver.user in ['admin']:
             now = time.time()
             length = now - start
             preserver.curate_manager.update_tag(package.uuid, f'🔒 Preserved in {length:.2f}s')
         else:
             preserver.curate_manager.update_tag(package.uuid, '🔒 Preserved')
+        if not package.split:
+            preserver.record_fingerprint(package, fingerprint, aip_uuid, job)
     except Exception as e:
+        if cancellation.lease_lost():
+            # The job is another worker's now, it records and tags it
+            preserver.scratch.remove(processing_directory)
+            logger.info(f"============= Stopped {node['Path']}, its lease was lost =============")
+            raise
+        if cancellation.cancelled():
+            job.finish('cancelled')
+            preserver.scratch.remove(processing_directory)
+            logger.info(f"============= Cancelled {node['Path']} after {time.time() - start:.2f} seconds =============")
+            preserver.curate_manager.update_tag(node['Uuid'], 'Cancelled')
+            raise
         logger.error(e)
+        job.finish('failed', str(e))
+        length = time.time() - start
         logger.info(f"============= AIP Failed {node['Path']} in {length:.2f} seconds =============")
-        preserver.curate_manager.update_tag(package.uuid, 'Preservation Failed - Try Again')
+        preserver.curate_manager.update_tag(node['Uuid'], 'Preservation Failed - Try Again')
         raise 
 
-    # DIP Upload
+    # DIP hand-off, the AtoM deposit is drained by the DIP worker
     try:
         if preserver.a3m_manager.processing_config['dip_enabled'] or package.atom_slug:
-            if not package.atom_slug:
-                raise ValueError("Slug not found in package metadata.")
-            preserver.curate_manager.update_tag(package.uuid, 'Uploading DIP...', dip=True)
-            preserver.upload_dip_to_atom(aip_uuid, processing_directory, package.atom_slug)
-            preserver.curate_manager.update_tag(package.uuid, 'DIP Uploaded', dip=True)
+            with job.stage('dip_handoff'):
+                if not package.atom_slug:
+                    raise ValueError("Slug not found in package metadata.")
+                preserver.queue_dip(package, aip_uuid, processing_directory)
+            preserver.curate_manager.update_tag(package.uuid, 'DIP Queued', dip=True)
     except Exception as e:
         logger.error(e)
+        # The AIP itself was preserved
+        job.finish('completed', f"DIP: {e}")
+        if package.split:
+            preserver.finish_split_part(package)
+        length = time.time() - start
         logger.info(f"============= DIP Failed {node['Path']} in {length:.2f} seconds =============")
         preserver.curate_manager.update_tag(package.uuid, 'DIP Failed', dip=True)
         raise
+    finally:
+        # The AIP is already in Curate, nothing left here is needed
+        preserver.scratch.remove(processing_directory)
 
+    job.finish('completed')
+    if package.split:
+        preserver.finish_split_part(package)
     end = time.time()
     length = end - start
     logger.info(f"============= Completed {node['Path']} in {length:.2f} seconds =============")
-    
-    logger.info(f"Removing processing directory {processing_directory}")
-    shutil.rmtree(processing_directory)
-
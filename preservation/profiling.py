@@ -0,0 +1,97 @@
+import cProfile
+import json
+import logging
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import PROFILE_DIRECTORY
+
+logger = logging.getLogger("preservation")
+
+TOP_FUNCTIONS = 15
+TOP_ALLOCATIONS = 15
+
+def profile_directory(job_id: int, node_uuid: str) -> Path:
+    """
+    Returns where the profiles of a preservation run are written.
+    """
+    return Path(PROFILE_DIRECTORY) / f"{job_id or 'nojob'}-{node_uuid}"
+
+
+class JobProfiler:
+    """
+    Records a CPU profile and an allocation snapshot for each stage of a preservation run.
+
+    Each stage is saved as {n}-{stage}.prof (load with pstats or snakeviz) and
+    {n}-{stage}.alloc.txt, and summary.json lists the hottest functions and
+    largest allocation sites of every stage.
+    """
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        profile = cProfile.Profile()
+        tracemalloc.start()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            try:
+                self._save_stage(name, profile, snapshot, duration, peak)
+            except Exception as e:
+                logger.error(f"Failed to save {name} profile: {e}")
+
+    def _save_stage(self, name: str, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot, duration: float, peak: int):
+        prefix = self.directory / f"{len(self.stages):02d}-{name}"
+        profile.dump_stats(f"{prefix}.prof")
+
+        stats = pstats.Stats(profile)
+        functions = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({
+                'function': f"{filename}:{line}({function})",
+                'calls': calls,
+                'tottime': round(tottime, 6),
+                'cumtime': round(cumtime, 6)
+            })
+        functions.sort(key=lambda function: function['tottime'], reverse=True)
+
+        allocations = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )).statistics('lineno')
+        with open(f"{prefix}.alloc.txt", 'w') as alloc_file:
+            for statistic in allocations:
+                alloc_file.write(f"{statistic}\n")
+
+        self.stages.append({
+            'stage': name,
+            'duration': round(duration, 6),
+            'peak_traced_bytes': peak,
+            'top_functions': functions[:TOP_FUNCTIONS],
+            'top_allocations': [
+                {'site': str(statistic.traceback), 'bytes': statistic.size, 'count': statistic.count}
+                for statistic in allocations[:TOP_ALLOCATIONS]
+            ]
+        })
+
+    def write_summary(self) -> Path:
+        summary_path = self.directory / 'summary.json'
+        with open(summary_path, 'w') as summary_file:
+            json.dump({'stages': self.stages}, summary_file, indent=4)
+        for stage in self.stages:
+            hottest = ', '.join(f"{function['function']} {function['tottime']:.3f}s" for function in stage['top_functions'][:3])
+            logger.info(f"Profile {stage['stage']} {stage['duration']:.2f}s, peak {stage['peak_traced_bytes']} bytes: {hottest}")
+        return summary_path
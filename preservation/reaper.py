@@ -0,0 +1,251 @@
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from config import (
+    A3M_DAEMONS, A3M_DOCKER_IMAGE, REAPER_INTERVAL_SECONDS, REAPER_ORPHAN_AGE_SECONDS,
+    REAPER_FAILED_RETENTION_SECONDS, REAPER_STALE_RUNNING_SECONDS, REAPER_MIN_AGE_SECONDS,
+    REAPER_PRESSURE_FREE_RATIO
+)
+from preservation import metrics
+from preservation.admission import AdmissionController, pid_alive
+from preservation.worker_api import database_manager
+from preservation.scratch import volumes
+
+logger = logging.getLogger("preservation")
+
+# a3md output that the preservation run moves out as soon as the transfer finishes
+A3MD_SHARE_DIRECTORY = Path('/home/a3m/.local/share/a3m/share')
+A3MD_LEFTOVER_DIRECTORIES = ('completed', 'dips')
+
+def tree_usage(path: Path) -> tuple:
+    """
+    Returns the bytes under a path and the newest modification time in it.
+    """
+    total = 0
+    newest = path.stat().st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs:
+            try:
+                newest = max(newest, os.lstat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                continue
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            newest = max(newest, stat.st_mtime)
+            total += stat.st_size
+    return total, newest
+
+def exited_for(container) -> float:
+    """
+    Returns the seconds since a container exited.
+    """
+    finished = (container.attrs.get('State') or {}).get('FinishedAt') or ''
+    try:
+        # Docker reports nanoseconds, which fromisoformat doesn't take
+        finished_at = datetime.fromisoformat(finished[:19]).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return 0.0
+    return time.time() - finished_at.timestamp()
+
+
+class Reaper:
+    """
+    Removes what failed or interrupted preservation runs leave behind:
+    processing directories, AIPs and DIPs left in the a3m daemon and stray a3m client containers.
+
+    Anything belonging to a job that still holds a disk reservation is never touched.
+    Retention periods drop to REAPER_MIN_AGE_SECONDS while any scratch volume is short of space.
+    """
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.volumes = volumes()
+        for volume in self.volumes:
+            volume.mkdir(parents=True, exist_ok=True)
+        self.db_manager = database_manager()
+        self.admission = AdmissionController(self.db_manager)
+        self.host = socket.gethostname()
+        self.docker_client = self._docker_client()
+        self._stop = threading.Event()
+
+    def _docker_client(self):
+        try:
+            import docker
+            return docker.from_env()
+        except Exception as e:
+            logger.error(f"Docker unavailable, container leftovers will not be reaped: {e}")
+            return None
+
+    def under_pressure(self) -> bool:
+        for volume in self.volumes:
+            usage = shutil.disk_usage(volume)
+            if usage.free / usage.total < REAPER_PRESSURE_FREE_RATIO:
+                return True
+        return False
+
+    def _reclaimed(self, kind: str, target: str, size: int, reason: str):
+        action = "Would remove" if self.dry_run else "Removed"
+        logger.info(f"{action} {kind} {target} ({size} bytes): {reason}")
+        if not self.dry_run:
+            metrics.inc('preservation_reaper_removed_total', labels={'kind': kind})
+            metrics.inc('preservation_reaper_reclaimed_bytes_total', size, {'kind': kind})
+
+    def _directory_reason(self, job: dict, age: float, size: int, active: set, pressure: bool) -> str:
+        """
+        Returns why a processing directory can be removed, or None to keep it.
+        """
+        minimum = REAPER_MIN_AGE_SECONDS
+        if job is None:
+            if age > (minimum if pressure else REAPER_ORPHAN_AGE_SECONDS):
+                return "no job recorded"
+            return None
+        if job['id'] in active:
+            return None
+        if job['status'] == 'running':
+            if job['lease_expires'] is not None:
+                if job['lease_expires'] < time.time():
+                    return f"job {job['id']} lease expired"
+                return None
+            # An empty directory may belong to a job still waiting for admission
+            if size and age > REAPER_STALE_RUNNING_SECONDS:
+                return f"job {job['id']} is running without a live worker"
+            return None
+        if job['status'] in ('completed', 'skipped'):
+            return f"job {job['id']} {job['status']}"
+        if age > (minimum if pressure else REAPER_FAILED_RETENTION_SECONDS):
+            return f"job {job['id']} {job['status']}"
+        return None
+
+    def reap_processing_directories(self, pressure: bool) -> int:
+        # A job's directories on every volume share its processing directory's name
+        jobs = {Path(path).name: job for path, job in self.db_manager.get_jobs_by_processing_directory().items()}
+        active = self.admission.active_job_ids()
+        reclaimed = 0
+        now = time.time()
+        for path in (path for volume in self.volumes for path in volume.iterdir()):
+            if not path.is_dir():
+                continue
+            try:
+                size, newest = tree_usage(path)
+            except OSError as e:
+                logger.error(f"Failed to measure {path}: {e}")
+                continue
+            reason = self._directory_reason(jobs.get(path.name), now - newest, size, active, pressure)
+            if reason is None:
+                continue
+            if not self.dry_run:
+                shutil.rmtree(path, ignore_errors=True)
+            self._reclaimed('processing_directory', path, size, reason)
+            reclaimed += size
+        return reclaimed
+
+    def reap_a3md_leftovers(self, pressure: bool) -> int:
+        if self.docker_client is None:
+            return 0
+        running_aips = self.db_manager.get_running_aip_uuids()
+        reclaimed = 0
+        for name in A3M_DAEMONS:
+            try:
+                daemon = self.docker_client.containers.get(name)
+            except Exception as e:
+                logger.error(f"A3M Daemon container not found: {e}")
+                continue
+            reclaimed += self._reap_daemon_leftovers(daemon, running_aips, pressure)
+        return reclaimed
+
+    def _reap_daemon_leftovers(self, daemon, running_aips: set, pressure: bool) -> int:
+        minutes = int((REAPER_MIN_AGE_SECONDS if pressure else REAPER_ORPHAN_AGE_SECONDS) / 60)
+        reclaimed = 0
+        for directory in A3MD_LEFTOVER_DIRECTORIES:
+            path = A3MD_SHARE_DIRECTORY / directory
+            result = daemon.exec_run(
+                ['find', str(path), '-mindepth', '1', '-maxdepth', '1', '-mmin', f'+{minutes}', '-exec', 'du', '-sb', '{}', '+'],
+                user="root"
+            )
+            if result.exit_code != 0:
+                logger.error(f"Failed to list {path} in {daemon.name}: {result.output}")
+                continue
+            for line in result.output.decode('utf-8').splitlines():
+                size, _, leftover = line.partition('\t')
+                if not leftover or any(aip_uuid in leftover for aip_uuid in running_aips):
+                    continue
+                if not self.dry_run:
+                    removed = daemon.exec_run(['rm', '-rf', leftover], user="root")
+                    if removed.exit_code != 0:
+                        logger.error(f"Failed to remove {leftover} from {daemon.name}: {removed.output}")
+                        continue
+                self._reclaimed(f'a3md_{directory}', leftover, int(size), "not collected by a preservation run")
+                reclaimed += int(size)
+        return reclaimed
+
+    def reap_client_containers(self) -> int:
+        if self.docker_client is None:
+            return 0
+        from preservation.a3m import CLIENT_CONTAINER_LABEL, OWNER_HOST_LABEL, OWNER_PID_LABEL
+        removed = 0
+        labelled = self.docker_client.containers.list(all=True, filters={'label': CLIENT_CONTAINER_LABEL})
+        # Containers started before they were labelled
+        exited = self.docker_client.containers.list(all=True, filters={'ancestor': A3M_DOCKER_IMAGE, 'status': 'exited'})
+        seen = set()
+        for container in labelled + exited:
+            if container.id in seen or container.name in A3M_DAEMONS:
+                continue
+            seen.add(container.id)
+            labels = container.labels or {}
+            if OWNER_PID_LABEL in labels:
+                # Only a client whose owning process has died on this host is stray, an exited one
+                # may still be waiting for its owner to read its logs and remove it
+                if labels.get(OWNER_HOST_LABEL) != self.host or pid_alive(int(labels[OWNER_PID_LABEL] or 0)):
+                    continue
+                reason = f"owning process {labels[OWNER_PID_LABEL]} has died"
+            elif container.status == 'exited' and exited_for(container) > REAPER_MIN_AGE_SECONDS:
+                reason = f"left {container.status}"
+            else:
+                continue
+            if not self.dry_run:
+                try:
+                    container.remove(force=True)
+                except Exception as e:
+                    logger.error(f"Failed to remove container {container.name}: {e}")
+                    continue
+            self._reclaimed('a3m_client_container', container.name, 0, reason)
+            removed += 1
+        return removed
+
+    def sweep(self) -> int:
+        """
+        Runs every policy once. Returns the bytes reclaimed.
+        """
+        pressure = self.under_pressure()
+        if pressure:
+            logger.info("Processing volume is under disk pressure, using minimum retention")
+        reclaimed = 0
+        for policy in (self.reap_processing_directories, self.reap_a3md_leftovers):
+            try:
+                reclaimed += policy(pressure)
+            except Exception as e:
+                logger.error(f"Reaper {policy.__name__} failed: {e}")
+        try:
+            self.reap_client_containers()
+        except Exception as e:
+            logger.error(f"Reaper reap_client_containers failed: {e}")
+        metrics.registry.set('preservation_reaper_last_sweep_timestamp_seconds', time.time())
+        logger.info(f"Reaper sweep {'found' if self.dry_run else 'reclaimed'} {reclaimed} bytes")
+        return reclaimed
+
+    def run(self, interval: float = REAPER_INTERVAL_SECONDS):
+        logger.info("Starting reaper")
+        while not self._stop.is_set():
+            self.sweep()
+            self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,237 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from config import (
+    BREAKER_FAILURE_THRESHOLD, BREAKER_MAX_WAIT_SECONDS, BREAKER_RESET_SECONDS, RETRY_BASE_DELAY_SECONDS,
+    RETRY_BUDGET_MIN_PER_SECOND, RETRY_BUDGET_RATIO, RETRY_MAX_ATTEMPTS, RETRY_MAX_DELAY_SECONDS
+)
+from preservation import cancellation, metrics
+
+logger = logging.getLogger("preservation")
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+# Retries an endpoint can save up while it is healthy
+BUDGET_CAPACITY = 10
+# How often calls held by an open circuit check it again
+BREAKER_POLL_SECONDS = 1
+
+
+class TransientError(RuntimeError):
+    """
+    A failure that is worth retrying which isn't an HTTP error, such as Cells being too slow to issue a token.
+    """
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised when a service stays unavailable for longer than a call will wait for it.
+    """
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (TransientError, requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def retry_after(error: Exception) -> float:
+    """
+    Returns the delay a 429 or 503 response asked for in seconds, or None.
+    """
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+def backoff(attempt: int) -> float:
+    """
+    Full jitter exponential backoff, so that workers failing together don't retry together.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)))
+
+
+class RetryBudget:
+    """
+    Limits the retries of one endpoint to RETRY_BUDGET_RATIO of its calls, plus
+    RETRY_BUDGET_MIN_PER_SECOND, so an outage isn't answered with a storm of retries.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = float(BUDGET_CAPACITY)
+        self._updated = time.monotonic()
+
+    def _refill(self, tokens: float):
+        now = time.monotonic()
+        self._tokens = min(BUDGET_CAPACITY, self._tokens + tokens + (now - self._updated) * RETRY_BUDGET_MIN_PER_SECOND)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(RETRY_BUDGET_RATIO)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a service after BREAKER_FAILURE_THRESHOLD consecutive transient failures.
+
+    After BREAKER_RESET_SECONDS one call is let through as a probe. If it succeeds the
+    circuit closes again, otherwise it stays open for another BREAKER_RESET_SECONDS.
+    """
+    def __init__(self, service: str):
+        self.service = service
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+
+    def _cooling(self) -> bool:
+        return self._opened is not None and time.monotonic() - self._opened < BREAKER_RESET_SECONDS
+
+    def available(self) -> bool:
+        """
+        Returns True unless the circuit is open or a probe is already in flight.
+        """
+        with self._lock:
+            return self._opened is None or not (self._cooling() or self._probing)
+
+    def allow(self) -> bool:
+        """
+        Returns True if a call may go ahead, making it the probe when the circuit is half open.
+        """
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._cooling() or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened is not None:
+                logger.info(f"{self.service} is available again, closing its circuit")
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= BREAKER_FAILURE_THRESHOLD:
+                if self._opened is None:
+                    logger.error(f"{self.service} failed {self._failures} times in a row, opening its circuit")
+                    metrics.inc('preservation_circuit_opened_total', labels={'service': self.service})
+                self._opened = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """
+        Ends a probe that finished without telling whether the service works, so the next call probes instead.
+        """
+        with self._lock:
+            self._probing = False
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Blocks until the service may be called. Returns False if timeout passes first.
+        Raises Cancelled if the current job is cancelled while waiting.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.available():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            cancellation.sleep(BREAKER_POLL_SECONDS)
+        return True
+
+
+class ResiliencePolicy:
+    """
+    The retry and circuit breaking policy shared by every Curate and AtoM call.
+    Breakers are per service and retry budgets per endpoint, shared by the threads of a process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._budgets = {}
+
+    def breaker(self, service: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(service, CircuitBreaker(service))
+
+    def budget(self, service: str, endpoint: str) -> RetryBudget:
+        with self._lock:
+            return self._budgets.setdefault((service, endpoint), RetryBudget())
+
+    def call(self, service: str, endpoint: str, function):
+        """
+        Calls function, retrying transient failures with jittered exponential backoff while
+        the endpoint's retry budget allows. While the service's circuit is open the call waits
+        up to BREAKER_MAX_WAIT_SECONDS for it rather than failing work already done.
+        Waits end early, raising Cancelled, when the current job is cancelled.
+        """
+        breaker = self.breaker(service)
+        budget = self.budget(service, endpoint)
+        labels = {'service': service, 'endpoint': endpoint}
+        budget.deposit()
+        attempt = 1
+        while True:
+            waited = time.monotonic()
+            while not breaker.allow():
+                if time.monotonic() - waited >= BREAKER_MAX_WAIT_SECONDS:
+                    raise CircuitOpenError(f"{service} has been unavailable for {BREAKER_MAX_WAIT_SECONDS}s")
+                cancellation.sleep(BREAKER_POLL_SECONDS)
+            try:
+                result = function()
+            except Exception as e:
+                if not is_transient(e):
+                    # The service answered, so it is up
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt >= RETRY_MAX_ATTEMPTS:
+                    raise
+                if not budget.withdraw():
+                    metrics.inc('preservation_retry_budget_exhausted_total', labels=labels)
+                    logger.error(f"Retry budget of {service} {endpoint} exhausted")
+                    raise
+                delay = min(retry_after(e) or backoff(attempt), RETRY_MAX_DELAY_SECONDS)
+                metrics.inc('preservation_http_retries_total', labels=labels)
+                logger.warning(f"{service} {endpoint} failed (attempt {attempt}/{RETRY_MAX_ATTEMPTS}), retrying in {delay:.1f}s: {e}")
+                cancellation.sleep(delay)
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+    def wait_until_available(self, services: tuple, timeout: float = BREAKER_MAX_WAIT_SECONDS):
+        """
+        Blocks until none of the services' circuits are open.
+        Raises CircuitOpenError if one stays open for timeout seconds, and Cancelled if the current job is cancelled.
+        """
+        deadline = time.monotonic() + timeout
+        for service in services:
+            breaker = self.breaker(service)
+            if breaker.available():
+                continue
+            logger.info(f"Waiting for {service} to become available")
+            if not breaker.wait(max(deadline - time.monotonic(), 0)):
+                raise CircuitOpenError(f"{service} has been unavailable for {timeout}s")
+
+
+policy = ResiliencePolicy()
+call = policy.call
+wait_until_available = policy.wait_until_available
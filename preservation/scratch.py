@@ -0,0 +1,118 @@
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from config import ADMISSION_HEADROOM_BYTES, PROCESSING_IO_SAMPLE_SECONDS, PROCESSING_STAGE_TIERS, PROCESSING_VOLUMES
+
+logger = logging.getLogger("preservation")
+
+# What each tier of PROCESSING_STAGE_TIERS holds:
+# download: the download and the transfer a3m reads, extract: the AIP moved out of a3md, its extraction, compressed copy and DIP
+TIERS = ('download', 'extract')
+DISKSTATS = Path('/proc/diskstats')
+
+def tier_volumes(tier: str) -> list:
+    return [Path(volume) for volume in PROCESSING_VOLUMES[PROCESSING_STAGE_TIERS[tier]]]
+
+def volumes() -> list:
+    """
+    Returns every scratch volume, each once.
+    """
+    return list(dict.fromkeys(Path(volume) for paths in PROCESSING_VOLUMES.values() for volume in paths))
+
+def volume_of(path: Path) -> Path:
+    """
+    Returns the scratch volume a processing directory is on.
+    """
+    return max((volume for volume in volumes() if Path(path).is_relative_to(volume)), key=lambda volume: len(volume.parts))
+
+def _io_ticks() -> dict:
+    """
+    Returns the milliseconds each block device has spent doing I/O, empty where /proc/diskstats is unavailable.
+    """
+    try:
+        lines = DISKSTATS.read_text().splitlines()
+    except OSError:
+        return {}
+    return {(int(fields[0]), int(fields[1])): int(fields[12]) for fields in map(str.split, lines) if len(fields) > 12}
+
+def io_busy(paths: list) -> dict:
+    """
+    Returns the fraction of PROCESSING_IO_SAMPLE_SECONDS the device under each path spent doing I/O.
+    Devices without disk statistics, such as tmpfs or network filesystems, count as idle.
+    """
+    devices = {}
+    for path in paths:
+        device = os.stat(path).st_dev
+        devices[path] = (os.major(device), os.minor(device))
+    before, start = _io_ticks(), time.monotonic()
+    if not before or PROCESSING_IO_SAMPLE_SECONDS <= 0:
+        return {path: 0.0 for path in paths}
+    time.sleep(PROCESSING_IO_SAMPLE_SECONDS)
+    after, elapsed = _io_ticks(), (time.monotonic() - start) * 1000
+    return {
+        path: min(1.0, (after.get(device, 0) - before.get(device, 0)) / elapsed) if device in before else 0.0
+        for path, device in devices.items()
+    }
+
+
+class ScratchSpace:
+    """
+    Places processing directories on the scratch volumes of PROCESSING_VOLUMES.
+
+    A job's processing directory is on a volume of its download tier. When its extract tier is
+    on another volume, a directory of the same name there holds the rest of its files. Each tier's
+    volume is chosen by its free space, less what running jobs have reserved on it, shared out
+    between the jobs already on it and scaled down by how busy its device is.
+    """
+    def __init__(self, admission):
+        self.admission = admission
+        for volume in volumes():
+            volume.mkdir(parents=True, exist_ok=True)
+
+    def _scores(self) -> dict:
+        usage = self.admission.volume_usage()
+        busy = io_busy(volumes())
+        scores = {}
+        for volume in volumes():
+            outstanding, jobs = usage.get(str(volume), (0, 0))
+            available = max(shutil.disk_usage(volume).free - outstanding - ADMISSION_HEADROOM_BYTES, 0)
+            scores[volume] = available * (1 - busy[volume]) / (1 + jobs)
+        return scores
+
+    def place(self) -> Path:
+        """
+        Creates a new processing directory on each tier's best volume. Returns the download tier's.
+        """
+        scores = self._scores()
+        name = str(uuid4())
+        placed = {}
+        for tier in TIERS:
+            volume = max(tier_volumes(tier), key=lambda volume: scores[volume])
+            placed[tier] = volume / name
+            placed[tier].mkdir(exist_ok=True)
+        logger.debug(f"Created new processing directory {placed['download']}, extracting to {placed['extract'].parent}")
+        return placed['download']
+
+    def directory(self, processing_directory: Path, tier: str) -> Path:
+        """
+        Returns the directory of a processing directory's job on a tier.
+        """
+        for volume in tier_volumes(tier):
+            if (volume / processing_directory.name).is_dir():
+                return volume / processing_directory.name
+        return processing_directory
+
+    def directories(self, processing_directory: Path) -> list:
+        """
+        Returns every directory of a processing directory's job, across all volumes.
+        """
+        return [volume / processing_directory.name for volume in volumes() if (volume / processing_directory.name).is_dir()]
+
+    def remove(self, processing_directory: Path):
+        logger.info(f"Removing processing directory {processing_directory}")
+        for directory in self.directories(processing_directory):
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,58 @@
+from pathlib import PurePosixPath
+
+def is_collection(node: dict) -> bool:
+    return node.get('Type') in ('COLLECTION', 2)
+
+def _size(node: dict) -> int:
+    try:
+        return int(node.get('Size') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def plan_parts(child_nodes: list, max_bytes: int, max_files: int) -> list:
+    """
+    Partitions the recursive child listing of a directory into parts of at most
+    max_bytes and max_files, either of which may be 0 for no limit.
+
+    Files are taken in path order so each part keeps whole neighbouring folders where it can.
+    A file larger than max_bytes gets a part of its own. Each folder goes to the part holding
+    its first file, or to the last part if it is empty, so its metadata travels with its contents.
+    Returns a list of child node lists, a single part when no split is needed.
+    """
+    files = sorted((node for node in child_nodes if not is_collection(node)), key=lambda node: node['Path'])
+    parts, part_bytes = [[]], 0
+    for node in files:
+        size = _size(node)
+        full = (max_bytes and part_bytes + size > max_bytes) or (max_files and len(parts[-1]) >= max_files)
+        if parts[-1] and full:
+            parts.append([])
+            part_bytes = 0
+        parts[-1].append(node)
+        part_bytes += size
+
+    folder_parts = {}
+    for index, part in enumerate(parts):
+        for node in part:
+            for parent in PurePosixPath(node['Path']).parents:
+                folder_parts.setdefault(str(parent), index)
+    for node in child_nodes:
+        if is_collection(node):
+            parts[folder_parts.get(node['Path'], len(parts) - 1)].append(node)
+    return parts
+
+def part_node(node: dict, group: str, index: int, children: list, count: int, fingerprint: dict) -> dict:
+    """
+    Returns the node submitted for one part of a split directory.
+    Size is the size of the part so admission reserves only what the part needs.
+    """
+    return {
+        **node,
+        'Size': str(sum(_size(child) for child in children if not is_collection(child))),
+        'SplitPart': {
+            'group': group,
+            'index': index,
+            'count': count,
+            'children': children,
+            'fingerprint': fingerprint
+        }
+    }
@@ -0,0 +1,48 @@
+from config import SCHEDULER_INTERACTIVE_MAX_NODES
+from db.models.job_model import JOB_PRIORITIES, JobModel
+
+
+class Submission:
+    """
+    Queues the nodes of one submission as they are read, for both POST /jobs and main.py --nodes-file.
+
+    Without an explicit priority, submissions of up to SCHEDULER_INTERACTIVE_MAX_NODES nodes are
+    queued as high and larger ones as normal. The first nodes are held back until the submission
+    either ends or grows past that, so every job is queued at its final priority.
+    """
+    def __init__(self, user: str, config_id: int, profile: bool = False, force: bool = False, priority: str = None):
+        self.user = user
+        self.config_id = config_id
+        self.profile = profile
+        self.force = force
+        self.priority = JOB_PRIORITIES[priority] if priority else None
+        self.job_ids = []
+        self._held = []
+
+    def add(self, nodes: list) -> list:
+        """
+        Queues nodes. Returns the (job ID, node) of each job queued, which may be none or include nodes held back before.
+        """
+        if self.priority is None:
+            self._held += nodes
+            if len(self._held) <= SCHEDULER_INTERACTIVE_MAX_NODES:
+                return []
+            self.priority = JOB_PRIORITIES['normal']
+            nodes, self._held = self._held, []
+        return self._queue(nodes)
+
+    def finish(self) -> list:
+        """
+        Queues the nodes still held back once the submission has ended. Returns their (job ID, node).
+        """
+        if self.priority is None:
+            self.priority = JOB_PRIORITIES['high']
+        nodes, self._held = self._held, []
+        return self._queue(nodes)
+
+    def _queue(self, nodes: list) -> list:
+        if not nodes:
+            return []
+        job_ids = JobModel.add_jobs_to_db(nodes, self.user, self.config_id, self.profile, self.force, self.priority)
+        self.job_ids += job_ids
+        return list(zip(job_ids, nodes))
@@ -0,0 +1,110 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from uuid import uuid4
+
+from config import TRACE_DIRECTORY, TRACING_ENABLED
+
+logger = logging.getLogger("preservation")
+
+_active_trace = contextvars.ContextVar('active_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Trace:
+    """
+    Collects the spans of one preservation run as Chrome trace events.
+
+    The written file loads in Perfetto or chrome://tracing. Every event carries
+    trace, span and parent span IDs so it can also be replayed into an OTLP collector.
+    """
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'trace_id': self.trace_id, 'name': self.name, **{k: str(v) for k, v in self.attributes.items()}}
+        }
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file)
+        logger.debug(f"Wrote trace {self.trace_id} to {path}")
+
+
+def trace_path(name: str) -> Path:
+    """
+    Returns where a trace is written, grouped by day.
+    """
+    return Path(TRACE_DIRECTORY) / datetime.now().strftime('%Y-%m-%d') / f"{name}.json"
+
+@contextmanager
+def trace(name: str, path: Path, **attributes):
+    """
+    Records every span opened inside the block and writes them to path on exit.
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    active = Trace(name, attributes)
+    token = _active_trace.set(active)
+    try:
+        with span(name, 'preservation', **attributes):
+            yield active
+    finally:
+        _active_trace.reset(token)
+        try:
+            active.write(path)
+        except Exception as e:
+            logger.error(f"Failed to write trace to {path}: {e}")
+
+@contextmanager
+def span(name: str, category: str, **attributes):
+    """
+    Records the block as a span of the active trace.
+    Yields the span attributes so more can be added as they become known.
+    Does nothing outside a trace.
+    """
+    active = _active_trace.get()
+    if active is None:
+        yield attributes
+        return
+    span_id = uuid4().hex[:16]
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.time_ns()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes['error'] = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        args = {k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k, v in attributes.items()}
+        args.update(trace_id=active.trace_id, span_id=span_id, parent_span_id=parent_id)
+        active.add({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': (time.time_ns() - start) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_native_id(),
+            'args': args
+        })
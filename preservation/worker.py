@@ -0,0 +1,201 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from config import CURATE_URL, JOB_CANCEL_POLL_SECONDS, JOB_HEARTBEAT_SECONDS, SCHEDULER_TAG_INTERVAL_SECONDS, SCHEDULER_TAG_MAX_JOBS
+from preservation import cancellation, logs
+from preservation.curate import CurateManager
+from preservation.database import DatabaseManager
+from preservation.worker_api import database_manager
+from preservation.batching import batchable
+from preservation.preservation import Preservation, process_batch, process_node
+
+logger = logging.getLogger("preservation")
+
+class LeaseKeeper:
+    """
+    Renews the leases on a worker's running jobs every JOB_HEARTBEAT_SECONDS
+    so no other worker reclaims them while they are still being processed,
+    and cancels them through token once any of them has been asked to stop.
+    """
+    def __init__(self, db_manager: DatabaseManager, owner: str, job_ids: list, token: cancellation.CancelToken):
+        self.db_manager = db_manager
+        self.owner = owner
+        self.job_ids = list(job_ids)
+        self.token = token
+        self.cancel_requests = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def _check_cancel_requests(self):
+        try:
+            requested = self.db_manager.get_cancel_requests(self.job_ids)
+        except Exception as e:
+            logger.error(f"Failed to check jobs {self.job_ids} for cancel requests: {e}")
+            return
+        if requested and not self.token.cancelled:
+            logger.info(f"Cancelling jobs {sorted(requested)}")
+            self.cancel_requests = requested
+            self.token.cancel()
+
+    def _renew(self):
+        try:
+            lost = self.db_manager.renew_leases(self.job_ids, self.owner)
+        except Exception as e:
+            logger.error(f"Failed to renew leases on jobs {self.job_ids}: {e}")
+            return
+        for job_id in lost:
+            logger.warning(f"Lost the lease on job {job_id}, it may be processed by another worker")
+            self.job_ids.remove(job_id)
+        # Carrying on would race the worker that reclaimed the job
+        if lost and not self.token.cancelled:
+            self.token.cancel(cancellation.LEASE_LOST)
+
+    def _run(self):
+        renewed = time.monotonic()
+        while not self._stop.wait(min(JOB_CANCEL_POLL_SECONDS, JOB_HEARTBEAT_SECONDS)):
+            self._check_cancel_requests()
+            if time.monotonic() - renewed >= JOB_HEARTBEAT_SECONDS:
+                self._renew()
+                renewed = time.monotonic()
+
+    def __enter__(self) -> 'LeaseKeeper':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueueTagger:
+    """
+    Shows the jobs at the front of the queue their position and estimated start in Curate,
+    from a thread of its own so the Curate calls don't hold up claiming jobs.
+    Every worker runs one, but only one tags per SCHEDULER_TAG_INTERVAL_SECONDS.
+    """
+    def __init__(self, db_manager: DatabaseManager, poll_interval: float):
+        self.db_manager = db_manager
+        self.poll_interval = poll_interval
+        self.curate_manager = CurateManager('admin', CURATE_URL, configure_client=False)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='queue-tagger', daemon=True)
+
+    def tag_queue_positions(self):
+        try:
+            if not self.db_manager.claim_interval('queue_tags', SCHEDULER_TAG_INTERVAL_SECONDS):
+                return
+            estimates = self.db_manager.get_queue_estimates(SCHEDULER_TAG_MAX_JOBS)
+        except Exception as e:
+            logger.error(f"Failed to estimate queue positions: {e}")
+            return
+        for estimate in estimates:
+            if self._stop.is_set():
+                return
+            tag = f"Queued: position {estimate['position']}"
+            if estimate['estimated_start']:
+                start = datetime.strptime(estimate['estimated_start'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).astimezone()
+                tag += f", starts ~{start:%H:%M}" if start.date() == datetime.now().date() else f", starts ~{start:%d %b %H:%M}"
+            try:
+                # A job claimed since the estimate has its own progress tag, which this would overwrite
+                if not self.db_manager.is_job_queued(estimate['id']):
+                    continue
+                self.curate_manager.update_tag(estimate['node_uuid'], tag)
+            except Exception as e:
+                logger.error(f"Failed to tag queue position of job {estimate['id']}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            self.tag_queue_positions()
+
+    def __enter__(self) -> 'QueueTagger':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class PreservationWorker:
+    """
+    Claims queued preservation jobs from the database and processes them one at a time.
+    Claimed jobs are leased to the worker for as long as it keeps renewing them, so
+    worker processes on this host, and on other hosts through WORKER_API_URL, can share one queue.
+    """
+    def __init__(self, poll_interval: float = 5):
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.db_manager = database_manager()
+        self._stop = threading.Event()
+
+    def process_job(self, job: dict):
+        logger.info(f"Claimed job {job['id']} for {job['node_path']} (attempt {job['attempts']})")
+        token = cancellation.CancelToken()
+        with LeaseKeeper(self.db_manager, self.worker_id, [job['id']], token) as lease_keeper, cancellation.activate(token), \
+                logs.context(job_id=job['id'], node_uuid=job['node_uuid']):
+            self._process_job(job, lease_keeper)
+
+    def _process_job(self, job: dict, lease_keeper: LeaseKeeper):
+        try:
+            # Built per job so config edits and the user's Cells Client login apply
+            preserver = Preservation(config_id=job['config_id'], user=job['user'])
+            processing_directory = preserver.get_new_processing_directory()
+        except Exception as e:
+            logger.error(f"Failed to start job {job['id']}: {e}")
+            try:
+                self.db_manager.finish_job(job['id'], 'failed', str(e), owner=self.worker_id)
+            except Exception as e:
+                logger.error(f"Failed to record job {job['id']} as failed: {e}")
+            return
+        try:
+            jobs = self.claim_batch(preserver, job)
+            lease_keeper.job_ids = [batch_job['id'] for batch_job in jobs]
+            if len(jobs) > 1:
+                logger.info(f"Batching jobs {[batch_job['id'] for batch_job in jobs]}")
+                process_batch(preserver, jobs, processing_directory, profile=bool(job['profile']))
+            else:
+                process_node(preserver, job['node'], processing_directory, job_id=job['id'], profile=bool(job['profile']),
+                             force=bool(job['force']), owner=self.worker_id)
+        except Exception as e:
+            if cancellation.lease_lost():
+                logger.warning(f"Job {job['id']} stopped, its lease was lost")
+                return
+            if cancellation.cancelled():
+                logger.info(f"Job {job['id']} cancelled")
+                return
+            logger.error(f"Job {job['id']} failed: {e}")
+
+    def claim_batch(self, preserver: Preservation, job: dict) -> list:
+        """
+        Claims more small file jobs to preserve alongside job when its config batches them.
+        """
+        max_file_bytes = preserver.processing_config['batch_max_file_bytes']
+        if not batchable(job['node'], max_file_bytes):
+            return [job]
+        try:
+            return [job] + self.db_manager.claim_batch_jobs(job, preserver.processing_config['batch_max_nodes'] - 1, max_file_bytes)
+        except Exception as e:
+            logger.error(f"Failed to claim jobs to batch with job {job['id']}: {e}")
+            return [job]
+
+    def run(self):
+        logger.info(f"Starting preservation worker {self.worker_id}")
+        with QueueTagger(self.db_manager, self.poll_interval):
+            while not self._stop.is_set():
+                try:
+                    job = self.db_manager.claim_next_job(self.worker_id)
+                except Exception as e:
+                    logger.error(f"Failed to claim preservation job: {e}")
+                    job = None
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+                self.process_job(job)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,84 @@
+import json
+import logging
+
+import requests
+
+from config import HTTP_TIMEOUT_SECONDS, RETRY_MAX_ATTEMPTS, WORKER_API_TOKEN, WORKER_API_URL
+from preservation import cancellation, resilience
+from preservation.database import DatabaseManager, LeaseLost
+
+logger = logging.getLogger("preservation")
+
+# What workers on other hosts may call on the host holding the job database, by the object answering it
+METHODS = {
+    'jobs': (
+        'get_preservation_processing_configs', 'get_atom_config', 'create_job', 'claim_next_job', 'claim_batch_jobs',
+        'renew_leases', 'get_cancel_requests', 'requeue_jobs', 'start_job', 'update_job', 'finish_job',
+        'get_queue_estimates', 'claim_interval', 'is_job_queued', 'get_job_priority', 'get_jobs_by_processing_directory',
+        'get_split_progress', 'get_running_aip_uuids', 'get_peak_ratios', 'start_job_stage', 'finish_job_stage',
+        'get_remaining_estimate', 'add_metric_samples',
+    ),
+    'fingerprints': ('unchanged', 'record'),
+    'aips': ('delete_files', 'insert_files'),
+}
+# Sets travel as JSON lists
+SET_RESULTS = ('get_cancel_requests', 'get_running_aip_uuids')
+
+
+class WorkerAPIError(RuntimeError):
+    pass
+
+
+def call(target: str, method: str, *args, **kwargs):
+    """
+    Calls method of target on the API host and returns its result, raising LeaseLost as it was raised there.
+
+    Only failures to reach the API are retried. A call that timed out or failed there may
+    already have claimed or written, so it is left to the caller like a local database error.
+    """
+    body = json.dumps({'args': args, 'kwargs': kwargs}, default=str)
+    headers = {'Authorization': f'Bearer {WORKER_API_TOKEN}', 'Content-Type': 'application/json'}
+    attempt = 1
+    while True:
+        try:
+            response = requests.post(f"{WORKER_API_URL}/workers/{target}/{method}", data=body, headers=headers,
+                                     timeout=HTTP_TIMEOUT_SECONDS)
+            break
+        except requests.ConnectionError as e:
+            if attempt >= RETRY_MAX_ATTEMPTS:
+                raise
+            delay = resilience.backoff(attempt)
+            logger.warning(f"Worker API {target}/{method} unreachable (attempt {attempt}/{RETRY_MAX_ATTEMPTS}), retrying in {delay:.1f}s: {e}")
+            cancellation.sleep(delay)
+            attempt += 1
+    try:
+        detail = response.json().get('detail')
+    except ValueError:
+        detail = response.text
+    if response.status_code == 409:
+        raise LeaseLost(detail)
+    if response.status_code != 200:
+        raise WorkerAPIError(f"Worker API {target}/{method} failed with {response.status_code}: {detail}")
+    return response.json()['result']
+
+
+class RemoteDatabaseManager:
+    """
+    The DatabaseManager of the host holding the job database, called through its worker API.
+    Takes the same calls and raises LeaseLost the same way, so workers on other hosts share its queue and leases.
+    """
+    def __getattr__(self, method: str):
+        if method not in METHODS['jobs']:
+            raise AttributeError(method)
+
+        def remote(*args, **kwargs):
+            result = call('jobs', method, *args, **kwargs)
+            return set(result) if method in SET_RESULTS else result
+        return remote
+
+
+def database_manager():
+    """
+    Returns the job database of a worker process: its own on the host holding it, through WORKER_API_URL elsewhere.
+    """
+    return RemoteDatabaseManager() if WORKER_API_URL else DatabaseManager()
@@ -0,0 +1,33 @@
+import argparse
+import signal
+
+from config import REAPER_INTERVAL_SECONDS
+from preservation import logs, metrics
+from preservation.reaper import Reaper
+
+logger = logs.configure("preservation", 'preservation_reaper.log')
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Curate Preservation Reaper')
+    parser.add_argument('-i', '--interval', help='Seconds between sweeps', type=float, default=REAPER_INTERVAL_SECONDS)
+    parser.add_argument('--once', help='Run a single sweep and exit', action='store_true')
+    parser.add_argument('--dry-run', help='Log what would be removed without removing it', action='store_true')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    metrics.start_flusher()
+    reaper = Reaper(dry_run=args.dry_run)
+    if args.once:
+        reaper.sweep()
+        return
+    signal.signal(signal.SIGTERM, lambda signum, frame: reaper.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: reaper.stop())
+    reaper.run(args.interval)
+
+if __name__ == '__main__':
+    logger.info(' =============== REAPER STARTED =============== ')
+    main()
+    logger.info(' =============== REAPER STOPPED =============== \n')
@@ -0,0 +1,277 @@
+import hashlib
+import logging
+import random
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+
+logger = logging.getLogger("preservation")
+
+# Where the real a3m daemon keeps its output, as seen by exec_run commands
+CONTAINER_SHARE_DIRECTORY = '/home/a3m/.local/share/a3m/share'
+ExecResult = namedtuple('ExecResult', 'exit_code,output')
+
+METS_NAMESPACES = {
+    'mets': 'http://www.loc.gov/METS/',
+    'premis': 'http://www.loc.gov/premis/v3',
+    'xlink': 'http://www.w3.org/1999/xlink',
+}
+# Format name and PRONOM PUID identified for each extension the shapes generate
+FORMATS = {
+    '.tif': ('Tagged Image File Format', 'fmt/353'),
+    '.pdf': ('Acrobat PDF 1.4 - Portable Document Format', 'fmt/18'),
+    '.jpg': ('JPEG File Interchange Format', 'fmt/43'),
+    '.json': ('JSON Data Interchange Format', 'fmt/817'),
+    '.xml': ('Extensible Markup Language', 'fmt/101'),
+}
+
+
+def tree_size(path: Path) -> int:
+    return sum(child.stat().st_size for child in path.rglob('*') if child.is_file())
+
+def sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_mets(path: Path, package_uuid: str, objects_directory: Path):
+    """
+    Writes a METS document with a PREMIS object for every file, as a3m does,
+    the amdSecs ahead of the fileSec.
+    """
+    for prefix, uri in METS_NAMESPACES.items():
+        ET.register_namespace(prefix, uri)
+    mets_ns, premis_ns, xlink_ns = (f"{{{METS_NAMESPACES[prefix]}}}" for prefix in ('mets', 'premis', 'xlink'))
+    mets = ET.Element(f'{mets_ns}mets', {'OBJID': package_uuid})
+    ET.SubElement(mets, f'{mets_ns}metsHdr', {'CREATEDATE': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')})
+    file_sec = ET.Element(f'{mets_ns}fileSec')
+    file_groups = {use: ET.SubElement(file_sec, f'{mets_ns}fileGrp', {'USE': use}) for use in ('original', 'metadata')}
+    for index, file_path in enumerate(sorted(path for path in objects_directory.rglob('*') if path.is_file())):
+        file_uuid = str(uuid4())
+        amd_id = f'amdSec_{index + 1}'
+        amd = ET.SubElement(mets, f'{mets_ns}amdSec', {'ID': amd_id})
+        xml_data = ET.SubElement(ET.SubElement(ET.SubElement(amd, f'{mets_ns}techMD', {'ID': f'techMD_{index + 1}'}),
+                                               f'{mets_ns}mdWrap', {'MDTYPE': 'PREMIS:OBJECT'}), f'{mets_ns}xmlData')
+        premis_object = ET.SubElement(xml_data, f'{premis_ns}object', {'version': '3.0'})
+        identifier = ET.SubElement(premis_object, f'{premis_ns}objectIdentifier')
+        ET.SubElement(identifier, f'{premis_ns}objectIdentifierType').text = 'UUID'
+        ET.SubElement(identifier, f'{premis_ns}objectIdentifierValue').text = file_uuid
+        characteristics = ET.SubElement(premis_object, f'{premis_ns}objectCharacteristics')
+        fixity = ET.SubElement(characteristics, f'{premis_ns}fixity')
+        ET.SubElement(fixity, f'{premis_ns}messageDigestAlgorithm').text = 'sha256'
+        ET.SubElement(fixity, f'{premis_ns}messageDigest').text = sha256(file_path)
+        ET.SubElement(characteristics, f'{premis_ns}size').text = str(file_path.stat().st_size)
+        format_name, puid = FORMATS.get(file_path.suffix.lower(), ('Generic binary', None))
+        premis_format = ET.SubElement(characteristics, f'{premis_ns}format')
+        ET.SubElement(ET.SubElement(premis_format, f'{premis_ns}formatDesignation'), f'{premis_ns}formatName').text = format_name
+        if puid:
+            registry = ET.SubElement(premis_format, f'{premis_ns}formatRegistry')
+            ET.SubElement(registry, f'{premis_ns}formatRegistryName').text = 'PRONOM'
+            ET.SubElement(registry, f'{premis_ns}formatRegistryKey').text = puid
+        ET.SubElement(premis_object, f'{premis_ns}originalName').text = f"%transferDirectory%{file_path.relative_to(objects_directory.parent)}"
+        use = 'metadata' if 'metadata' in file_path.relative_to(objects_directory).parts else 'original'
+        file_element = ET.SubElement(file_groups[use], f'{mets_ns}file', {'ID': f'file-{file_uuid}', 'ADMID': amd_id})
+        ET.SubElement(file_element, f'{mets_ns}FLocat', {
+            'LOCTYPE': 'OTHER', 'OTHERLOCTYPE': 'SYSTEM', f'{xlink_ns}href': str(file_path.relative_to(objects_directory.parent))
+        })
+    mets.append(file_sec)
+    ET.ElementTree(mets).write(path, encoding='UTF-8', xml_declaration=True)
+
+
+class SimulatedA3MDaemon:
+    """
+    Turns transfers into AIPs the way a3md does, at a configurable speed.
+
+    AIPs are written as 7z archived bags under share/completed with METS and PREMIS for
+    every file, and DIPs under share/dips when the processing config enables them.
+    A transfer takes overhead seconds plus its size over bytes_per_second, and fails at failure_rate.
+    At most concurrency transfers are processed at once, the rest wait as they would for a3m's workers.
+    """
+    def __init__(self, share_directory: Path, overhead: float = 0, bytes_per_second: float = 0, failure_rate: float = 0,
+                 concurrency: int = 1):
+        self.share_directory = share_directory
+        self.overhead = overhead
+        self.bytes_per_second = bytes_per_second
+        self.failure_rate = failure_rate
+        self._slots = threading.Semaphore(concurrency)
+        self.transfers = 0
+        for directory in ('completed', 'dips', 'tmp'):
+            (share_directory / directory).mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, path: str) -> str:
+        return path.replace(CONTAINER_SHARE_DIRECTORY, str(self.share_directory))
+
+    def transfer(self, transfer_path: Path, name: str, processing_config: dict) -> tuple:
+        """
+        Processes a transfer. Returns the exit code and the client log.
+        """
+        with self._slots:
+            self.transfers += 1
+            return self._transfer(transfer_path, name, processing_config)
+
+    def _transfer(self, transfer_path: Path, name: str, processing_config: dict) -> tuple:
+        transfer_uuid = str(uuid4())
+        log = [f"Submitting transfer {name} ({transfer_uuid}) from {transfer_path}"]
+        size = tree_size(transfer_path)
+        time.sleep(self.overhead + (size / self.bytes_per_second if self.bytes_per_second else 0))
+        if random.random() < self.failure_rate:
+            log.append(f"Transfer {transfer_uuid} failed: simulated processing error")
+            return 1, '\n'.join(log)
+
+        aip_uuid = str(uuid4())
+        bag = self.share_directory / 'tmp' / f"{name}-{aip_uuid}"
+        objects = bag / 'data' / 'objects'
+        # a3m keeps the transfer's layout under objects
+        shutil.copytree(transfer_path / 'data', objects / 'data')
+        if any((transfer_path / 'metadata').iterdir()):
+            shutil.copytree(transfer_path / 'metadata', objects / 'metadata')
+        if processing_config.get('normalize') == 'True':
+            for file_path in [path for path in objects.rglob('*') if path.is_file() and 'metadata' not in path.parts]:
+                shutil.copy2(file_path, file_path.with_name(f"{file_path.stem}-{uuid4()}{file_path.suffix}"))
+        (bag / 'data' / 'logs').mkdir()
+        (bag / 'data' / 'logs' / 'filenameCleanup.log').write_text(f"Transfer {transfer_uuid}: no names changed\n")
+        write_mets(bag / 'data' / f'METS.{aip_uuid}.xml', aip_uuid, objects)
+        (bag / 'bagit.txt').write_text("BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n")
+        with open(bag / 'manifest-sha256.txt', 'w') as manifest:
+            for file_path in sorted(path for path in (bag / 'data').rglob('*') if path.is_file()):
+                manifest.write(f"{sha256(file_path)}  {file_path.relative_to(bag)}\n")
+        log.append(f"Transfer {transfer_uuid} processed, packaging AIP {aip_uuid}")
+
+        archive = self.share_directory / 'completed' / f"{bag.name}.7z"
+        level = processing_config.get('aip_compression_level', '1')
+        try:
+            subprocess.run(['7z', 'a', '-t7z', f'-mx={level}', str(archive), bag.name],
+                           cwd=bag.parent, capture_output=True, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.append(f"Failed to compress AIP {aip_uuid}: {e}")
+            return 1, '\n'.join(log)
+        finally:
+            shutil.rmtree(bag, ignore_errors=True)
+
+        if processing_config.get('dip_enabled') == 'True':
+            dip = self.share_directory / 'dips' / aip_uuid
+            shutil.copytree(transfer_path / 'data', dip / 'objects')
+            write_mets(dip / f'METS.{aip_uuid}.xml', aip_uuid, dip / 'objects')
+        log.append(f"Processing of package {aip_uuid} completed successfully")
+        return 0, '\n'.join(log)
+
+    def exec_run(self, command, user: str = None) -> ExecResult:
+        """
+        Runs a command against the share directory, which is mapped to where the real daemon keeps it.
+        """
+        args = [self.local_path(arg) for arg in (shlex.split(command) if isinstance(command, str) else command)]
+        if args[0] == 'chown':
+            return ExecResult(0, b'')
+        result = subprocess.run(args, capture_output=True)
+        output = (result.stdout + result.stderr).replace(str(self.share_directory).encode(), CONTAINER_SHARE_DIRECTORY.encode())
+        return ExecResult(result.returncode, output)
+
+
+class FakeContainer:
+    def __init__(self, name: str, status: str = 'running', labels: dict = None, run=None):
+        self.id = uuid4().hex
+        self.name = name
+        self.status = status
+        self.labels = labels or {}
+        self.attrs = {}
+        self._run = run
+        self._result = None
+        self._exit_code = None
+        self._exited = threading.Event()
+
+    def _transfer(self):
+        exit_code, result = self._run()
+        if not self._exited.is_set():
+            self._exit_code, self._result = exit_code, result
+            self._exited.set()
+
+    def wait(self) -> dict:
+        # The transfer runs on while a killed client returns, as it does on a real a3md
+        threading.Thread(target=self._transfer, name=f'{self.name}-transfer', daemon=True).start()
+        self._exited.wait()
+        self.status = 'exited'
+        return {'StatusCode': self._exit_code}
+
+    def kill(self):
+        if not self._exited.is_set():
+            self._exit_code, self._result = 137, ''
+            self._exited.set()
+
+    def logs(self) -> bytes:
+        return (self._result or '').encode('utf-8')
+
+    def remove(self, force: bool = False):
+        self.status = 'removed'
+
+
+class FakeDaemonContainer(FakeContainer):
+    def __init__(self, name: str, daemon: SimulatedA3MDaemon, mounts: list):
+        super().__init__(name)
+        self.exec_run = daemon.exec_run
+        # The daemon reads transfers and writes AIPs on the host paths themselves
+        self.attrs = {'Mounts': [{'Source': str(mount), 'Destination': str(mount)} for mount in mounts]}
+
+
+def matches(container: FakeContainer, filters: dict) -> bool:
+    """
+    Applies the label and status filters of containers.list, other filters match everything.
+    """
+    label = filters.get('label')
+    if label:
+        key, _, value = label.partition('=')
+        if key not in container.labels or (value and container.labels[key] != value):
+            return False
+    return filters.get('status') in (None, container.status)
+
+
+class FakeContainers:
+    def __init__(self, daemons: dict, mounts: list):
+        self.daemons = daemons
+        self.daemon_containers = {name: FakeDaemonContainer(name, daemon, mounts) for name, daemon in daemons.items()}
+        self._lock = threading.Lock()
+        self._clients = []
+
+    def get(self, name: str):
+        return self.daemon_containers[name]
+
+    def run(self, image: str, name: str, command: list, labels: dict = None, **kwargs) -> FakeContainer:
+        transfer_path = Path(command[command.index('--name') + 2])
+        transfer_name = command[command.index('--name') + 1]
+        address = next(arg for arg in command if arg.startswith('--address='))
+        daemon = self.daemons[address.partition('=')[2].partition(':')[0]]
+        processing_config = dict(
+            value.split('=', 1) for flag, value in zip(command, command[1:]) if flag == '--processing-config'
+        )
+        container = FakeContainer(name, labels=labels, run=lambda: daemon.transfer(transfer_path, transfer_name, processing_config))
+        with self._lock:
+            self._clients.append(container)
+        return container
+
+    def list(self, all: bool = False, filters: dict = None) -> list:
+        with self._lock:
+            self._clients = [container for container in self._clients if container.status != 'removed']
+            return [container for container in self._clients if matches(container, filters or {})]
+
+
+class FakeNetworks:
+    def get(self, name: str):
+        return name
+
+
+class FakeDockerClient:
+    """
+    The parts of the Docker SDK used by preservation, backed by SimulatedA3MDaemons keyed by container name,
+    each mounting the given scratch volumes.
+    """
+    def __init__(self, daemons: dict, mounts: list):
+        self.containers = FakeContainers(daemons, mounts)
+        self.networks = FakeNetworks()
@@ -0,0 +1,241 @@
+import logging
+import multiprocessing
+import resource
+import sqlite3 as sqlite
+import statistics
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from simulation.environment import SimulatedEnvironment, SimulatedWorkerHost
+
+logger = logging.getLogger("preservation")
+
+SAMPLE_SECONDS = 0.5
+POLL_SECONDS = 0.5
+BENCHMARK_USER = 'simulation'
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+def stage_summary(conn) -> dict:
+    """
+    Returns the count, mean, 95th percentile and total seconds of each stage.
+    """
+    durations = {}
+    for stage, duration in conn.execute('SELECT stage, duration FROM preservation_job_stages WHERE duration IS NOT NULL'):
+        durations.setdefault(stage, []).append(duration)
+    return {
+        stage: {
+            'count': len(values),
+            'mean_seconds': statistics.mean(values),
+            'p95_seconds': percentile(values, 0.95),
+            'total_seconds': sum(values),
+        }
+        for stage, values in durations.items()
+    }
+
+def pending(conn, dip: bool, host_db_paths: list = ()) -> int:
+    count = conn.execute("SELECT COUNT(*) FROM preservation_jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+    if dip:
+        count += conn.execute("SELECT COUNT(*) FROM dip_queue WHERE status IN ('queued', 'uploading')").fetchone()[0]
+        # Each host deposits the DIPs of its own jobs from its own queue
+        for path in host_db_paths:
+            host_conn = sqlite.connect(path, timeout=30)
+            try:
+                count += host_conn.execute("SELECT COUNT(*) FROM dip_queue WHERE status IN ('queued', 'uploading')").fetchone()[0]
+            finally:
+                host_conn.close()
+    return count
+
+
+class DiskSampler:
+    """
+    Samples the total size of the scratch volumes in the background and keeps the peak.
+    """
+    def __init__(self, directories: list):
+        from preservation.jobs import path_size
+        self.directories = directories
+        self.path_size = path_size
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='disk-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_SECONDS):
+            try:
+                self.peak = max(self.peak, sum(self.path_size(directory) for directory in self.directories))
+            except OSError:
+                # Files disappear while processing directories are cleaned up
+                continue
+
+    def start(self) -> 'DiskSampler':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def placements(conn, volumes: list) -> dict:
+    """
+    Returns the number of jobs whose processing directory was placed on each volume.
+    """
+    counts = {str(volume): 0 for volume in volumes}
+    for (directory,) in conn.execute('SELECT processing_directory FROM preservation_jobs WHERE processing_directory IS NOT NULL'):
+        counts[str(Path(directory).parent)] = counts.get(str(Path(directory).parent), 0) + 1
+    return counts
+
+def start_runners(workers: int, dip: bool) -> tuple:
+    from preservation.dip_queue import DIPWorker
+    from preservation.worker import PreservationWorker
+    runners = [PreservationWorker(poll_interval=POLL_SECONDS) for _ in range(workers)]
+    if dip:
+        runners.append(DIPWorker(poll_interval=POLL_SECONDS))
+    threads = [threading.Thread(target=runner.run, name=f'worker-{index}', daemon=True) for index, runner in enumerate(runners)]
+    for thread in threads:
+        thread.start()
+    return runners, threads
+
+def run_worker_host(root: Path, name: str, curate_url: str, api_url: str, api_token: str, workers: int, latencies: dict,
+                    dip: bool, daemons: int, volumes: int, ready, stop, results):
+    """
+    Runs the preservation workers of another host until stop is set, claiming jobs through the worker API.
+    Puts the transfers of each of its a3md daemons on results once they have stopped.
+    Runs in a process of its own, as the host patches config for the whole process.
+    """
+    host = SimulatedWorkerHost(root, name, curate_url, api_url, api_token, latencies, daemons, volumes).start()
+    from preservation import logs
+    logs.configure("preservation", 'preservation.log', text_format="%(asctime)s %(threadName)s %(filename)s:%(lineno)d %(levelname)s %(message)s")
+    try:
+        runners, threads = start_runners(workers, dip)
+        ready.set()
+        stop.wait()
+        for runner in runners:
+            runner.stop()
+        for thread in threads:
+            thread.join()
+        results.put({f'{name}/{daemon}': simulated.transfers for daemon, simulated in host.daemons.items()})
+    finally:
+        logs.stop()
+
+def run_shape(shape: str, root: Path, scale: float = 1, workers: int = 1, latencies: dict = None,
+              config_fields: dict = None, dip: bool = False, timeout: float = None, daemons: int = 1, volumes: int = 1,
+              hosts: int = 1) -> dict:
+    """
+    Preserves one shape in a fresh simulated environment with the given number of hosts, and
+    preservation workers, a3md daemons and scratch volumes on each, and returns its throughput, stage times and peak disk and memory.
+    Hosts after the first run in processes of their own and share its queue through the API's worker endpoints.
+    Run each shape in its own process: the environment patches config for the whole process.
+    """
+    environment = SimulatedEnvironment(root, latencies, daemons, volumes).start()
+    # Written to root/logs through the same writer thread as the workers' logs
+    from preservation import logs
+    logs.configure("preservation", 'preservation.log', text_format="%(asctime)s %(threadName)s %(filename)s:%(lineno)d %(levelname)s %(message)s")
+
+    from preservation.database import DatabaseManager
+
+    server = None
+    host_processes = []
+    context = multiprocessing.get_context('spawn')
+    ready, stop, host_results = [], context.Event(), context.Queue()
+    if hosts > 1:
+        import config
+        from simulation.loadtest import UvicornServer
+        config.WORKER_API_TOKEN = uuid4().hex
+        # Imported once the token is set, the worker endpoints read it at import time
+        from api import app
+        server = UvicornServer(app).start()
+        for index in range(2, hosts + 1):
+            ready.append(context.Event())
+            host_processes.append(context.Process(
+                target=run_worker_host, name=f'host-{index}',
+                args=(root, f'host-{index}', environment.curate.url, server.url, config.WORKER_API_TOKEN, workers,
+                      latencies, dip, daemons, volumes, ready[-1], stop, host_results)
+            ))
+        for process in host_processes:
+            process.start()
+        for event in ready:
+            event.wait()
+    host_db_paths = [root / f'host-{index}' / 'preservation.db' for index in range(2, hosts + 1)]
+
+    config_fields = dict(config_fields or {})
+    if dip:
+        config_fields['dip_enabled'] = 1
+    config_id = environment.add_config(**config_fields)
+    nodes = environment.add_shape(shape, scale, atom_slug='simulated-description' if dip else None)
+    logger.info(f"Benchmarking {shape}: {len(nodes)} nodes with {workers} workers on each of {hosts} hosts")
+
+    db_manager = DatabaseManager()
+    start = time.time()
+    for node in nodes:
+        db_manager.create_job(node['Uuid'], node['Path'], BENCHMARK_USER, config_id, node)
+    host_volumes = [root / f'host-{index}' / volume.relative_to(root) for index in range(2, hosts + 1) for volume in environment.volumes]
+    sampler = DiskSampler(environment.volumes + host_volumes).start()
+    runners, threads = start_runners(workers, dip)
+
+    timed_out = False
+    conn = sqlite.connect(environment.db_path, timeout=30)
+    try:
+        while pending(conn, dip, host_db_paths):
+            if timeout and time.time() - start > timeout:
+                timed_out = True
+                logger.error(f"Benchmark of {shape} timed out after {timeout}s")
+                break
+            time.sleep(POLL_SECONDS)
+        elapsed = time.time() - start
+        for runner in runners:
+            runner.stop()
+        stop.set()
+        for thread in threads:
+            thread.join(None if not timed_out else 1)
+        for process in host_processes:
+            process.join(None if not timed_out else 1)
+            if process.is_alive():
+                process.terminate()
+        host_transfers = {}
+        while not host_results.empty():
+            host_transfers.update(host_results.get())
+        sampler.stop()
+
+        statuses = dict(conn.execute('SELECT status, COUNT(*) FROM preservation_jobs GROUP BY status').fetchall())
+        peak_job_bytes = conn.execute('SELECT MAX(peak_bytes) FROM preservation_jobs').fetchone()[0] or 0
+        stages = stage_summary(conn)
+        volume_jobs = placements(conn, environment.volumes + host_volumes)
+    finally:
+        conn.close()
+        if server:
+            server.stop()
+        environment.stop()
+        logs.stop()
+
+    submitted_bytes = sum(int(node['Size']) for node in nodes)
+    finished = statuses.get('completed', 0) + statuses.get('skipped', 0)
+    return {
+        'shape': shape,
+        'scale': scale,
+        'workers': workers,
+        'daemons': daemons,
+        'volumes': volumes,
+        'hosts': hosts,
+        'nodes': len(nodes),
+        'bytes': submitted_bytes,
+        'jobs': statuses,
+        'timed_out': timed_out,
+        'elapsed_seconds': elapsed,
+        'nodes_per_hour': finished / elapsed * 3600 if elapsed else 0,
+        'bytes_per_hour': submitted_bytes / elapsed * 3600 if elapsed else 0,
+        'stages': stages,
+        'peak_disk_bytes': max(sampler.peak, peak_job_bytes),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'peak_child_rss_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        'curate_requests': environment.curate.requests,
+        'curate_failures': environment.curate.failures,
+        'atom_deposits': len(environment.atom.deposits),
+        'a3md_transfers': {**{name: daemon.transfers for name, daemon in environment.daemons.items()}, **host_transfers},
+        'volume_jobs': {str(Path(volume).relative_to(root)): count for volume, count in volume_jobs.items()},
+    }
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sqlite3 as sqlite
+from pathlib import Path
+from uuid import uuid4
+
+from simulation.a3md import FakeDockerClient, SimulatedA3MDaemon
+from simulation.servers import FakeAtoMServer, FakeCurateServer
+from simulation.shapes import SHAPES
+
+BIN_DIRECTORY = Path(__file__).resolve().parent / 'bin'
+# Nodes are created in the common files workspace
+WORKSPACE = 'pydiods1'
+WORKSPACE_DIRECTORY = 'common-files'
+WRITE_BLOCK_BYTES = 1024 * 1024
+
+# Seconds per call, bytes per second (0 for unlimited) and failure rates of the stand-ins
+DEFAULT_LATENCIES = {
+    'curate': 0.05,
+    'curate_failure_rate': 0.0,
+    'cells_call': 0.2,
+    'cells_bytes_per_second': 100 * 1024 ** 2,
+    'a3m_overhead': 5.0,
+    'a3m_bytes_per_second': 50 * 1024 ** 2,
+    'a3m_failure_rate': 0.0,
+    # Transfers each a3md processes at once
+    'a3m_concurrency': 1,
+    'atom': 0.2,
+    'atom_failure_rate': 0.0,
+}
+
+
+class SimulatedEnvironment:
+    """
+    Runs preservation against local stand-ins for Cells, the Cells Client, a3md and AtoM.
+
+    Everything is kept under root: the fake Cells datasource, the a3md share, the
+    preservation database, processing and DIP directories, traces and logs.
+    start() must run before any preservation module is imported, since they read
+    config and create their Docker client at import time, so use one environment per process.
+    """
+    def __init__(self, root: Path, latencies: dict = None, daemons: int = 1, volumes: int = 1):
+        self.root = Path(root)
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.curate = FakeCurateServer(self.latencies['curate'], self.latencies['curate_failure_rate'])
+        self.atom = FakeAtoMServer(self.latencies['atom'], self.latencies['atom_failure_rate'])
+        self._add_host(self.root, daemons, volumes)
+
+    def _add_host(self, host_root: Path, daemons: int, volumes: int):
+        # Named as start_a3md_container.sh names them
+        self.daemons = {
+            name: SimulatedA3MDaemon(
+                host_root / name, self.latencies['a3m_overhead'], self.latencies['a3m_bytes_per_second'],
+                self.latencies['a3m_failure_rate'], int(self.latencies['a3m_concurrency'])
+            )
+            for name in ['a3md'] + [f'a3md-{index}' for index in range(2, daemons + 1)]
+        }
+        # Scratch volumes processing directories are spread across, all on the disk under root
+        self.volumes = [host_root / 'processing'] + [host_root / f'processing-{index}' for index in range(2, volumes + 1)]
+        self.host_root = host_root
+        self.db_path = host_root / 'preservation.db'
+
+    def _set_environment(self):
+        os.environ['PATH'] = f"{BIN_DIRECTORY}{os.pathsep}{os.environ['PATH']}"
+        os.environ['SIMULATION_ROOT'] = str(self.root)
+        os.environ['SIMULATION_CELLS_LATENCY'] = str(self.latencies['cells_call'])
+        os.environ['SIMULATION_CELLS_BYTES_PER_SECOND'] = str(self.latencies['cells_bytes_per_second'])
+
+    def _patch_config(self, curate_url: str):
+        import config
+        config.CURATE_URL = curate_url
+        config.LOG_DIRECTORY = str(self.host_root / 'logs')
+        config.PROCESSING_DIRECTORY = str(self.volumes[0])
+        config.PROCESSING_VOLUMES = {'default': [str(volume) for volume in self.volumes]}
+        config.PROCESSING_STAGE_TIERS = {'download': 'default', 'extract': 'default'}
+        # The volumes share one device, so sampling its I/O load would only slow placement down
+        config.PROCESSING_IO_SAMPLE_SECONDS = 0
+        config.DIP_QUEUE_DIRECTORY = str(self.host_root / 'dip_queue')
+        config.TRACE_DIRECTORY = str(self.host_root / 'traces')
+        config.PROFILE_DIRECTORY = str(self.host_root / 'profiles')
+        config.A3M_DAEMONS = list(self.daemons)
+        Path(config.LOG_DIRECTORY).mkdir(parents=True, exist_ok=True)
+
+        import docker
+        client = FakeDockerClient(self.daemons, self.volumes)
+        docker.from_env = lambda *args, **kwargs: client
+
+        import db.models
+        import preservation.database
+        db.models.DB_PATH = str(self.db_path)
+        preservation.database.DB_PATH = str(self.db_path)
+
+    def start(self) -> 'SimulatedEnvironment':
+        (self.root / 'cells' / WORKSPACE_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        self.curate.start()
+        self.atom.start()
+        self._set_environment()
+        self._patch_config(self.curate.url)
+
+        from db.models.atom_model import init_db as init_atom_db
+        from db.models.preservation_model import init_db as init_preservation_db
+        from preservation.database import DatabaseManager
+        init_atom_db()
+        init_preservation_db()
+        DatabaseManager()
+        # AtoM is reached over SSH and rsync, which the rsync stand-in replaces
+        from preservation import atom
+        atom.check_ssh_connection = lambda hostname: True
+        with sqlite.connect(self.db_path) as conn:
+            conn.execute('DELETE FROM atom_config')
+            conn.execute('''
+                INSERT INTO atom_config (id, atom_url, atom_api_key, atom_username, atom_password)
+                VALUES (1, ?, 'simulated', 'simulated', 'simulated')
+            ''', (self.atom.url,))
+        return self
+
+    def stop(self):
+        self.curate.stop()
+        self.atom.stop()
+
+    def add_config(self, **fields) -> int:
+        """
+        Adds a preservation config with the given column values. Returns its ID.
+        """
+        fields = {'name': f'simulation-{uuid4().hex[:8]}', 'user': 'simulation', **fields}
+        with sqlite.connect(self.db_path) as conn:
+            cursor = conn.execute(
+                f"INSERT INTO preservation_configs ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                list(fields.values())
+            )
+            return cursor.lastrowid
+
+    def _write_file(self, path: Path, size: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as file:
+            remaining = size
+            while remaining:
+                # Random bytes so 7z and zip do as much work as they would on real media
+                block = os.urandom(min(remaining, WRITE_BLOCK_BYTES))
+                file.write(block)
+                remaining -= len(block)
+
+    def add_shape(self, shape: str, scale: float = 1, atom_slug: str = None) -> list:
+        """
+        Creates the files of a shape in the fake Cells datasource and registers their nodes.
+        Returns the top level nodes, which are what a user would submit.
+        """
+        entries = SHAPES[shape](scale)
+        prefix = f"{uuid4().hex[:8]}-{shape}"
+        storage = self.root / 'cells' / WORKSPACE_DIRECTORY / prefix
+        for relative, size in entries:
+            if size is None:
+                (storage / relative).mkdir(parents=True, exist_ok=True)
+            else:
+                self._write_file(storage / relative, size)
+
+        nodes = []
+        for relative, size in entries:
+            if size is None:
+                size = sum(file_size for path, file_size in entries if file_size is not None and path.startswith(f'{relative}/'))
+            node_path = f"{WORKSPACE}/{prefix}/{relative}"
+            meta_store = {
+                'name': f'"{Path(relative).name}"',
+                'usermeta-dc-title': f'"{Path(relative).stem}"',
+            }
+            if atom_slug and '/' not in relative:
+                meta_store['usermeta-atom-linked-description'] = f'"{atom_slug}"'
+            node = {
+                'Uuid': str(uuid4()),
+                'Path': node_path,
+                'Type': 'COLLECTION' if (storage / relative).is_dir() else 'LEAF',
+                'Size': str(size),
+                'Etag': hashlib.md5(node_path.encode('utf-8')).hexdigest(),
+                'MTime': str(int((storage / relative).stat().st_mtime)),
+                'MetaStore': meta_store,
+            }
+            self.curate.add_node(node)
+            if '/' not in relative:
+                nodes.append(node)
+        return nodes
+
+
+class SimulatedWorkerHost(SimulatedEnvironment):
+    """
+    Another preservation host sharing the queue of a SimulatedEnvironment under the same root through its worker API.
+    It has its own a3md daemons, scratch volumes and database under root/name, and uses the environment's
+    Cells, Curate and AtoM. Like the environment, start() must run before any preservation module is imported.
+    """
+    def __init__(self, root: Path, name: str, curate_url: str, api_url: str, api_token: str,
+                 latencies: dict = None, daemons: int = 1, volumes: int = 1):
+        self.root = Path(root)
+        self.name = name
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.curate_url = curate_url
+        self.api_url = api_url
+        self.api_token = api_token
+        self._add_host(self.root / name, daemons, volumes)
+
+    def start(self) -> 'SimulatedWorkerHost':
+        self.host_root.mkdir(parents=True, exist_ok=True)
+        self._set_environment()
+        self._patch_config(self.curate_url)
+        import config
+        config.WORKER_API_URL = self.api_url
+        config.WORKER_API_TOKEN = self.api_token
+        from preservation import atom
+        atom.check_ssh_connection = lambda hostname: True
+        return self
+
+    def stop(self):
+        pass
@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import os
+import random
+import resource
+import socket
+import sqlite3 as sqlite
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from simulation.benchmark import percentile
+from simulation.servers import FakeAtoMServer, self_signed_certificate
+
+logger = logging.getLogger("preservation_api")
+
+LOADTEST_USER = 'loadtest'
+# Preservation configs in the database when a run starts, as a busy deployment might have
+SEED_CONFIGS = 25
+# Terms Curate's description picker searches for, so repeated searches share the cache
+SEARCH_TERMS = ('minutes', 'letters', 'photographs', 'maps', 'council', 'parish', 'estate', 'survey', 'diaries', 'accounts')
+# Relative weight of each operation in a mix
+MIXES = {
+    # Curate's UI polling the config list, mostly revalidating with its ETag
+    'polling': {'list_configs': 30, 'list_configs_etag': 55, 'get_atom_config': 5, 'atom_search': 10},
+    # Admins editing configs, each write invalidating the config cache the pollers read through
+    'writes': {'list_configs': 40, 'list_configs_etag': 20, 'update_config': 25, 'add_config': 8, 'delete_config': 7},
+    # Description lookups, most repeating a recent search and the rest reaching AtoM
+    'search': {'atom_search': 70, 'atom_search_unique': 25, 'get_atom_config': 5},
+    'mixed': {
+        'list_configs': 20, 'list_configs_etag': 35, 'update_config': 5, 'add_config': 2, 'delete_config': 2,
+        'get_atom_config': 6, 'atom_search': 22, 'atom_search_unique': 8,
+    },
+}
+MODES = ('asgi', 'uvicorn')
+
+def rss_bytes() -> int:
+    """
+    Returns the resident set size of this process, from /proc/self/statm where available.
+    """
+    try:
+        return int(Path('/proc/self/statm').read_text().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def config_body(name: str, **fields) -> dict:
+    return {'name': name, 'user': LOADTEST_USER, 'description': f"Load test config {name}", **fields}
+
+
+class APIEnvironment:
+    """
+    Runs the API against a fresh database under root and a stand-in AtoM served over HTTPS,
+    since the AtoM config only accepts https URLs.
+    start() must run before the api package is imported, which configures its log file at import time.
+    """
+    def __init__(self, root: Path, atom_latency: float = 0):
+        self.root = Path(root)
+        self.certificate = self_signed_certificate(self.root / 'tls')
+        self.atom = FakeAtoMServer(atom_latency, certificate=self.certificate)
+        self.db_path = self.root / 'preservation.db'
+
+    def start(self) -> 'APIEnvironment':
+        import config
+        config.LOG_DIRECTORY = str(self.root / 'logs')
+        Path(config.LOG_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        # Trusted by the API's AtoM client, which reads the environment
+        os.environ['SSL_CERT_FILE'] = str(self.certificate[0])
+        import db.models
+        import preservation.database
+        db.models.DB_PATH = str(self.db_path)
+        preservation.database.DB_PATH = str(self.db_path)
+        self.atom.start()
+
+        from db.models.atom_model import init_db as init_atom_db
+        from db.models.preservation_model import init_db as init_preservation_db
+        init_atom_db()
+        init_preservation_db()
+        with sqlite.connect(self.db_path) as conn:
+            conn.execute('DELETE FROM atom_config')
+            conn.execute('''
+                INSERT INTO atom_config (id, atom_url, atom_api_key, atom_username, atom_password)
+                VALUES (1, ?, 'loadtest', 'loadtest', 'loadtest')
+            ''', (self.atom.url,))
+            for index in range(SEED_CONFIGS):
+                fields = config_body(f'loadtest-seed-{index:03d}')
+                conn.execute(
+                    f"INSERT INTO preservation_configs ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                    list(fields.values())
+                )
+        return self
+
+    def config_ids(self) -> list:
+        with sqlite.connect(self.db_path) as conn:
+            # The default config can't be updated or deleted
+            return [row[0] for row in conn.execute("SELECT id FROM preservation_configs WHERE id != 1 AND name LIKE 'loadtest-seed-%'")]
+
+    def stop(self):
+        self.atom.stop()
+
+
+class LoadState:
+    """
+    What the virtual users share: the seeded configs, the configs added during the run and the config list ETag.
+    """
+    def __init__(self, config_ids: list):
+        self.config_ids = config_ids
+        self.added = []
+        self.etag = None
+
+
+async def list_configs(client, state: LoadState):
+    response = await client.get('/preservation/')
+    state.etag = response.headers.get('etag', state.etag)
+    # Configs added by this run are found by name, as the add response doesn't return their ID
+    if response.status_code == 200:
+        state.added = [config['id'] for config in response.json() if config['name'].startswith('loadtest-added-')]
+    return response
+
+async def list_configs_etag(client, state: LoadState):
+    if state.etag is None:
+        return await list_configs(client, state)
+    response = await client.get('/preservation/', headers={'If-None-Match': state.etag})
+    state.etag = response.headers.get('etag', state.etag)
+    return response
+
+async def update_config(client, state: LoadState):
+    config_id = random.choice(state.config_ids)
+    body = config_body(f'loadtest-seed-{config_id}', compression_level=random.randint(1, 9))
+    return await client.post(f'/preservation/{config_id}', json=body)
+
+async def add_config(client, state: LoadState):
+    return await client.post('/preservation/', json=config_body(f'loadtest-added-{uuid4().hex[:12]}'))
+
+async def delete_config(client, state: LoadState):
+    if not state.added:
+        return await add_config(client, state)
+    config_id = state.added.pop(random.randrange(len(state.added)))
+    return await client.delete(f'/preservation/{config_id}')
+
+async def get_atom_config(client, state: LoadState):
+    return await client.get('/atom/')
+
+async def atom_search(client, state: LoadState):
+    return await client.get('/atom/search', params={'sq0': random.choice(SEARCH_TERMS), 'sf0': 'title', 'limit': 10})
+
+async def atom_search_unique(client, state: LoadState):
+    return await client.get('/atom/search', params={'sq0': f"{random.choice(SEARCH_TERMS)} {uuid4().hex[:8]}", 'sf0': 'title', 'limit': 10})
+
+OPERATIONS = {
+    'list_configs': list_configs,
+    'list_configs_etag': list_configs_etag,
+    'update_config': update_config,
+    'add_config': add_config,
+    'delete_config': delete_config,
+    'get_atom_config': get_atom_config,
+    'atom_search': atom_search,
+    'atom_search_unique': atom_search_unique,
+}
+# Responses that count as successes, anything else is an error
+EXPECTED_STATUSES = {
+    'list_configs_etag': (200, 304),
+    'add_config': (201,),
+    # A config listed before another user's delete of it finished
+    'delete_config': (200, 201, 404),
+}
+
+
+class UvicornServer:
+    """
+    Serves the app with uvicorn from a background thread on a free local port,
+    so requests go through the HTTP server and its event loop as they would in production.
+    """
+    def __init__(self, app):
+        import uvicorn
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', 0))
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level='warning', access_log=False, lifespan='on'))
+        self._thread = threading.Thread(target=self.server.run, kwargs={'sockets': [self.socket]}, name='uvicorn', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.socket.getsockname()
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'UvicornServer':
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("uvicorn failed to start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join()
+
+
+async def _virtual_user(client, state: LoadState, mix: dict, started: float, deadline: float, think_seconds: float, samples: list):
+    """
+    Runs operations drawn from mix back to back until deadline, pausing a random think time between them.
+    Each sample is (seconds since the run started, operation, seconds taken, status or None, success).
+    """
+    import httpx
+    names, weights = list(mix), list(mix.values())
+    while (offset := time.monotonic() - started) < deadline:
+        name = random.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await OPERATIONS[name](client, state)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            logger.debug(f"Load test {name} failed: {e!r}")
+            status = None
+        samples.append((offset, name, time.perf_counter() - start, status, status in EXPECTED_STATUSES.get(name, (200,))))
+        if think_seconds:
+            await asyncio.sleep(random.expovariate(1 / think_seconds))
+
+async def _sample_rss(started: float, interval: float, rss: list):
+    while True:
+        rss.append((time.monotonic() - started, rss_bytes()))
+        await asyncio.sleep(interval)
+
+async def _drive(client, state: LoadState, mix: dict, users: int, seconds: float, think_seconds: float, interval: float) -> tuple:
+    samples, rss = [], []
+    started = time.monotonic()
+    sampler = asyncio.create_task(_sample_rss(started, interval, rss))
+    await asyncio.gather(*(
+        _virtual_user(client, state, mix, started, seconds, think_seconds, samples) for _ in range(users)
+    ))
+    sampler.cancel()
+    rss.append((time.monotonic() - started, rss_bytes()))
+    return samples, rss, time.monotonic() - started
+
+async def _run(app, mode: str, state: LoadState, mix: dict, users: int, seconds: float, think_seconds: float, interval: float) -> tuple:
+    import httpx
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    if mode == 'asgi':
+        # Runs the app's startup and shutdown handlers as uvicorn would
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', limits=limits) as client:
+                return await _drive(client, state, mix, users, seconds, think_seconds, interval)
+    server = UvicornServer(app).start()
+    try:
+        async with httpx.AsyncClient(base_url=server.url, limits=limits, timeout=60) as client:
+            return await _drive(client, state, mix, users, seconds, think_seconds, interval)
+    finally:
+        server.stop()
+
+def summarise(samples: list, seconds: float) -> dict:
+    """
+    Returns the requests, errors, throughput and 50th and 99th percentile latency of samples.
+    """
+    durations = [duration for _, _, duration, _, _ in samples]
+    errors = sum(1 for *_, ok in samples if not ok)
+    statuses = {}
+    for _, _, _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0,
+        'throughput': len(samples) / seconds if seconds else 0,
+        'p50_ms': percentile(durations, 0.5) * 1000 if durations else 0,
+        'p99_ms': percentile(durations, 0.99) * 1000 if durations else 0,
+        'statuses': statuses,
+    }
+
+def run_mix(mix: str, root: Path, mode: str = 'asgi', users: int = 20, seconds: float = 30, warmup: float = 5,
+            think_seconds: float = 0, atom_latency: float = 0.05, interval: float = 10) -> dict:
+    """
+    Drives the API with users concurrent virtual users running operations drawn from a mix,
+    against a fresh database and stand-in AtoM, and returns latency and throughput overall,
+    per operation and per interval, with the process RSS over the run.
+    Requests made during the first warmup seconds are left out. Run each mix in its own
+    process: the environment patches config for the whole process.
+    """
+    environment = APIEnvironment(root, atom_latency).start()
+    from api import app
+    from preservation import logs
+
+    state = LoadState(environment.config_ids())
+    logger.info(f"Load testing {mix} with {users} users for {seconds}s over {mode}")
+    try:
+        samples, rss, elapsed = asyncio.run(_run(app, mode, state, MIXES[mix], users, warmup + seconds, think_seconds, interval))
+    finally:
+        environment.stop()
+        logs.stop()
+
+    measured = [sample for sample in samples if sample[0] >= warmup]
+    measured_seconds = elapsed - warmup
+    operations = {}
+    for sample in measured:
+        operations.setdefault(sample[1], []).append(sample)
+    intervals = {}
+    for sample in measured:
+        intervals.setdefault(int((sample[0] - warmup) // interval), []).append(sample)
+    return {
+        'mix': mix,
+        'mode': mode,
+        'users': users,
+        'seconds': measured_seconds,
+        'warmup_seconds': warmup,
+        'think_seconds': think_seconds,
+        'atom_latency': atom_latency,
+        **summarise(measured, measured_seconds),
+        'operations': {name: summarise(operation_samples, measured_seconds) for name, operation_samples in sorted(operations.items())},
+        'intervals': [
+            {
+                'start_seconds': index * interval,
+                **summarise(interval_samples, min(interval, measured_seconds - index * interval)),
+                'peak_rss_bytes': max((value for offset, value in rss if offset - warmup < (index + 1) * interval), default=0),
+            }
+            for index, interval_samples in sorted(intervals.items())
+        ],
+        'rss_start_bytes': next((value for offset, value in rss if offset >= warmup), rss[0][1]),
+        'rss_end_bytes': rss[-1][1],
+        'atom_searches': environment.atom.searches,
+    }
+
+
+# Operations with fewer samples than this aren't compared, their percentiles are too noisy
+BASELINE_MIN_REQUESTS = 100
+# Error rate a run may exceed its baseline by
+BASELINE_ERROR_RATE_TOLERANCE = 0.001
+
+def baseline_key(result: dict) -> str:
+    return f"{result['mix']}/{result['mode']}/{result['users']}"
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a description of each way result is worse than baseline by more than tolerance,
+    a fraction of the baseline value: lower throughput, higher p50 or p99 latency, overall or
+    of any operation, or a higher error rate.
+    """
+    regressions = []
+    for name, current, previous in [('overall', result, baseline)] + [
+        (operation, summary, baseline['operations'][operation])
+        for operation, summary in result['operations'].items()
+        if operation in baseline.get('operations', {})
+        and min(summary['requests'], baseline['operations'][operation]['requests']) >= BASELINE_MIN_REQUESTS
+    ]:
+        if name == 'overall' and current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f"throughput {current['throughput']:.0f}/s, baseline {previous['throughput']:.0f}/s")
+        for metric in ('p50_ms', 'p99_ms'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric[:3]} {current[metric]:.1f}ms, baseline {previous[metric]:.1f}ms")
+        if current['error_rate'] > previous['error_rate'] + BASELINE_ERROR_RATE_TOLERANCE:
+            regressions.append(f"{name} error rate {current['error_rate']:.2%}, baseline {previous['error_rate']:.2%}")
+    return regressions
@@ -0,0 +1,220 @@
+import datetime
+import hashlib
+import ipaddress
+import json
+import logging
+import random
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("preservation")
+
+def self_signed_certificate(directory: Path, host: str = '127.0.0.1') -> tuple:
+    """
+    Writes a self-signed certificate and key for host to directory. Returns their paths.
+    Clients trust it through SSL_CERT_FILE.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(host))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    directory.mkdir(parents=True, exist_ok=True)
+    certfile, keyfile = directory / 'simulation.crt', directory / 'simulation.key'
+    certfile.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    keyfile.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return certfile, keyfile
+
+
+class FakeServer:
+    """
+    Serves a fake HTTP service on a local port from a background thread.
+
+    Every request waits latency seconds, and fails with a 502 at failure_rate,
+    so retries and circuit breakers are exercised as they would be against a struggling service.
+    Given a certificate, from self_signed_certificate, it serves HTTPS.
+    """
+    def __init__(self, latency: float = 0, failure_rate: float = 0, certificate: tuple = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._tls = certificate is not None
+        if self._tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*certificate)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"{'https' if self._tls else 'http'}://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method: str):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with server._lock:
+                    server.requests += 1
+                    failed = random.random() < server.failure_rate
+                    if failed:
+                        server.failures += 1
+                time.sleep(server.latency)
+                if failed:
+                    status, payload = 502, {'error': 'Simulated bad gateway'}
+                else:
+                    status, payload = server.handle(method, self.path, self.headers, body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def do_PUT(self):
+                self._respond('PUT')
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.__class__.__name__}: {format % args}")
+
+        return Handler
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> tuple:
+        """
+        Returns the status code and JSON payload of a request.
+        """
+        return 404, {'error': f"No route for {method} {path}"}
+
+    def start(self) -> 'FakeServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeCurateServer(FakeServer):
+    """
+    The Cells REST endpoints used by preservation: tree listings and user-meta updates and searches.
+    Nodes are registered by the simulated environment as it creates their files.
+    """
+    def __init__(self, latency: float = 0, failure_rate: float = 0):
+        super().__init__(latency, failure_rate)
+        self.nodes = {}
+        # Node UUID -> namespace -> every value written, in order
+        self.tags = {}
+
+    def add_node(self, node: dict):
+        with self._lock:
+            self.nodes[node['Path']] = node
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> tuple:
+        if not headers.get('Authorization', '').startswith('Bearer '):
+            return 401, {'error': 'Missing token'}
+        request = json.loads(body or b'{}')
+        if method == 'POST' and path == '/a/tree/admin/list':
+            parent = request['Node']['Path'].rstrip('/') + '/'
+            with self._lock:
+                children = [node for node_path, node in self.nodes.items() if node_path.startswith(parent)]
+            if not request.get('Recursive'):
+                children = [node for node in children if '/' not in node['Path'][len(parent):]]
+            return 200, {'Children': children}
+        if method == 'PUT' and path == '/a/user-meta/update':
+            with self._lock:
+                for meta in request['MetaDatas']:
+                    self.tags.setdefault(meta['NodeUuid'], {}).setdefault(meta['Namespace'], []).append(json.loads(meta['JsonValue']))
+            return 200, {'MetaDatas': request['MetaDatas']}
+        if method == 'POST' and path == '/a/user-meta/search':
+            node_uuids = set(request.get('NodeUuids', []))
+            with self._lock:
+                metadatas = [
+                    {'NodeUuid': node['Uuid'], 'Namespace': namespace, 'JsonValue': value}
+                    for node in self.nodes.values() if node['Uuid'] in node_uuids
+                    for namespace, value in node['MetaStore'].items() if namespace.startswith('usermeta-')
+                ]
+                metadatas += [
+                    {'NodeUuid': node_uuid, 'Namespace': namespace, 'JsonValue': json.dumps(values[-1])}
+                    for node_uuid, namespaces in self.tags.items() if node_uuid in node_uuids
+                    for namespace, values in namespaces.items()
+                ]
+            return 200, {'Metadatas': metadatas}
+        return super().handle(method, path, headers, body)
+
+
+class FakeAtoMServer(FakeServer):
+    """
+    The AtoM SWORD deposit endpoint, recording each deposit against its slug, and the
+    information object search, answering each query with the same descriptions every time.
+    """
+    def __init__(self, latency: float = 0, failure_rate: float = 0, certificate: tuple = None):
+        super().__init__(latency, failure_rate, certificate)
+        self.deposits = []
+        self.searches = 0
+
+    def _search(self, query: dict) -> dict:
+        terms = ' '.join(value for key, values in sorted(query.items()) if key.startswith('sq') for value in values)
+        seed = int(hashlib.sha1(terms.encode('utf-8')).hexdigest()[:8], 16)
+        limit = int(query.get('limit', ['10'])[0])
+        total = seed % 50
+        return {
+            'total': total,
+            'results': [
+                {
+                    'slug': f"description-{seed:08x}-{index}",
+                    'title': f"{terms or 'Untitled'} {index}",
+                    'reference_code': f"SIM-{seed % 1000:03d}-{index}",
+                    'level_of_description': 'File',
+                }
+                for index in range(min(limit, total))
+            ],
+        }
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> tuple:
+        if method == 'POST' and path.startswith('/sword/deposit/'):
+            with self._lock:
+                self.deposits.append({'slug': path[len('/sword/deposit/'):], 'location': headers.get('Content-Location')})
+            return 201, {'status': 'Deposited'}
+        url = urlsplit(path)
+        if method == 'GET' and url.path == '/api/informationobjects':
+            if not headers.get('REST-API-Key'):
+                return 401, {'error': 'Missing API key'}
+            with self._lock:
+                self.searches += 1
+            return 200, self._search(parse_qs(url.query))
+        return super().handle(method, path, headers, body)
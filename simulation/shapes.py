@@ -0,0 +1,38 @@
+"""
+Representative submissions for benchmarks. Each shape is a list of (path, size) entries under
+the shape's own folder, where a size of None is a folder. Top level entries are submitted as nodes.
+"""
+
+KB = 1024
+MB = 1024 * KB
+
+def small_files(scale: float) -> list:
+    # Scanned letters and photographs preserved one by one
+    return [(f'letter-{index:04d}.tif', 256 * KB) for index in range(int(200 * scale))]
+
+def large_files(scale: float) -> list:
+    # Audiovisual masters
+    return [(f'master-{index:02d}.mkv', int(200 * MB * scale)) for index in range(4)]
+
+def deep_directory(scale: float) -> list:
+    # One deposited collection with nested series
+    entries = [('collection', None)]
+    for series in range(int(10 * scale) or 1):
+        entries.append((f'collection/series-{series:02d}', None))
+        entries += [(f'collection/series-{series:02d}/item-{item:03d}.pdf', 512 * KB) for item in range(50)]
+    return entries
+
+def mixed(scale: float) -> list:
+    entries = [(f'document-{index:03d}.pdf', (index % 10 + 1) * 100 * KB) for index in range(int(60 * scale))]
+    entries += [(f'video-{index}.mp4', int(50 * MB * scale)) for index in range(2)]
+    for folder in range(int(5 * scale) or 1):
+        entries.append((f'folder-{folder}', None))
+        entries += [(f'folder-{folder}/page-{page:03d}.jpg', 200 * KB) for page in range(20)]
+    return entries
+
+SHAPES = {
+    'small-files': small_files,
+    'large-files': large_files,
+    'deep-directory': deep_directory,
+    'mixed': mixed,
+}
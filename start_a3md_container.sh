@@ -1,21 +1,38 @@
 #!/bin/bash
 
 A3M_DOCKER_IMAGE="ghcr.io/artefactual-labs/a3m:v0.7.9"
-PROCESSING_DIRECTORY='/tmp/curate/preservation'
+# Every scratch volume of PROCESSING_VOLUMES in config.py, mounted into each a3md at the same path
+PROCESSING_VOLUMES=('/tmp/curate/preservation')
+# Number of a3md containers, named a3md, a3md-2, a3md-3... to match A3M_DAEMONS in config.py
+A3MD_COUNT=${1:-1}
 
-# Create processing directory if it doesn't exist
-mkdir -p "$PROCESSING_DIRECTORY"
+# Create scratch volume directories if they don't exist
+mounts=()
+for volume in "${PROCESSING_VOLUMES[@]}"; do
+    mkdir -p "$volume"
+    mounts+=(-v "$volume:$volume")
+done
 
 # Create a3m-network if it doesn't exist
 if ! docker network inspect a3m-network >/dev/null 2>&1; then
     docker network create a3m-network
 fi
 
-# Start a3md container
-if [ "$(docker ps -aq -f name=a3md)" ]; then
-    # Start the existing container
-    docker start a3md
-else
-    # Start a new a3md container
-    docker run -d --name a3md --user 1000 -v "$PROCESSING_DIRECTORY:$PROCESSING_DIRECTORY" --network a3m-network -p 7000:7000 --restart on-failure -e A3M_DEBUG=yes "$A3M_DOCKER_IMAGE"
-fi
+# Start a3md containers
+for index in $(seq 1 "$A3MD_COUNT"); do
+    if [ "$index" -eq 1 ]; then
+        name=a3md
+        # Only the first daemon is published on the host, clients reach the others over a3m-network
+        ports="-p 7000:7000"
+    else
+        name="a3md-$index"
+        ports=""
+    fi
+    if [ "$(docker ps -aq -f name=^${name}$)" ]; then
+        # Start the existing container
+        docker start "$name"
+    else
+        # Start a new a3md container
+        docker run -d --name "$name" --user 1000 "${mounts[@]}" --network a3m-network $ports --restart on-failure -e A3M_DEBUG=yes "$A3M_DOCKER_IMAGE"
+    fi
+done
@@ -0,0 +1,20 @@
+import pytest
+
+import db.models
+import preservation.database
+from preservation.database import DatabaseManager
+
+
+@pytest.fixture
+def db_manager(tmp_path, monkeypatch) -> DatabaseManager:
+    """
+    A DatabaseManager on an empty preservation database of its own.
+    """
+    path = str(tmp_path / 'preservation.db')
+    monkeypatch.setattr(db.models, 'DB_PATH', path)
+    monkeypatch.setattr(preservation.database, 'DB_PATH', path)
+    # The per-thread connection would still point at the previous database
+    monkeypatch.setattr(db.models._local, 'conn', None, raising=False)
+    yield DatabaseManager()
+    if db.models._local.conn is not None:
+        db.models._local.conn.close()
@@ -0,0 +1,94 @@
+import pytest
+
+from preservation.aip_index import read_mets
+
+AMD_SECS = '''
+  <mets:amdSec ID="amdSec_1">
+    <mets:techMD ID="techMD_1">
+      <mets:mdWrap MDTYPE="PREMIS:OBJECT">
+        <mets:xmlData>
+          <premis:object>
+            <premis:objectIdentifier><premis:objectIdentifierValue>uuid-report</premis:objectIdentifierValue></premis:objectIdentifier>
+            <premis:objectCharacteristics>
+              <premis:fixity>
+                <premis:messageDigestAlgorithm>sha256</premis:messageDigestAlgorithm>
+                <premis:messageDigest>aaa</premis:messageDigest>
+              </premis:fixity>
+              <premis:size>1024</premis:size>
+              <premis:format>
+                <premis:formatDesignation><premis:formatName>PDF</premis:formatName></premis:formatDesignation>
+                <premis:formatRegistry><premis:formatRegistryKey>fmt/276</premis:formatRegistryKey></premis:formatRegistry>
+              </premis:format>
+            </premis:objectCharacteristics>
+            <premis:originalName>%transferDirectory%objects/report.pdf</premis:originalName>
+          </premis:object>
+        </mets:xmlData>
+      </mets:mdWrap>
+    </mets:techMD>
+    <mets:rightsMD ID="rightsMD_1">
+      <mets:mdWrap MDTYPE="PREMIS:RIGHTS">
+        <mets:xmlData><premis:object><premis:originalName>ignored</premis:originalName></premis:object></mets:xmlData>
+      </mets:mdWrap>
+    </mets:rightsMD>
+  </mets:amdSec>
+  <mets:amdSec ID="amdSec_2">
+    <mets:techMD ID="techMD_2">
+      <mets:mdWrap MDTYPE="PREMIS:OBJECT">
+        <mets:xmlData>
+          <premis:object>
+            <premis:objectIdentifier><premis:objectIdentifierValue>uuid-photo</premis:objectIdentifierValue></premis:objectIdentifier>
+            <premis:objectCharacteristics>
+              <premis:size>2048</premis:size>
+            </premis:objectCharacteristics>
+            <premis:originalName>%transferDirectory%objects/photo.jpg</premis:originalName>
+          </premis:object>
+        </mets:xmlData>
+      </mets:mdWrap>
+    </mets:techMD>
+  </mets:amdSec>
+'''
+
+FILE_SEC = '''
+  <mets:fileSec>
+    <mets:fileGrp USE="original">
+      <mets:file ID="file-report" ADMID="amdSec_1">
+        <mets:FLocat xlink:href="objects/report.pdf" LOCTYPE="OTHER"/>
+      </mets:file>
+      <mets:file ID="file-photo" ADMID="amdSec_2">
+        <mets:FLocat xlink:href="objects/photo.jpg" LOCTYPE="OTHER"/>
+      </mets:file>
+      <mets:file ID="file-orphan" ADMID="amdSec_3">
+        <mets:FLocat xlink:href="objects/orphan.txt" LOCTYPE="OTHER"/>
+      </mets:file>
+    </mets:fileGrp>
+  </mets:fileSec>
+'''
+
+def write_mets(path, *sections: str):
+    path.write_text(
+        '<mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:premis="http://www.loc.gov/premis/v3" '
+        'xmlns:xlink="http://www.w3.org/1999/xlink">' + ''.join(sections) + '</mets:mets>'
+    )
+    return path
+
+
+@pytest.mark.parametrize('amd_secs_first', [True, False], ids=['amdSecs first', 'fileSec first'])
+def test_read_mets_joins_files_to_their_premis_object(tmp_path, amd_secs_first):
+    sections = (AMD_SECS, FILE_SEC) if amd_secs_first else (FILE_SEC, AMD_SECS)
+    mets_path = write_mets(tmp_path / 'METS.xml', *sections)
+
+    files = {entry['path']: entry for entry in read_mets(mets_path)}
+
+    assert sorted(files) == ['objects/orphan.txt', 'objects/photo.jpg', 'objects/report.pdf']
+    report = files['objects/report.pdf']
+    assert report['name'] == 'report.pdf'
+    assert report['use'] == 'original'
+    assert report['file_uuid'] == 'uuid-report'
+    assert report['original_name'] == 'objects/report.pdf'
+    assert report['size'] == 1024
+    assert (report['checksum'], report['checksum_type']) == ('aaa', 'sha256')
+    assert (report['puid'], report['format_name']) == ('fmt/276', 'PDF')
+    assert files['objects/photo.jpg']['file_uuid'] == 'uuid-photo'
+    assert files['objects/photo.jpg']['size'] == 2048
+    # A file whose amdSec never turns up is still read, without characteristics
+    assert 'file_uuid' not in files['objects/orphan.txt']
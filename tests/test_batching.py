@@ -0,0 +1,76 @@
+import sqlite3
+
+from db.models.job_model import JOB_PRIORITIES
+from preservation.batching import ATOM_SLUG_KEY, plan_batches
+
+
+def queue(db_manager, user: str, config_id: int = 1) -> int:
+    node = {'Uuid': f'{user}-node', 'Path': f'/personal/{user}/file', 'Size': 1024, 'Type': 'LEAF'}
+    return db_manager.create_job(node['Uuid'], node['Path'], user, config_id, node=node, priority=JOB_PRIORITIES['normal'])
+
+def add_config(db_manager) -> int:
+    with sqlite3.connect(db_manager.db_file) as conn:
+        return conn.execute("INSERT INTO preservation_configs (name, user) VALUES ('Other', 'admin')").lastrowid
+
+
+def node(name: str, size: int = 1024, **fields) -> dict:
+    return {'Uuid': name, 'Path': f'/personal/admin/{name}', 'Size': size, 'Type': 'LEAF', **fields}
+
+def names(nodes: list) -> list:
+    return [node['Uuid'] for node in nodes]
+
+
+def test_plan_batches_caps_nodes_per_batch():
+    nodes = [node(f'file-{index}') for index in range(7)]
+
+    batches, singles = plan_batches(nodes, max_file_bytes=4096, max_nodes=3)
+
+    assert [names(batch) for batch in batches] == [['file-0', 'file-1', 'file-2'], ['file-3', 'file-4', 'file-5']]
+    # A batch of one is preserved on its own
+    assert names(singles) == ['file-6']
+
+def test_plan_batches_leaves_large_files_on_their_own():
+    nodes = [node('small-0'), node('large', size=8192), node('small-1'), node('limit', size=4096)]
+
+    batches, singles = plan_batches(nodes, max_file_bytes=4096, max_nodes=10)
+
+    assert [names(batch) for batch in batches] == [['small-0', 'small-1', 'limit']]
+    assert names(singles) == ['large']
+
+def test_plan_batches_leaves_mixed_nodes_on_their_own():
+    nodes = [
+        node('file-0'),
+        node('folder', Type='COLLECTION'),
+        node('linked', MetaStore={ATOM_SLUG_KEY: 'a-description'}),
+        node('part', SplitPart={'index': 1}),
+        node('file-1'),
+    ]
+
+    batches, singles = plan_batches(nodes, max_file_bytes=4096, max_nodes=10)
+
+    assert [names(batch) for batch in batches] == [['file-0', 'file-1']]
+    assert names(singles) == ['folder', 'linked', 'part']
+
+def test_plan_batches_disabled_by_config():
+    nodes = [node(f'file-{index}') for index in range(3)]
+
+    batches, singles = plan_batches(nodes, max_file_bytes=0, max_nodes=10)
+
+    assert batches == []
+    assert names(singles) == names(nodes)
+
+def test_claim_batch_jobs_only_batches_the_same_user_and_config(db_manager):
+    other_config = add_config(db_manager)
+    lead = queue(db_manager, 'alice')
+    same = queue(db_manager, 'alice')
+    queue(db_manager, 'alice', config_id=other_config)
+    queue(db_manager, 'bob')
+    db_manager.create_job('large', '/personal/alice/large', 'alice', 1, node=node('large', size=8192))
+    also_same = queue(db_manager, 'alice')
+
+    job = db_manager.claim_next_job('worker')
+    batch = db_manager.claim_batch_jobs(job, 10, 4096)
+
+    assert job['id'] == lead
+    assert [batch_job['id'] for batch_job in batch] == [same, also_same]
+    assert all(batch_job['lease_owner'] == 'worker' for batch_job in batch)
@@ -0,0 +1,48 @@
+import pytest
+
+from db.models.job_model import _solve, fit_stage
+
+MB = 1024 ** 2
+
+
+def test_solve_returns_the_solution():
+    assert _solve([[2.0, 1.0], [1.0, 3.0]], [5.0, 10.0]) == pytest.approx([1.0, 3.0])
+
+def test_solve_pivots_past_a_zero_on_the_diagonal():
+    assert _solve([[0.0, 1.0], [1.0, 0.0]], [2.0, 3.0]) == pytest.approx([3.0, 2.0])
+
+def test_solve_returns_none_for_a_singular_system():
+    assert _solve([[1.0, 2.0], [2.0, 4.0]], [3.0, 6.0]) is None
+    assert _solve([[0.0, 0.0], [0.0, 0.0]], [0.0, 0.0]) is None
+
+
+def test_fit_stage_without_samples():
+    assert fit_stage([]) is None
+
+def test_fit_stage_with_a_single_sample_predicts_its_duration():
+    predict = fit_stage([(10 * MB, 4, 12.0)])
+
+    assert predict(10 * MB, 4) == pytest.approx(12.0)
+    assert predict(1000 * MB, 400) == pytest.approx(12.0)
+
+def test_fit_stage_with_identical_sizes_predicts_their_mean():
+    predict = fit_stage([(50 * MB, 10, duration) for duration in (8.0, 10.0, 12.0, 10.0)])
+
+    assert predict(50 * MB, 10) == pytest.approx(10.0, rel=0.01)
+
+def test_fit_stage_learns_cost_per_mb_and_per_file():
+    # 2 s overhead, 0.5 s per MB and 0.1 s per file
+    samples = [
+        (size * MB, files, 2 + 0.5 * size + 0.1 * files)
+        for size, files in ((10, 5), (40, 20), (100, 10), (5, 200), (70, 70), (20, 100))
+    ]
+    predict = fit_stage(samples)
+
+    assert predict(60 * MB, 30) == pytest.approx(2 + 0.5 * 60 + 0.1 * 30, rel=0.01)
+
+def test_fit_stage_falls_back_to_the_mean_on_a_negative_cost():
+    # Bigger packages finishing sooner would predict negative durations for large ones
+    samples = [(size * MB, 1, 100.0 - size) for size in (10, 20, 30, 40, 50)]
+    predict = fit_stage(samples)
+
+    assert predict(500 * MB, 1) == pytest.approx(70.0)
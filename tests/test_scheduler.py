@@ -0,0 +1,117 @@
+import sqlite3
+
+from config import SCHEDULER_MAX_WAIT_SECONDS
+from db.models.job_model import JOB_PRIORITIES
+
+
+def queue(db_manager, user: str, priority: str = 'normal', config_id: int = 1) -> int:
+    node = {'Uuid': f'{user}-node', 'Path': f'/personal/{user}/file', 'Size': 1024, 'Type': 'LEAF'}
+    return db_manager.create_job(node['Uuid'], node['Path'], user, config_id, node=node, priority=JOB_PRIORITIES[priority])
+
+def execute(db_manager, sql: str, params: tuple = ()):
+    with sqlite3.connect(db_manager.db_file) as conn:
+        conn.execute(sql, params)
+
+def add_config(db_manager, max_concurrent_jobs: int) -> int:
+    with sqlite3.connect(db_manager.db_file) as conn:
+        return conn.execute(
+            "INSERT INTO preservation_configs (name, user, max_concurrent_jobs) VALUES ('Capped', 'admin', ?)",
+            (max_concurrent_jobs,)
+        ).lastrowid
+
+
+def test_claims_higher_priority_first(db_manager):
+    low = queue(db_manager, 'alice', 'low')
+    normal = queue(db_manager, 'bob', 'normal')
+    high = queue(db_manager, 'carol', 'high')
+
+    assert [db_manager.claim_next_job('worker')['id'] for _ in range(3)] == [high, normal, low]
+    assert db_manager.claim_next_job('worker') is None
+
+def test_users_take_turns_at_the_same_priority(db_manager):
+    alice = [queue(db_manager, 'alice') for _ in range(3)]
+    bob = queue(db_manager, 'bob')
+
+    claimed = [db_manager.claim_next_job('worker')['id'] for _ in range(4)]
+
+    # Bob queued after all of Alice's jobs but goes second, as Alice already has one running
+    assert claimed == [alice[0], bob, alice[1], alice[2]]
+
+def test_fewest_running_jobs_beats_waiting_longest(db_manager):
+    alice = [queue(db_manager, 'alice') for _ in range(2)]
+    bob = [queue(db_manager, 'bob') for _ in range(2)]
+    db_manager.claim_next_job('worker')
+    db_manager.claim_next_job('worker')
+    db_manager.finish_job(bob[0], 'completed')
+
+    # Alice's job has waited longer, but she still has one running and Bob has none
+    assert db_manager.claim_next_job('worker')['id'] == bob[1]
+    assert db_manager.claim_next_job('worker')['id'] == alice[1]
+
+def test_higher_priority_beats_fair_share(db_manager):
+    queue(db_manager, 'alice')
+    db_manager.claim_next_job('worker')
+    urgent = queue(db_manager, 'alice', 'high')
+    queue(db_manager, 'bob')
+
+    assert db_manager.claim_next_job('worker')['id'] == urgent
+
+def test_passes_over_configs_at_their_cap(db_manager):
+    capped = add_config(db_manager, max_concurrent_jobs=1)
+    first = queue(db_manager, 'alice', 'high', config_id=capped)
+    second = queue(db_manager, 'alice', 'high', config_id=capped)
+    other = queue(db_manager, 'bob', 'low')
+
+    assert db_manager.claim_next_job('worker')['id'] == first
+    # The capped config's second job outranks the other, but has to wait for the first to finish
+    assert db_manager.claim_next_job('worker')['id'] == other
+    assert db_manager.claim_next_job('worker') is None
+
+    db_manager.finish_job(first, 'completed')
+    assert db_manager.claim_next_job('worker')['id'] == second
+
+def test_claims_starved_jobs_first(db_manager):
+    starved = queue(db_manager, 'alice', 'low')
+    queue(db_manager, 'bob', 'high')
+    execute(db_manager, "UPDATE preservation_jobs SET created = datetime('now', ?) WHERE id = ?",
+            (f'-{SCHEDULER_MAX_WAIT_SECONDS + 60} seconds', starved))
+
+    assert db_manager.claim_next_job('worker')['id'] == starved
+
+def test_claim_leases_the_job(db_manager):
+    job_id = queue(db_manager, 'alice')
+
+    job = db_manager.claim_next_job('worker')
+
+    assert job['id'] == job_id
+    assert job['status'] == 'running'
+    assert job['lease_owner'] == 'worker'
+    assert job['attempts'] == 1
+    assert job['node']['Uuid'] == 'alice-node'
+
+def test_requeues_jobs_whose_lease_expired(db_manager):
+    job_id = queue(db_manager, 'alice')
+    db_manager.claim_next_job('crashed')
+    execute(db_manager, "UPDATE preservation_jobs SET lease_expires = 0 WHERE id = ?", (job_id,))
+
+    job = db_manager.claim_next_job('worker')
+
+    assert job['id'] == job_id
+    assert job['lease_owner'] == 'worker'
+    assert job['attempts'] == 2
+
+def test_requeued_job_waits_out_its_delay(db_manager):
+    deferred = queue(db_manager, 'alice', 'high')
+    db_manager.claim_next_job('worker')
+    db_manager.requeue_jobs([deferred], 'worker', delay=60)
+    other = queue(db_manager, 'bob', 'low')
+
+    assert db_manager.claim_next_job('worker')['id'] == other
+    assert db_manager.claim_next_job('worker') is None
+
+    execute(db_manager, "UPDATE preservation_jobs SET not_before = 0 WHERE id = ?", (deferred,))
+    job = db_manager.claim_next_job('worker')
+    assert job['id'] == deferred
+    # Going back in the queue isn't counted as a failed attempt
+    assert job['attempts'] == 1
+
@@ -0,0 +1,46 @@
+import sqlite3
+
+from config import SCHEDULER_INTERACTIVE_MAX_NODES
+from db.models.job_model import JOB_PRIORITIES
+from preservation.submission import Submission
+
+
+def node(index: int) -> dict:
+    return {'Uuid': f'node-{index}', 'Path': f'/personal/admin/file-{index}', 'Size': 1024, 'Type': 'LEAF'}
+
+def priorities(db_manager) -> list:
+    with sqlite3.connect(db_manager.db_file) as conn:
+        return [row[0] for row in conn.execute('SELECT priority FROM preservation_jobs ORDER BY id')]
+
+
+def test_small_submission_is_held_back_and_queued_as_high(db_manager):
+    submission = Submission('admin', 1)
+
+    assert submission.add([node(index) for index in range(SCHEDULER_INTERACTIVE_MAX_NODES)]) == []
+    assert priorities(db_manager) == []
+
+    queued = submission.finish()
+
+    assert [queued_node['Uuid'] for _, queued_node in queued] == [f'node-{index}' for index in range(SCHEDULER_INTERACTIVE_MAX_NODES)]
+    assert submission.job_ids == [job_id for job_id, _ in queued]
+    assert priorities(db_manager) == [JOB_PRIORITIES['high']] * SCHEDULER_INTERACTIVE_MAX_NODES
+
+def test_large_submission_is_queued_as_normal_once_it_outgrows_interactive(db_manager):
+    submission = Submission('admin', 1)
+
+    held = [submission.add([node(index)]) for index in range(SCHEDULER_INTERACTIVE_MAX_NODES)]
+    queued = submission.add([node(SCHEDULER_INTERACTIVE_MAX_NODES)])
+
+    assert held == [[]] * SCHEDULER_INTERACTIVE_MAX_NODES
+    # The held back nodes go first, in the order they were read
+    assert [queued_node['Uuid'] for _, queued_node in queued] == [f'node-{index}' for index in range(SCHEDULER_INTERACTIVE_MAX_NODES + 1)]
+    assert len(submission.add([node(100)])) == 1
+    assert submission.finish() == []
+    assert priorities(db_manager) == [JOB_PRIORITIES['normal']] * (SCHEDULER_INTERACTIVE_MAX_NODES + 2)
+
+def test_explicit_priority_queues_at_once(db_manager):
+    submission = Submission('admin', 1, priority='low')
+
+    assert len(submission.add([node(0)])) == 1
+    assert submission.finish() == []
+    assert priorities(db_manager) == [JOB_PRIORITIES['low']]
@@ -0,0 +1,64 @@
+import pytest
+import requests
+from fastapi import FastAPI
+
+import api.routes.worker_routes as worker_routes
+import preservation.worker_api as worker_api
+from preservation.database import LeaseLost
+from preservation.worker_api import RemoteDatabaseManager
+from simulation.loadtest import UvicornServer
+
+TOKEN = 'worker-secret'
+
+
+@pytest.fixture(scope='module')
+def server():
+    app = FastAPI()
+    app.include_router(worker_routes.router, prefix='/workers')
+    server = UvicornServer(app).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def remote(db_manager, server, monkeypatch) -> RemoteDatabaseManager:
+    """
+    The job database of db_manager as a worker on another host sees it.
+    """
+    monkeypatch.setattr(worker_routes, 'WORKER_API_TOKEN', TOKEN)
+    # Answered by a DatabaseManager on this test's database
+    monkeypatch.setattr(worker_routes, '_targets', {})
+    monkeypatch.setattr(worker_api, 'WORKER_API_URL', server.url)
+    monkeypatch.setattr(worker_api, 'WORKER_API_TOKEN', TOKEN)
+    return RemoteDatabaseManager()
+
+def node(name: str) -> dict:
+    return {'Uuid': name, 'Path': f'/personal/admin/{name}', 'Size': 1024, 'Type': 'LEAF'}
+
+
+def test_remote_workers_claim_renew_and_finish_through_the_api(db_manager, remote):
+    job_id = db_manager.create_job('a', '/personal/admin/a', 'admin', 1, node=node('a'))
+
+    job = remote.claim_next_job('other-host:1')
+
+    assert job['id'] == job_id
+    assert job['node'] == node('a')
+    assert remote.claim_next_job('other-host:2') is None
+    assert remote.renew_leases([job_id], 'other-host:1') == []
+    assert remote.get_cancel_requests([job_id]) == set()
+    remote.finish_job(job_id, 'completed', owner='other-host:1')
+    assert db_manager.is_job_queued(job_id) is False
+
+def test_lost_lease_is_raised_on_the_remote_worker(db_manager, remote):
+    job_id = db_manager.create_job('a', '/personal/admin/a', 'admin', 1, node=node('a'))
+    db_manager.claim_next_job('api-host:1')
+
+    with pytest.raises(LeaseLost):
+        remote.update_job(job_id, owner='other-host:1', stage='stolen')
+
+def test_worker_calls_need_the_token_and_a_listed_method(remote, server):
+    call = {'args': [], 'kwargs': {}}
+    headers = {'Authorization': f'Bearer {TOKEN}'}
+
+    assert requests.post(f'{server.url}/workers/jobs/get_running_aip_uuids', json=call).status_code == 403
+    assert requests.post(f'{server.url}/workers/jobs/_check_owned', json=call, headers=headers).status_code == 404
+    assert requests.post(f'{server.url}/workers/jobs/get_running_aip_uuids', json=call, headers=headers).json() == {'result': []}
@@ -0,0 +1,54 @@
+import argparse
+import multiprocessing
+import signal
+
+from preservation import logs, metrics
+from preservation.worker import PreservationWorker
+
+logger = logs.configure("preservation", 'preservation.log', text_format="%(asctime)s %(process)d %(filename)s:%(lineno)d %(levelname)s %(message)s")
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Curate Preservation Worker')
+    parser.add_argument('-p', '--processes', help='Number of worker processes claiming jobs on this host', type=int, default=1)
+    args = parser.parse_args()
+    return args
+
+
+def run_worker():
+    worker = PreservationWorker()
+    metrics.start_flusher()
+    # Stop between jobs, a running preservation is allowed to finish
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+
+def run_worker_process():
+    try:
+        run_worker()
+    finally:
+        # Worker processes exit without running atexit, so queued log records are written here
+        logs.stop()
+
+def main():
+    args = parse_arguments()
+    if args.processes <= 1:
+        run_worker()
+        return
+    # Each process leases its own jobs from the shared queue
+    processes = [multiprocessing.Process(target=run_worker_process, name=f'worker-{index}') for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    signal.signal(signal.SIGTERM, stop)
+    # Ctrl+C already reaches every process in the foreground group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':
+    logger.info(' =============== WORKER STARTED =============== ')
+    main()
+    logger.info(' =============== WORKER STOPPED =============== \n')